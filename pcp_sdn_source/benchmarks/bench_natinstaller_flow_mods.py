@@ -0,0 +1,134 @@
+"""
+This benchmark measures the throughput of building and serializing flow
+modifications that install NAT flow entries.
+
+`NatInstaller`, which copies a flow modification serialized once per address
+family, protocol and translation direction and writes only the IP addresses,
+ports, cookie and idle timeout into it, is compared against building the match
+fields, actions and instructions of every `OFPFlowMod` from keyword arguments.
+
+Run from the `pcp_sdn_source` directory:
+
+  python benchmarks/bench_natinstaller_flow_mods.py [number of mappings]
+"""
+
+#===============================================================================
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from pcp_sdn.nat import natinstaller
+from pcp_sdn.nat import nattable
+
+#===============================================================================
+
+
+class _NullForwarder(object):
+  
+  """
+  Forwarder serializing messages the way `ryu.controller.controller.Datapath`
+  does, without sending them.
+  """
+  
+  ofproto = ofproto_v1_3
+  ofproto_parser = ofproto_v1_3_parser
+  
+  def __init__(self):
+    self.id = 1
+    self.xid = 0
+  
+  def send_msg(self, msg):
+    self.xid += 1
+    msg.set_xid(self.xid)
+    msg.serialize()
+
+
+def _legacy_install_nat_entry(nat_installer, nat_table_entry, priority=1):
+  """
+  Install the NAT flow entries the way the previous installer did, building the
+  `OFPFlowMod` from keyword arguments for each translation direction.
+  """
+  
+  forwarder = nat_installer._forwarder
+  ofproto = forwarder.ofproto
+  parser = forwarder.ofproto_parser
+  
+  for translation_direction, direction_suffix, matched_prefix, translated_prefix in [
+      (natinstaller.NatTranslationDirection.INTERNAL_TO_EXTERNAL, 'src', 'internal', 'external'),
+      (natinstaller.NatTranslationDirection.EXTERNAL_TO_INTERNAL, 'dst', 'external', 'internal')]:
+    ip_field_name = natinstaller.MATCH_FIELD_NAME_MAPS[
+      'ip_' + direction_suffix][nat_table_entry.address_family]
+    port_field_name = natinstaller.MATCH_FIELD_NAME_MAPS[
+      'port_' + direction_suffix][nat_table_entry.protocol]
+    
+    match_data = {
+      'eth_type': nat_table_entry.address_family,
+      'ip_proto': nat_table_entry.protocol,
+      ip_field_name: getattr(nat_table_entry, matched_prefix + '_ip'),
+      port_field_name: getattr(nat_table_entry, matched_prefix + '_port'),
+    }
+    action_set_data = {
+      ip_field_name: getattr(nat_table_entry, translated_prefix + '_ip'),
+      port_field_name: getattr(nat_table_entry, translated_prefix + '_port'),
+    }
+    
+    actions = [parser.OFPActionSetField(**{field_name: field_value})
+               for field_name, field_value in action_set_data.items()]
+    instructions = [
+      parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions),
+      parser.OFPInstructionGotoTable(nat_installer._next_table_id)
+    ]
+    forwarder.send_msg(parser.OFPFlowMod(forwarder, command=ofproto.OFPFC_ADD,
+      match=parser.OFPMatch(**match_data), instructions=instructions,
+      table_id=nat_installer._get_table_id(translation_direction),
+      idle_timeout=nat_table_entry.lifetime, priority=priority,
+      cookie=nat_installer._get_cookie(nat_table_entry, translation_direction),
+      flags=ofproto.OFPFF_SEND_FLOW_REM))
+
+
+def _install_nat_entry(nat_installer, nat_table_entry):
+  nat_installer.install_nat_entry(nat_table_entry, 1)
+
+
+def bench_build_flow_mods(num_mappings):
+  nat_table_entries = [
+    nattable.NatTableEntry(nattable.AddressFamily.IPv4,
+      nattable.IpUpperProtocol.TCP if i % 2 else nattable.IpUpperProtocol.UDP,
+      "172.16.{0}.{1}".format(i // 250 % 256, i % 250 + 2), 1024 + i % 1000,
+      "200.0.0.{0}".format(i % 250 + 1), 1024 + i % 60000, 3600)
+    for i in range(num_mappings)]
+  
+  for name, install_func in [('keyword args', _legacy_install_nat_entry),
+                             ('template', _install_nat_entry)]:
+    nat_installer = natinstaller.NatInstaller(
+      _NullForwarder(), 2, [1, 2, 3], 4,
+      refresh_mode=natinstaller.NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE)
+    
+    start = timeit.default_timer()
+    for nat_table_entry in nat_table_entries:
+      install_func(nat_installer, nat_table_entry)
+    elapsed = timeit.default_timer() - start
+    
+    print("  {0:>13}: {1:10.0f} flow modifications per second".format(
+      name, 2 * num_mappings / elapsed))
+
+
+def main():
+  num_mappings = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  
+  print("Mappings: {0} (two flow modifications each)".format(num_mappings))
+  bench_build_flow_mods(num_mappings)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,90 @@
+"""
+This benchmark measures the latency of allocating external ports in the NAT
+table as the port pool of a single external IP address fills up, for both
+round-robin and random port allocation.
+
+Run from the `pcp_sdn_source` directory:
+
+  python benchmarks/bench_nattable_allocation.py
+"""
+
+#===============================================================================
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+from pcp_sdn.nat import nattable
+
+#===============================================================================
+
+_NUM_FILL_STEPS = 10
+
+
+def _create_table(port_allocation_type):
+  pool_config = dict(app_config.app_config['default_nat_pool_config'])
+  pool_config['external_ip_high_end'] = pool_config['external_ip_low_end']
+  pool_config['port_allocation_type'] = port_allocation_type
+  
+  return nattable.NatTable(**pool_config), pool_config
+
+
+def bench_allocation_latency(port_allocation_type):
+  """
+  Fill the port pool and print the mean allocation latency for each 10% of
+  the pool filled.
+  """
+  
+  table, pool_config = _create_table(port_allocation_type)
+  num_ports = pool_config['external_port_high_end'] - pool_config['external_port_low_end'] + 1
+  step_size = num_ports // _NUM_FILL_STEPS
+  
+  internal_port = 1
+  for step in range(_NUM_FILL_STEPS):
+    start = timeit.default_timer()
+    for unused_ in range(step_size):
+      table.add_entry("172.16.0.2", internal_port, 3600)
+      internal_port += 1
+    elapsed = timeit.default_timer() - start
+    
+    print("  {0:>3}% - {1:>3}% full: {2:8.3f} us per allocation".format(
+      step * 100 // _NUM_FILL_STEPS, (step + 1) * 100 // _NUM_FILL_STEPS,
+      elapsed / step_size * 1e6))
+  
+  return table, internal_port - 1
+
+
+def bench_churn_latency(table, num_entries, num_operations=20000):
+  """
+  Remove and add entries in a pool that is nearly full, printing the mean
+  latency of one remove + add pair.
+  """
+  
+  start = timeit.default_timer()
+  for i in range(num_operations):
+    internal_port = (i % num_entries) + 1
+    table.remove_entry("172.16.0.2", internal_port)
+    table.add_entry("172.16.0.2", internal_port, 3600)
+  elapsed = timeit.default_timer() - start
+  
+  print("  churn at {0}% full: {1:8.3f} us per remove + add".format(
+    _NUM_FILL_STEPS * 10, elapsed / num_operations * 1e6))
+
+
+def main():
+  for name, port_allocation_type in [
+      ('ROUND_ROBIN', nattable.NatTableAllocationType.ROUND_ROBIN),
+      ('RANDOM', nattable.NatTableAllocationType.RANDOM)]:
+    print("Port allocation type: {0}".format(name))
+    table, num_entries = bench_allocation_latency(port_allocation_type)
+    bench_churn_latency(table, num_entries)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,86 @@
+"""
+This benchmark measures the throughput of adding NAT table entries from 1 to N
+concurrent writer threads.
+
+A `NatTable` guarded by one global lock is compared against
+`ShardedNatTable`, which has one lock per shard. Each writer thread adds
+entries for its own internal IP addresses.
+
+Under CPython, the GIL serializes the execution of Python code, so the
+benchmark shows the overhead of lock contention rather than parallel speedup.
+
+Run from the `pcp_sdn_source` directory:
+  
+  python benchmarks/bench_nattable_concurrent_writers.py [max. number of threads] [entries per thread]
+"""
+
+#===============================================================================
+
+import os
+import sys
+import threading
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+from pcp_sdn.nat import nattable
+from pcp_sdn.nat import shardednattable
+
+#===============================================================================
+
+
+class _GloballyLockedNatTable(object):
+  
+  def __init__(self):
+    self._table = nattable.NatTable()
+    self._lock = threading.Lock()
+  
+  def add_entry(self, *args, **kwargs):
+    with self._lock:
+      return self._table.add_entry(*args, **kwargs)
+
+
+def _add_entries(table, thread_index, num_entries):
+  for i in range(num_entries):
+    table.add_entry("172.{0}.{1}.{2}".format(16 + thread_index, i // 250, i % 250 + 2), 1024, 3600)
+
+
+def _run_writers(table, num_threads, num_entries_per_thread):
+  threads = [threading.Thread(target=_add_entries, args=(table, thread_index, num_entries_per_thread))
+             for thread_index in range(num_threads)]
+  
+  start = timeit.default_timer()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  
+  return timeit.default_timer() - start
+
+
+def bench_concurrent_writers(max_num_threads, num_entries_per_thread):
+  for num_threads in range(1, max_num_threads + 1):
+    print("Writer threads: {0}".format(num_threads))
+    
+    for name, table_factory in [
+          ('global lock', _GloballyLockedNatTable),
+          ('sharded', lambda: shardednattable.ShardedNatTable(max_num_threads))]:
+      elapsed = _run_writers(table_factory(), num_threads, num_entries_per_thread)
+      
+      print("  {0:>13}: {1:10.0f} entries per second".format(
+        name, num_threads * num_entries_per_thread / elapsed))
+
+
+def main():
+  max_num_threads = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+  num_entries_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+  
+  bench_concurrent_writers(max_num_threads, num_entries_per_thread)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,122 @@
+"""
+This benchmark measures the memory used per mapping in the NAT table, comparing
+the current `NatTableEntry` with an equivalent entry class backed by `__dict__`.
+
+The memory is computed from the sizes of the entries, their attribute values
+and both table indexes (`sys.getsizeof`). Attribute values shared between
+entries (e.g. external IP addresses) are counted once.
+
+Run from the `pcp_sdn_source` directory:
+
+  python benchmarks/bench_nattable_memory.py [number of mappings ...]
+
+The default numbers of mappings are 100000, 1000000 and 5000000.
+"""
+
+#===============================================================================
+
+import gc
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+from pcp_sdn.nat import nattable
+
+#===============================================================================
+
+_DEFAULT_NUMS_MAPPINGS = [100000, 1000000, 5000000]
+
+
+class _DictNatTableEntry(object):
+  
+  def __init__(self, address_family, protocol, internal_ip, internal_port,
+               external_ip, external_port, lifetime, expiry_time=None):
+    self._address_family = address_family
+    self._protocol = protocol
+    self._internal_ip = internal_ip
+    self._internal_port = internal_port
+    self._external_ip = external_ip
+    self._external_port = external_port
+    self.lifetime = lifetime
+    self.expiry_time = expiry_time
+
+
+def _fill_table(num_mappings):
+  pool_config = dict(app_config.app_config['default_nat_pool_config'])
+  pool_config['internal_ip_low_end'] = "10.0.0.1"
+  pool_config['internal_ip_high_end'] = "10.255.255.254"
+  pool_config['external_ip_low_end'] = "200.0.0.1"
+  pool_config['external_ip_high_end'] = "200.255.255.254"
+  table = nattable.NatTable(**pool_config)
+  
+  internal_ip_base = nattable.ip_to_int("10.0.0.1")
+  for i in range(num_mappings):
+    # 100 mappings per subscriber
+    internal_ip_value = internal_ip_base + i // 100
+    internal_ip = "{0}.{1}.{2}.{3}".format(
+      internal_ip_value >> 24, (internal_ip_value >> 16) & 0xff,
+      (internal_ip_value >> 8) & 0xff, internal_ip_value & 0xff)
+    table.add_entry(internal_ip, 1024 + i % 100, 3600)
+  
+  return table
+
+
+def _get_table_size(table, entry_size_func):
+  counted_object_ids = set()
+  
+  def _getsizeof_once(object_):
+    if id(object_) in counted_object_ids:
+      return 0
+    counted_object_ids.add(id(object_))
+    return sys.getsizeof(object_)
+  
+  size = sys.getsizeof(table._table) + sys.getsizeof(table._table_external)
+  
+  for key, entry in table._table.items():
+    size += _getsizeof_once(key)
+    size += entry_size_func(entry)
+    for value in [entry.internal_ip, entry.internal_port, entry.external_ip,
+                  entry.external_port, entry.lifetime, entry.expiry_time]:
+      size += _getsizeof_once(value)
+  
+  for key in table._table_external:
+    size += _getsizeof_once(key)
+  
+  return size
+
+
+def _get_slots_entry_size(entry):
+  return sys.getsizeof(entry)
+
+
+def _get_dict_entry_size(entry):
+  dict_entry = _DictNatTableEntry(**entry.to_dict())
+  return sys.getsizeof(dict_entry) + sys.getsizeof(dict_entry.__dict__)
+
+
+def bench_memory(num_mappings):
+  table = _fill_table(num_mappings)
+  gc.collect()
+  
+  for name, entry_size_func in [('__slots__', _get_slots_entry_size),
+                                ('__dict__', _get_dict_entry_size)]:
+    size = _get_table_size(table, entry_size_func)
+    print("  {0:>9} entries: {1:8.1f} bytes per mapping ({2:.1f} MiB total)".format(
+      name, float(size) / num_mappings, size / 1024.0 / 1024.0))
+
+
+def main():
+  nums_mappings = [int(arg) for arg in sys.argv[1:]] or _DEFAULT_NUMS_MAPPINGS
+  
+  for num_mappings in nums_mappings:
+    print("Mappings: {0}".format(num_mappings))
+    bench_memory(num_mappings)
+
+
+if __name__ == '__main__':
+  main()
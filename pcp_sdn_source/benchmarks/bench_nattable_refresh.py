@@ -0,0 +1,74 @@
+"""
+This benchmark measures the throughput of refreshing the lifetime of NAT table
+entries, the most frequent mutation of the NAT table in steady state (PCP
+clients refresh their mappings periodically).
+
+The in-place refresh (`NatTable.update_entry_lifetime_by_key`) is compared
+against rebuilding the entry and rewriting both table indexes.
+
+Run from the `pcp_sdn_source` directory:
+
+  python benchmarks/bench_nattable_refresh.py [number of mappings] [number of refreshes]
+"""
+
+#===============================================================================
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+from pcp_sdn.nat import nattable
+
+#===============================================================================
+
+
+def _refresh_by_rebuilding_entry(table, key, lifetime):
+  entry = table.find_entry_by_key(key)
+  
+  entry_dict = entry.to_dict()
+  entry_dict['lifetime'] = lifetime
+  
+  new_entry = nattable.NatTableEntry(**entry_dict)
+  table._table[key] = new_entry
+  table._table_external[table._get_external_key(entry)] = new_entry
+  
+  return new_entry
+
+
+def _refresh_in_place(table, key, lifetime):
+  return table.update_entry_lifetime_by_key(key, lifetime)
+
+
+def bench_refresh(num_mappings, num_refreshes):
+  table = nattable.NatTable()
+  keys = []
+  for i in range(num_mappings):
+    entry = table.add_entry("172.16.{0}.{1}".format(i // 250, i % 250 + 2), 1024, 3600)
+    keys.append(table._get_key(entry))
+  
+  for name, refresh_func in [('rebuild entry', _refresh_by_rebuilding_entry),
+                             ('in place', _refresh_in_place)]:
+    start = timeit.default_timer()
+    for i in range(num_refreshes):
+      refresh_func(table, keys[i % num_mappings], 3600 + i % 2)
+    elapsed = timeit.default_timer() - start
+    
+    print("  {0:>13}: {1:10.0f} refreshes per second".format(name, num_refreshes / elapsed))
+
+
+def main():
+  num_mappings = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+  num_refreshes = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+  
+  print("Mappings: {0}, refreshes: {1}".format(num_mappings, num_refreshes))
+  bench_refresh(num_mappings, num_refreshes)
+
+
+if __name__ == '__main__':
+  main()
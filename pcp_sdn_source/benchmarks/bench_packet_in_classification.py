@@ -0,0 +1,118 @@
+"""
+This benchmark measures the throughput of classifying packet-in messages as
+PCP messages, ARP messages or other packets.
+
+Parsing every packet with `ryu.lib.packet.Packet` and querying the protocol list
+is compared against `packetclassifier.classify`, which reads fixed header
+offsets and parses only PCP and ARP messages. The PCP and ARP handlers
+themselves are not included.
+
+Run from the `pcp_sdn_source` directory:
+
+  python benchmarks/bench_packet_in_classification.py [number of packets] [PCP %] [ARP %]
+"""
+
+#===============================================================================
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+from ryu.lib import packet
+
+from pcp_sdn import arphandler
+from pcp_sdn import packetclassifier
+from pcp_sdn.pcp import pcpmessage
+
+#===============================================================================
+
+
+def _build_frame(*protocols):
+  packet_ = packet.packet.Packet()
+  for protocol in protocols:
+    packet_.add_protocol(protocol)
+  packet_.serialize()
+  return bytes(packet_.data)
+
+
+def _build_frames():
+  ethernet_ipv4 = packet.ethernet.ethernet(ethertype=0x0800)
+  
+  pcp_frame = _build_frame(ethernet_ipv4, packet.ipv4.ipv4(proto=17),
+    packet.udp.udp(src_port=5350, dst_port=5351), b"\x02\x01" + b"\x00" * 58)
+  arp_frame = _build_frame(packet.ethernet.ethernet(ethertype=0x0806),
+    packet.arp.arp_ip(packet.arp.ARP_REQUEST, "00:00:00:00:00:01", "172.16.0.2",
+                      "00:00:00:00:00:00", "172.16.0.1"))
+  other_frames = [
+    _build_frame(ethernet_ipv4, packet.ipv4.ipv4(proto=6),
+                 packet.tcp.tcp(src_port=40000, dst_port=80), b"\x00" * 512),
+    _build_frame(ethernet_ipv4, packet.ipv4.ipv4(proto=17),
+                 packet.udp.udp(src_port=40000, dst_port=53), b"\x00" * 64),
+    _build_frame(packet.ethernet.ethernet(ethertype=0x86dd), packet.ipv6.ipv6(nxt=17),
+                 packet.udp.udp(src_port=40000, dst_port=443), b"\x00" * 256),
+  ]
+  
+  return pcp_frame, arp_frame, other_frames
+
+
+def _classify_by_parsing(data):
+  packet_ = packet.packet.Packet(data)
+  
+  if pcpmessage.is_pcp(packet_):
+    return packet_
+  if arphandler.is_arp(packet_):
+    return packet_
+  
+  return None
+
+
+def _classify_by_offsets(data):
+  packet_class = packetclassifier.classify(data)
+  if packet_class == packetclassifier.PacketClass.OTHER:
+    return None
+  
+  return packet.packet.Packet(data)
+
+
+def bench_classification(num_packets, pcp_percentage, arp_percentage):
+  pcp_frame, arp_frame, other_frames = _build_frames()
+  
+  random_ = random.Random(0)
+  frames = []
+  for unused_ in range(num_packets):
+    value = random_.uniform(0, 100)
+    if value < pcp_percentage:
+      frames.append(pcp_frame)
+    elif value < pcp_percentage + arp_percentage:
+      frames.append(arp_frame)
+    else:
+      frames.append(random_.choice(other_frames))
+  
+  for name, classify_func in [('full parse', _classify_by_parsing),
+                              ('fixed offsets', _classify_by_offsets)]:
+    start = timeit.default_timer()
+    for frame in frames:
+      classify_func(frame)
+    elapsed = timeit.default_timer() - start
+    
+    print("  {0:>13}: {1:10.0f} packet-ins per second".format(name, num_packets / elapsed))
+
+
+def main():
+  num_packets = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  pcp_percentage = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+  arp_percentage = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+  
+  print("Packets: {0}, PCP: {1}%, ARP: {2}%".format(num_packets, pcp_percentage, arp_percentage))
+  bench_classification(num_packets, pcp_percentage, arp_percentage)
+
+
+if __name__ == '__main__':
+  main()
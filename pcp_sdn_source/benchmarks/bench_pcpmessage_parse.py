@@ -0,0 +1,121 @@
+"""
+This benchmark measures the throughput of parsing PCP requests.
+
+`PcpMessage.parse`, which unpacks fields at fixed offsets of a `memoryview`
+with precompiled structures and converts IP addresses lazily, is compared
+against the previous parser, which sliced the data repeatedly, unpacked fields
+with format strings and converted every IP address with `netaddr`.
+
+Run from the `pcp_sdn_source` directory:
+
+  python benchmarks/bench_pcpmessage_parse.py [number of requests]
+"""
+
+#===============================================================================
+
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcp_sdn import app_config
+
+app_config.init()
+
+import netaddr
+
+from pcp_sdn.pcp import pcpmessage
+
+#===============================================================================
+
+
+def _legacy_packed_str_to_ip_addr(ip_addr_packed):
+  int_bytes = struct.unpack("{0}B".format(len(ip_addr_packed)), ip_addr_packed)
+  
+  ip_addr_int = 0
+  for byte_ in int_bytes:
+    ip_addr_int <<= 8
+    ip_addr_int += byte_
+  
+  ip_addr = netaddr.IPAddress(ip_addr_int, version=6)
+  if ip_addr.is_ipv4_mapped():
+    ip_addr = ip_addr.ipv4()
+  
+  return str(ip_addr)
+
+
+def _legacy_parse_request(data, pcp_client_ip_address):
+  """
+  Parse a PCP MAP or PEER request the way the previous parser did. Validation
+  that does not depend on the parsing approach is omitted.
+  """
+  
+  fields = pcpmessage.PcpMessage()
+  
+  if len(data) < 2 or ord(data[1]) >> 7 != pcpmessage.PcpMessageTypes.REQUEST:
+    return None
+  
+  fields['version'] = ord(data[0])
+  
+  header = struct.unpack("!BHL", data[1:8])
+  fields['message_type'] = header[0] >> 7
+  fields['opcode'] = header[0] & 0x7f
+  fields['lifetime'] = header[2]
+  fields['pcp_client_ip'] = _legacy_packed_str_to_ip_addr(data[8:8+16])
+  address_mismatch = fields['pcp_client_ip'] != pcp_client_ip_address
+  
+  opcode_data = data[24:]
+  fields['mapping_nonce'] = opcode_data[:12].encode('hex')
+  fields['protocol'] = ord(opcode_data[12])
+  fields['internal_port'], fields['external_port'] = struct.unpack("!HH", opcode_data[16:20])
+  fields['external_ip'] = _legacy_packed_str_to_ip_addr(opcode_data[20:36])
+  
+  if fields['opcode'] == pcpmessage.PcpMessageOpcodes.PEER:
+    fields['remote_peer_port'] = struct.unpack("!H", opcode_data[36:38])[0]
+    fields['remote_peer_ip'] = _legacy_packed_str_to_ip_addr(opcode_data[40:56])
+  
+  return fields, address_mismatch
+
+
+def _parse_request(data, pcp_client_ip_address):
+  pcp_message = pcpmessage.PcpMessage.parse(data, pcp_client_ip_address)
+  # The PCP server always reads the internal IP address of the mapping.
+  pcp_message['pcp_client_ip']
+  return pcp_message
+
+
+def _build_request(opcode, pcp_client_ip):
+  pcp_request = pcpmessage.PcpMessage(
+    version=2, message_type=pcpmessage.PcpMessageTypes.REQUEST, opcode=opcode,
+    lifetime=300, pcp_client_ip=pcp_client_ip, mapping_nonce="0102030464ff8e110a090204",
+    protocol=17, internal_port=1250, external_port=5555, external_ip="200.0.0.1",
+    remote_peer_port=4444, remote_peer_ip="210.0.0.100")
+  return bytes(pcp_request.serialize())
+
+
+def bench_parse(num_requests):
+  pcp_client_ip = "172.16.1.1"
+  requests = [_build_request(pcpmessage.PcpMessageOpcodes.MAP, pcp_client_ip),
+              _build_request(pcpmessage.PcpMessageOpcodes.PEER, pcp_client_ip)]
+  
+  for name, parse_func in [('previous', _legacy_parse_request),
+                           ('memoryview', _parse_request)]:
+    start = timeit.default_timer()
+    for i in range(num_requests):
+      parse_func(requests[i % 2], pcp_client_ip)
+    elapsed = timeit.default_timer() - start
+    
+    print("  {0:>10}: {1:10.0f} requests per second".format(name, num_requests / elapsed))
+
+
+def main():
+  num_requests = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  
+  print("Requests: {0} (half MAP, half PEER)".format(num_requests))
+  bench_parse(num_requests)
+
+
+if __name__ == '__main__':
+  main()
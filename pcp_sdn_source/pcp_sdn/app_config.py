@@ -101,6 +101,44 @@ _FACTORY_DEFAULT_CONFIG['default_mac_modifying_flow_entries_priority'] = 1
 _FACTORY_DEFAULT_CONFIG['default_arp_forwarding_priority'] = 2
 _FACTORY_DEFAULT_CONFIG['default_pcp_forwarding_priority'] = 3
 
+_FACTORY_DEFAULT_CONFIG['mapping_expiry_check_interval_seconds'] = 1
+
+_FACTORY_DEFAULT_CONFIG['flow_mod_batch_max_size'] = 64
+_FACTORY_DEFAULT_CONFIG['flow_mod_batch_flush_interval_seconds'] = 0.01
+
+_FACTORY_DEFAULT_CONFIG['nat_flow_refresh_mode'] = 0    # NatFlowRefreshMode.REINSTALL
+_FACTORY_DEFAULT_CONFIG['nat_flow_refresh_tolerance_seconds'] = 60
+
+_FACTORY_DEFAULT_CONFIG['nat_pool_partitions'] = 1
+
+_FACTORY_DEFAULT_CONFIG['pcp_response_cache_max_size'] = 4096
+
+_FACTORY_DEFAULT_CONFIG['pcp_udp_listener_enabled'] = False
+_FACTORY_DEFAULT_CONFIG['pcp_udp_listener_address'] = "0.0.0.0"
+# (IP prefix, datapath ID) pairs assigning PCP clients to forwarders. If empty,
+# PCP requests are processed by the forwarder holding the only NAT pool
+# partition (if `nat_pool_partitions` is 1) or dropped.
+_FACTORY_DEFAULT_CONFIG['pcp_udp_client_forwarders'] = OrderedDict()
+
+_FACTORY_DEFAULT_CONFIG['pcp_worker_pool_size'] = 4
+_FACTORY_DEFAULT_CONFIG['pcp_worker_queue_max_size'] = 256
+
+# 0 means no limit. Overrides are (IP prefix, quota) pairs.
+_FACTORY_DEFAULT_CONFIG['default_mapping_quota_per_internal_ip'] = 4096
+_FACTORY_DEFAULT_CONFIG['mapping_quota_overrides'] = OrderedDict()
+
+# If empty, mapping entries are not persisted.
+_FACTORY_DEFAULT_CONFIG['nat_journal_dir'] = ""
+_FACTORY_DEFAULT_CONFIG['nat_journal_compaction_threshold'] = 100000
+
+# 0 disables periodic reconciliation. The page size is the number of internal IP
+# addresses (a power of two) whose NAT flow entries are reconciled per cycle.
+_FACTORY_DEFAULT_CONFIG['nat_reconciliation_interval_seconds'] = 1
+_FACTORY_DEFAULT_CONFIG['nat_reconciliation_page_size'] = 256
+_FACTORY_DEFAULT_CONFIG['nat_reconciliation_max_flow_mods_per_cycle'] = 128
+# Reconciliation is abandoned if flow statistics replies do not arrive in time.
+_FACTORY_DEFAULT_CONFIG['nat_reconciliation_timeout_seconds'] = 10
+
 _FACTORY_DEFAULT_CONFIG['default_nat_pool_config'] = OrderedDict([
   ('internal_ip_low_end', "172.16.0.2"),
   ('internal_ip_high_end', "172.16.255.254"),
@@ -2,8 +2,13 @@
 This module contains datapath-related functions for easier management.
 """
 
+import struct
+import time
+
 from collections import OrderedDict
 
+from ryu.ofproto import ofproto_parser
+
 #===============================================================================
 
 
@@ -32,6 +37,8 @@ def add_flow_entry(datapath, match, actions, instructions=None, **kwargs):
   
   If `instructions` is None, install instruction that applies `actions` immediately.
   If `instructions` is not None, `actions` is ignored.
+  
+  Return the sent `OFPFlowMod` message.
   """
   
   ofproto = datapath.ofproto
@@ -43,17 +50,23 @@ def add_flow_entry(datapath, match, actions, instructions=None, **kwargs):
   message = parser.OFPFlowMod(datapath, command=ofproto.OFPFC_ADD, match=match,
                               instructions=instructions, **kwargs)
   datapath.send_msg(message)
+  
+  return message
 
 
-def remove_flow_entry(datapath, match, **kwargs):
+def remove_flow_entry(datapath, match, strict=False, **kwargs):
   """
   Remove a flow entry.
+  
+  If `strict` is True, remove only the flow entry whose match fields and
+  priority are identical to `match` and the priority in `**kwargs`.
   """
   
   ofproto = datapath.ofproto
   parser = datapath.ofproto_parser
   
-  message = parser.OFPFlowMod(datapath, command=ofproto.OFPFC_DELETE,
+  command = ofproto.OFPFC_DELETE_STRICT if strict else ofproto.OFPFC_DELETE
+  message = parser.OFPFlowMod(datapath, command=command,
                               out_port=ofproto.OFPP_ANY,
                               out_group=ofproto.OFPG_ANY,
                               match=match, **kwargs)
@@ -93,6 +106,9 @@ def send_packet(forwarder, packet_, out_port=None):
   """
   Send the packet out the port on the specified forwarder.
   
+  `packet_` is either a `ryu.lib.packet.packet.Packet` object or an already
+  serialized frame (`str` or `bytearray`).
+  
   If `out_port` is None, process the packet in the flow tables of the forwarder
   (i.e. the `OFPP_TABLE` port is used).
   """
@@ -103,11 +119,15 @@ def send_packet(forwarder, packet_, out_port=None):
   if out_port is None:
     out_port = ofproto.OFPP_TABLE
   
-  packet_.serialize()
+  if isinstance(packet_, (bytes, bytearray)):
+    data = packet_
+  else:
+    packet_.serialize()
+    data = packet_.data
   
   actions = [parser.OFPActionOutput(out_port)]
   packet_to_send = parser.OFPPacketOut(forwarder, buffer_id=ofproto.OFP_NO_BUFFER,
-    in_port=ofproto.OFPP_CONTROLLER, actions=actions, data=packet_.data)
+    in_port=ofproto.OFPP_CONTROLLER, actions=actions, data=data)
   
   forwarder.send_msg(packet_to_send)
 
@@ -126,6 +146,165 @@ def clear_datapath(datapath):
 #===============================================================================
 
 
+class PreserializedMsg(ofproto_parser.MsgBase):
+  
+  """
+  This class wraps an OpenFlow message that is already serialized (e.g. filled
+  in from a template) so that it can be sent like any other message.
+  
+  `buf` must contain the complete message including the header. Serialization
+  only writes the XID into the header.
+  """
+  
+  _HEADER_STRUCT = struct.Struct("!BBH")
+  _XID_STRUCT = struct.Struct("!I")
+  _XID_OFFSET = 4
+  
+  def __init__(self, datapath, buf):
+    super(PreserializedMsg, self).__init__(datapath)
+    self.buf = buf
+    self.version, self.msg_type, self.msg_len = self._HEADER_STRUCT.unpack_from(buf)
+  
+  def serialize(self):
+    self._XID_STRUCT.pack_into(self.buf, self._XID_OFFSET, self.xid)
+
+
+#===============================================================================
+
+
+class FlowModBatcher(object):
+  
+  """
+  This class collects OpenFlow messages (e.g. `OFPFlowMod`) to be sent to a
+  datapath and sends them in batches.
+  
+  The batcher can be passed in place of the datapath to the functions in this
+  module.
+  
+  A batch is sent once it contains `max_batch_size` messages or when `flush` is
+  called. Messages in a batch are serialized into a single buffer, followed by
+  an `OFPBarrierRequest`, and the buffer is sent to the datapath at once. A batch
+  is complete once the barrier reply for the batch is received (see
+  `handle_barrier_reply`).
+  """
+  
+  def __init__(self, datapath, max_batch_size, flush_interval, clock=time.time):
+    """
+    `flush_interval` is the maximum time in seconds messages should wait before
+    being sent, see `flush_if_due`.
+    """
+    
+    self._datapath = datapath
+    self._max_batch_size = max_batch_size
+    self._flush_interval = flush_interval
+    self._clock = clock
+    
+    self._buffer = bytearray()
+    self._num_messages = 0
+    self._batch_start_time = None
+    
+    # Key: XID of the barrier request sent after the batch
+    # Value: number of messages in the batch
+    self._pending_batches = {}
+  
+  @property
+  def datapath(self):
+    return self._datapath
+  
+  @property
+  def id(self):
+    return self._datapath.id
+  
+  @property
+  def ofproto(self):
+    return self._datapath.ofproto
+  
+  @property
+  def ofproto_parser(self):
+    return self._datapath.ofproto_parser
+  
+  @property
+  def num_pending_batches(self):
+    """
+    Return the number of batches sent but not yet confirmed by a barrier reply.
+    """
+    
+    return len(self._pending_batches)
+  
+  def send_msg(self, msg):
+    """
+    Add the message to the current batch. If the batch is full, send it.
+    """
+    
+    if msg.xid is None:
+      self._datapath.set_xid(msg)
+    msg.serialize()
+    
+    if self._num_messages == 0:
+      self._batch_start_time = self._clock()
+    
+    self._buffer += msg.buf
+    self._num_messages += 1
+    
+    if self._num_messages >= self._max_batch_size:
+      self.flush()
+  
+  def flush(self):
+    """
+    Send the messages in the current batch followed by a barrier request.
+    
+    Return the XID of the barrier request, or None if the batch is empty.
+    """
+    
+    if self._num_messages == 0:
+      return None
+    
+    barrier_request = self._datapath.ofproto_parser.OFPBarrierRequest(self._datapath)
+    self._datapath.set_xid(barrier_request)
+    barrier_request.serialize()
+    self._buffer += barrier_request.buf
+    
+    self._datapath.send(self._buffer)
+    self._pending_batches[barrier_request.xid] = self._num_messages
+    
+    self._buffer = bytearray()
+    self._num_messages = 0
+    self._batch_start_time = None
+    
+    return barrier_request.xid
+  
+  def flush_if_due(self, now=None):
+    """
+    Send the current batch if its first message has been waiting for at least
+    the flush interval. Return the XID of the barrier request, or None if no
+    batch was sent.
+    """
+    
+    if self._num_messages == 0:
+      return None
+    
+    if now is None:
+      now = self._clock()
+    
+    if now - self._batch_start_time >= self._flush_interval:
+      return self.flush()
+    else:
+      return None
+  
+  def handle_barrier_reply(self, xid):
+    """
+    Mark the batch whose barrier request has the specified XID as complete.
+    
+    Return the number of messages in the batch, or None if the XID does not
+    belong to any batch sent by this batcher.
+    """
+    
+    return self._pending_batches.pop(xid, None)
+
+
+#===============================================================================
+
+
 class FlowTableHelper(object):
   
   """
@@ -0,0 +1,179 @@
+"""
+This module:
+* keeps per-forwarder state (NAT and ARP handlers) keyed by datapath ID
+* assigns partitions of the NAT pool (see `natpool`) to forwarders
+* assigns PCP clients sending PCP requests directly over UDP to forwarders
+"""
+
+#===============================================================================
+
+from collections import OrderedDict
+
+import netaddr
+
+from .nat import natpool
+
+from app_config import app_config
+
+#===============================================================================
+
+
+class ForwarderRegistryFullError(Exception):
+  pass
+
+
+#===============================================================================
+
+
+class ForwarderContext(object):
+  
+  """
+  This class holds the state of one forwarder.
+  """
+  
+  def __init__(self, datapath_id, flow_mod_batcher, nat_handler, arp_handler):
+    self.datapath_id = datapath_id
+    self.flow_mod_batcher = flow_mod_batcher
+    self.nat_handler = nat_handler
+    self.arp_handler = arp_handler
+
+
+class ForwarderRegistry(object):
+  
+  """
+  This class keeps `ForwarderContext` objects keyed by datapath ID.
+  
+  Each forwarder is assigned its own partition of the external IP addresses of
+  the NAT pool, so that mappings created by different forwarders never collide.
+  A forwarder keeps its partition (and its context) when it reconnects.
+  
+  The partition of a disconnected forwarder (see `release`) is reassigned to a
+  new forwarder once no unused partition is left. The context of the
+  disconnected forwarder is removed at that point.
+  """
+  
+  def __init__(self, nat_pool_config=app_config['default_nat_pool_config'],
+               num_partitions=app_config['nat_pool_partitions']):
+    self._nat_pool_configs = natpool.partition_nat_pool_config(nat_pool_config, num_partitions)
+    
+    # Key: datapath ID
+    # Value: `ForwarderContext` object
+    self._contexts = {}
+    # Key: datapath ID
+    # Value: index of NAT pool partition
+    self._partition_indexes = {}
+    # Key: datapath ID of a disconnected forwarder, in the order of disconnection
+    # Value: None
+    self._released_datapath_ids = OrderedDict()
+  
+  def __len__(self):
+    return len(self._contexts)
+  
+  def __iter__(self):
+    return iter(list(self._contexts.values()))
+  
+  def __contains__(self, datapath_id):
+    return datapath_id in self._contexts
+  
+  def get(self, datapath_id):
+    """
+    Return the `ForwarderContext` object of the forwarder or None if the
+    forwarder is not registered.
+    """
+    
+    return self._contexts.get(datapath_id)
+  
+  def get_nat_pool_config(self, datapath_id):
+    """
+    Return the NAT pool configuration of the partition assigned to the forwarder.
+    If the forwarder has no partition yet, assign the first unused one, or else
+    the partition of the forwarder that disconnected first. If the forwarder was
+    released, it keeps its partition.
+    
+    Raise `ForwarderRegistryFullError` if all partitions are assigned to
+    connected forwarders.
+    """
+    
+    if datapath_id in self._partition_indexes:
+      self._released_datapath_ids.pop(datapath_id, None)
+    else:
+      used_partition_indexes = set(self._partition_indexes.values())
+      for partition_index in range(len(self._nat_pool_configs)):
+        if partition_index not in used_partition_indexes:
+          self._partition_indexes[datapath_id] = partition_index
+          break
+      else:
+        if not self._released_datapath_ids:
+          raise ForwarderRegistryFullError(
+            "all {0} NAT pool partitions are assigned".format(len(self._nat_pool_configs)))
+        
+        released_datapath_id, unused_ = self._released_datapath_ids.popitem(last=False)
+        self._partition_indexes[datapath_id] = self._partition_indexes.pop(released_datapath_id)
+        self._contexts.pop(released_datapath_id, None)
+    
+    return dict(self._nat_pool_configs[self._partition_indexes[datapath_id]])
+  
+  def add(self, forwarder_context):
+    """
+    Register the forwarder context. Replace the existing context of the same
+    datapath ID, if any.
+    """
+    
+    self._contexts[forwarder_context.datapath_id] = forwarder_context
+  
+  def remove(self, datapath_id):
+    """
+    Unregister the forwarder and release its NAT pool partition. Return the
+    removed `ForwarderContext` object or None if the forwarder is not registered.
+    """
+    
+    self._partition_indexes.pop(datapath_id, None)
+    self._released_datapath_ids.pop(datapath_id, None)
+    return self._contexts.pop(datapath_id, None)
+  
+  def release(self, datapath_id):
+    """
+    Mark the forwarder as disconnected. The forwarder keeps its context and its
+    NAT pool partition until the partition is reassigned to another forwarder
+    (see `get_nat_pool_config`).
+    """
+    
+    if datapath_id in self._partition_indexes:
+      self._released_datapath_ids[datapath_id] = None
+
+
+#===============================================================================
+
+
+class PcpClientForwarderMap(object):
+  
+  """
+  This class assigns PCP clients to forwarders by their IP address, so that PCP
+  requests of a client received directly over UDP are always processed by the
+  NAT handler of the same forwarder.
+  
+  `client_forwarders` is a dict of (IP prefix, datapath ID) pairs (e.g.
+  `{"172.16.0.0/16": 1}`). If multiple prefixes contain an IP address, the
+  longest prefix is used.
+  """
+  
+  def __init__(self, client_forwarders=app_config['pcp_udp_client_forwarders']):
+    # Items: (network, datapath ID), longest prefixes first
+    self._client_forwarders = sorted(
+      [(netaddr.IPNetwork(prefix), datapath_id)
+       for prefix, datapath_id in client_forwarders.items()],
+      key=lambda network_and_datapath_id: network_and_datapath_id[0].prefixlen, reverse=True)
+  
+  def get_datapath_id(self, pcp_client_ip):
+    """
+    Return the datapath ID of the forwarder assigned to the PCP client, or None
+    if no prefix contains the IP address of the PCP client.
+    """
+    
+    ip_addr = netaddr.IPAddress(pcp_client_ip)
+    
+    for network, datapath_id in self._client_forwarders:
+      if ip_addr in network:
+        return datapath_id
+    
+    return None
@@ -12,6 +12,8 @@ class Message(object):
   This class can be used to store payload data.
   """
   
+  __slots__ = ('_fields',)
+  
   def __init__(self):
     self._fields = {}
   
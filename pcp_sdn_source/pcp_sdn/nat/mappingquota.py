@@ -0,0 +1,65 @@
+"""
+This module defines limits on the number of mapping entries per internal IP
+address (subscriber).
+"""
+
+#===============================================================================
+
+import netaddr
+
+from . import nattable
+
+from ..app_config import app_config
+
+#===============================================================================
+
+
+class MappingQuota(object):
+  
+  """
+  This class returns the maximum number of mapping entries an internal IP
+  address may own.
+  
+  `default_quota` applies to all internal IP addresses not covered by
+  `quota_overrides`, a dict of (IP prefix, quota) pairs (e.g.
+  `{"172.16.5.0/24": 16384}`). If multiple prefixes contain an IP address, the
+  longest prefix is used. A quota of 0 means no limit.
+  """
+  
+  def __init__(self, default_quota=app_config['default_mapping_quota_per_internal_ip'],
+               quota_overrides=app_config['mapping_quota_overrides']):
+    self._default_quota = default_quota
+    
+    # Items: (address family, network as integer, netmask as integer, quota),
+    # longest prefixes first
+    self._quota_overrides = []
+    networks_and_quotas = sorted(
+      [(netaddr.IPNetwork(prefix), quota) for prefix, quota in quota_overrides.items()],
+      key=lambda network_and_quota: network_and_quota[0].prefixlen, reverse=True)
+    for network, quota in networks_and_quotas:
+      if network.version == 6:
+        address_family = nattable.AddressFamily.IPv6
+      else:
+        address_family = nattable.AddressFamily.IPv4
+      self._quota_overrides.append(
+        (address_family, network.network.value, network.netmask.value, quota))
+  
+  def get_quota(self, internal_ip):
+    """
+    Return the quota of the internal IP address, or None if the number of
+    mapping entries is not limited.
+    """
+    
+    ip_value = nattable.ip_to_int(internal_ip)
+    address_family = nattable.get_address_family(ip_value)
+    
+    quota = self._default_quota
+    for (network_address_family, network_value, netmask_value,
+         override_quota) in self._quota_overrides:
+      # IPv4 prefixes never match IPv6 addresses and vice versa.
+      if (network_address_family == address_family and
+          ip_value & netmask_value == network_value):
+        quota = override_quota
+        break
+    
+    return quota if quota > 0 else None
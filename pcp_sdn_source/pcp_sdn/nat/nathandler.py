@@ -6,8 +6,13 @@ This module:
 
 #===============================================================================
 
+import time
+
+from .. import timerwheel
+from . import mappingquota
 from . import nattable
 from . import natinstaller
+from . import natreconciler
 
 import logging
 
@@ -15,84 +20,412 @@ import logging
 
 
 class MappingRemovalType(object):
-  REMOVAL_TYPES = FLOW_ENTRY_REMOVED_BY_FORWARDER, REQUESTED_BY_CLIENT = (0, 1)
+  REMOVAL_TYPES = (
+    FLOW_ENTRY_REMOVED_BY_FORWARDER, REQUESTED_BY_CLIENT, EXPIRED, FLOW_ENTRY_INSTALLATION_FAILED
+  ) = (0, 1, 2, 3)
 
 
 class MappingError(Exception):
   pass
 
 
+class MappingQuotaExceededError(MappingError):
+  pass
+
+
+class FlowTableFullError(MappingError):
+  pass
+
+
 #===============================================================================
 
 
 class NatHandler(object):
   
-  def __init__(self, forwarder, external_port, table_ids, next_table_id):
-    self._nat_installer = natinstaller.NatInstaller(forwarder, external_port, table_ids, next_table_id)
-    self._nat_table = nattable.NatTable()
+  def __init__(self, forwarder, external_port, table_ids, next_table_id, clock=time.time,
+               nat_pool_config=None, mapping_quota=None, journal=None,
+               mapping_removal_callback=None):
+    """
+    `clock` is a function returning the current time in seconds, used to
+    compute expiry time of mapping entries.
+    
+    `nat_pool_config` is a dict of NAT pool configuration parameters overriding
+    the default values (see `NatTable`).
+    
+    `mapping_quota` is a `MappingQuota` limiting the number of mapping entries
+    per internal IP address. If None, the quotas from the configuration file
+    are used.
+    
+    `journal` is a `NatJournal` recording changes of mapping entries. If None,
+    mapping entries are not persisted. Call `recover_mappings` before creating
+    mapping entries to restore the mapping entries from the journal.
+    
+    `mapping_removal_callback` is a function called with the forwarder ID and
+    the `NatTableEntry` of each removed mapping entry, regardless of the reason
+    of the removal (e.g. to discard cached PCP responses for the mapping entry).
+    """
+    
+    if mapping_quota is None:
+      mapping_quota = mappingquota.MappingQuota()
+    self._mapping_quota = mapping_quota
+    
+    if nat_pool_config is None:
+      nat_pool_config = {}
+    
+    self._nat_table = nattable.NatTable(clock=clock, **nat_pool_config)
+    self._nat_installer = natinstaller.NatInstaller(forwarder, external_port, table_ids, next_table_id,
+      nat_pool_config=self._nat_table.nat_pool_config)
+    self._flow_reconciler = natreconciler.NatFlowReconciler(
+      self._nat_table, self._nat_installer, clock=clock)
+    
+    self._clock = clock
+    # Items: (key, NatTableEntry)
+    self._expiry_timer_wheel = timerwheel.TimerWheel(self._clock())
+    
+    self._journal = journal
+    self._mapping_removal_callback = mapping_removal_callback
+    
+    # Items: (translation direction, matched key) of flow entries uninstalled
+    # because the other flow entry of their mapping entry was removed by the
+    # forwarder (see `handle_flow_removed`)
+    self._uninstalled_partner_flow_entries = set()
+    
+    # Maximum number of mapping entries whose flow entries fit in the NAT flow
+    # tables of the forwarder, or None if unknown
+    self._max_num_mappings = None
+    self._table_features_xid = None
+    # Items: `OFPTableFeaturesStats` instances received so far
+    self._table_features = []
+    
+    # Key: XID of a flow modification installing a flow entry of a new mapping
+    # entry, not yet confirmed by a barrier reply
+    # Value: (key, NatTableEntry)
+    self._unconfirmed_flow_mods = {}
+  
+  def set_forwarder(self, forwarder):
+    """
+    Use a new forwarder (e.g. after the forwarder reconnected) and reconcile its
+    flow entries with the existing mapping entries (see
+    `reconcile_flow_entries`).
+    """
+    
+    self._nat_installer.set_forwarder(forwarder)
+    # Flow removal messages and errors from the previous connection will not
+    # arrive.
+    self._uninstalled_partner_flow_entries.clear()
+    self._unconfirmed_flow_mods.clear()
+    self.reconcile_flow_entries()
+  
+  def reconcile_flow_entries(self):
+    """
+    Request the NAT flow entries installed in the forwarder. Once the replies
+    are passed to `handle_flow_stats_reply`, flow entries not matching any
+    mapping entry are uninstalled and missing flow entries are installed.
+    
+    Flow entries matching mapping entries are kept, hence translations keep
+    working while the controller or the forwarder reconnects.
+    """
+    
+    self._flow_reconciler.start()
+  
+  def reconcile_next_flow_entry_page(self):
+    """
+    Request the NAT flow entries of the next page of internal IP addresses (see
+    `NatFlowReconciler.start_next_page`) and reconcile them once the replies are
+    passed to `handle_flow_stats_reply`.
+    
+    This method should be called periodically so that flow entries lost or left
+    behind (e.g. due to lost flow modifications or flow removal messages) are
+    repaired. Return False if a reconciliation is still in progress, True
+    otherwise.
+    """
+    
+    return self._flow_reconciler.start_next_page()
+  
+  def handle_flow_stats_reply(self, msg):
+    """
+    Process the `OFPFlowStatsReply` message. Return True if the message replies
+    to a request sent by `reconcile_flow_entries`, False otherwise.
+    """
+    
+    return self._flow_reconciler.handle_flow_stats_reply(msg)
+  
+  @property
+  def forwarder_id(self):
+    """
+    Return the datapath ID of the forwarder. The ID does not change when the
+    forwarder reconnects.
+    """
+    
+    return self._nat_installer.forwarder_id
+  
+  @property
+  def max_num_mappings(self):
+    """
+    Return the maximum number of mapping entries whose flow entries fit in the
+    forwarder, or None if unknown (see `request_flow_table_capacity`).
+    """
+    
+    return self._max_num_mappings
+  
+  def request_flow_table_capacity(self):
+    """
+    Request the features of the flow tables of the forwarder. Once the replies
+    are passed to `handle_table_features_reply`, new mapping entries are
+    rejected if their flow entries would not fit in the NAT flow tables.
+    """
+    
+    self._table_features = []
+    self._table_features_xid = self._nat_installer.request_nat_table_features()
+  
+  def handle_table_features_reply(self, msg):
+    """
+    Process the `OFPTableFeaturesStatsReply` message. Return True if the
+    message replies to the request sent by `request_flow_table_capacity`,
+    False otherwise.
+    """
+    
+    if self._table_features_xid is None or msg.xid != self._table_features_xid:
+      return False
+    
+    self._table_features.extend(msg.body)
+    
+    if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+      self._table_features_xid = None
+      # Each NAT flow table contains one flow entry per mapping entry.
+      self._max_num_mappings = self._nat_installer.get_nat_table_max_entries(self._table_features)
+      self._table_features = []
+      
+      logging.info("Maximum number of mapping entries: {0}".format(self._max_num_mappings))
+    
+    return True
+  
+  def flush_flow_mods(self):
+    """
+    Send the flow modifications batched by the forwarder right away, e.g. before
+    responding to a PCP request so that the flow entries of the mapping entry
+    are installed before the PCP client uses the mapping entry.
+    """
+    
+    self._nat_installer.flush()
+  
+  def handle_barrier_reply(self, xid):
+    """
+    Mark flow modifications sent before the barrier request with the specified
+    XID as successful. Errors of these flow modifications would have been
+    received before the barrier reply.
+    """
+    
+    for flow_mod_xid in list(self._unconfirmed_flow_mods):
+      # Compare XIDs modulo 2^32 as they wrap around.
+      if (xid - flow_mod_xid) & 0xffffffff < 0x80000000:
+        del self._unconfirmed_flow_mods[flow_mod_xid]
+  
+  def handle_error(self, msg):
+    """
+    Process the `OFPErrorMsg` message. If a flow entry of a new mapping entry
+    could not be installed, remove the mapping entry along with its other flow
+    entry and return the removed mapping entry. Otherwise, return None.
+    
+    If the flow entry was not installed because the flow table is full, new
+    mapping entries are rejected until existing ones are removed.
+    
+    If the message refers to a flow statistics request sent by the flow entry
+    reconciliation, the reconciliation is abandoned.
+    """
+    
+    if self._flow_reconciler.handle_error(msg):
+      return None
+    
+    ofproto = msg.datapath.ofproto
+    if msg.type != ofproto.OFPET_FLOW_MOD_FAILED:
+      return None
+    
+    key, table_entry = self._unconfirmed_flow_mods.pop(msg.xid, (None, None))
+    if table_entry is None or self._nat_table.find_entry_by_key(key) is not table_entry:
+      # The mapping entry has been removed in the meantime.
+      return None
+    
+    self._remove_mapping(key, table_entry, MappingRemovalType.FLOW_ENTRY_INSTALLATION_FAILED)
+    
+    if msg.code == ofproto.OFPFMFC_TABLE_FULL:
+      num_mappings = len(self._nat_table)
+      if self._max_num_mappings is None or num_mappings < self._max_num_mappings:
+        self._max_num_mappings = num_mappings
+    
+    logging.warning("Removed mapping entry, flow entry installation failed (code {0}): {1}".format(
+      msg.code, table_entry))
+    
+    return table_entry.to_dict()
+  
+  def recover_mappings(self, install_flow_entries=True):
+    """
+    Restore mapping entries from the journal that have not expired yet and
+    install their flow entries to the forwarder. Return the number of restored
+    mapping entries.
+    
+    If `install_flow_entries` is False, flow entries are not installed. Use
+    `reconcile_flow_entries` afterwards if the forwarder may still contain flow
+    entries of the restored mapping entries.
+    
+    The journal is compacted afterwards, so that it contains only the restored
+    mapping entries.
+    """
+    
+    if self._journal is None:
+      return 0
+    
+    num_recovered_mappings = 0
+    
+    for journal_entry in self._journal.load():
+      try:
+        table_entry = self._nat_table.add_entry(journal_entry.internal_ip,
+          journal_entry.internal_port, journal_entry.lifetime, journal_entry.external_ip,
+          journal_entry.external_port, journal_entry.protocol, journal_entry.address_family)
+      except (ValueError, nattable.NatPoolDepletedError) as e:
+        logging.info("Mapping entry not recovered ({0}): {1}".format(e, journal_entry))
+        continue
+      
+      if ((table_entry.external_ip, table_entry.external_port) !=
+          (journal_entry.external_ip, journal_entry.external_port)):
+        # The external IP address and port are no longer available (e.g. the
+        # NAT pool configuration changed).
+        self._nat_table.remove_entry_by_key(nattable.get_key(
+          table_entry.internal_ip, table_entry.internal_port, table_entry.protocol))
+        logging.info("Mapping entry not recovered (external IP address and port "
+                     "not available): {0}".format(journal_entry))
+        continue
+      
+      table_entry.expiry_time = journal_entry.expiry_time
+      
+      if install_flow_entries:
+        self._nat_installer.install_nat_entry(table_entry)
+      self._expiry_timer_wheel.schedule(table_entry.expiry_time, (
+        nattable.get_key(table_entry.internal_ip, table_entry.internal_port, table_entry.protocol),
+        table_entry))
+      num_recovered_mappings += 1
+    
+    self._journal.compact(self._nat_table.get_all_entries())
+    
+    logging.info("Recovered {0} mapping entries from the journal".format(num_recovered_mappings))
+    
+    return num_recovered_mappings
+  
+  def compact_journal_if_due(self):
+    """
+    Compact the journal if it grew past the compaction threshold (see
+    `NatJournal.compact_if_due`).
+    """
+    
+    if self._journal is not None:
+      self._journal.compact_if_due(self._nat_table.get_all_entries)
   
   def create_mapping(self, internal_ip, internal_port, external_ip, external_port, protocol, lifetime):
     """
     Create mapping entry.
     
-    If the mapping entry for the internal IP and port already exists, raise
-    `MappingError`. To update lifetime of a mapping entry, use
+    If the mapping entry for the internal IP, port and protocol already exists,
+    raise `MappingError`. To update lifetime of a mapping entry, use
     `update_mapping_lifetime` instead.
     
+    If the internal IP address already owns as many mapping entries as its
+    quota allows, raise `MappingQuotaExceededError`. If the flow entries of the
+    mapping entry would not fit in the NAT flow tables of the forwarder, raise
+    `FlowTableFullError`.
+    
     Further restrictions apply according to the `NatTable.add_entry` method.
     """
     
-    table_entry = self._nat_table.find_entry(internal_ip, internal_port)
+    key = nattable.get_key(internal_ip, internal_port, protocol)
+    table_entry = self._nat_table.find_entry_by_key(key)
     if table_entry:
       raise MappingError("Mapping entry already exists: {0}"
                          .format(table_entry))
+    
+    quota = self._mapping_quota.get_quota(internal_ip)
+    if quota is not None and self._nat_table.count_entries_by_internal_ip(internal_ip) >= quota:
+      raise MappingQuotaExceededError(
+        "Internal IP address {0} exceeded its quota of {1} mapping entries".format(
+          internal_ip, quota))
+    elif self._max_num_mappings is not None and len(self._nat_table) >= self._max_num_mappings:
+      raise FlowTableFullError(
+        "NAT flow tables are full ({0} mapping entries)".format(self._max_num_mappings))
     else:
       table_entry = self._nat_table.add_entry(
         internal_ip, internal_port, lifetime, external_ip, external_port, protocol)
-      self._nat_installer.install_nat_entry(table_entry)
+      if self._journal is not None:
+        self._journal.record_create(table_entry)
+      for xid in self._nat_installer.install_nat_entry(table_entry):
+        self._unconfirmed_flow_mods[xid] = (key, table_entry)
+      self._expiry_timer_wheel.schedule(table_entry.expiry_time, (key, table_entry))
       
       mapping = table_entry.to_dict()
       logging.info("Created mapping entry: {0}".format(mapping))
       
       return mapping
   
-  def find_mapping(self, internal_ip, internal_port):
+  def find_mapping(self, internal_ip, internal_port, protocol=nattable.IpUpperProtocol.UDP):
     """
-    Return the mapping entry given the internal IP address and internal port.
+    Return the mapping entry given the internal IP address, internal port and
+    protocol.
     
     If the mapping entry does not exist, return None.
     """
     
-    table_entry = self._nat_table.find_entry(internal_ip, internal_port)
+    table_entry = self._nat_table.find_entry_by_key(
+      nattable.get_key(internal_ip, internal_port, protocol))
     
     if table_entry:
       return table_entry.to_dict()
     else:
       return None
   
-  def update_mapping_lifetime(self, internal_ip, internal_port, lifetime):
+  def update_mapping_lifetime(self, internal_ip, internal_port, lifetime,
+                              protocol=nattable.IpUpperProtocol.UDP):
     """
     Update lifetime of the existing mapping entry. Return the mapping entry.
     
+    If the NAT flow entries are kept intact (see
+    `NatInstaller.is_lifetime_refresh_needed`), the lifetime is not updated and
+    the returned mapping entry contains the remaining lifetime.
+    
     If the mapping entry does not exist, raise `MappingError`.
     """
     
-    table_entry = self._nat_table.find_entry(internal_ip, internal_port)
+    key = nattable.get_key(internal_ip, internal_port, protocol)
+    table_entry = self._nat_table.find_entry_by_key(key)
     
     if table_entry:
-      table_entry = self._nat_table.update_entry_lifetime(internal_ip, internal_port, lifetime)
+      now = self._clock()
+      if not self._nat_installer.is_lifetime_refresh_needed(table_entry, now + lifetime):
+        mapping = table_entry.to_dict()
+        mapping['lifetime'] = max(int(table_entry.expiry_time - now), 0)
+        logging.info("Mapping entry lifetime kept (within refresh tolerance): {0}".format(mapping))
+        
+        return mapping
+      
+      previous_expiry_time = table_entry.expiry_time
+      table_entry = self._nat_table.update_entry_lifetime_by_key(key, lifetime)
+      if self._journal is not None:
+        self._journal.record_refresh(table_entry)
       self._nat_installer.modify_nat_entry_lifetime(table_entry)
       
+      # If the lifetime was extended, the entry is rescheduled when the previous
+      # expiry time passes (see `expire_mappings`).
+      if table_entry.expiry_time < previous_expiry_time:
+        self._expiry_timer_wheel.schedule(table_entry.expiry_time, (key, table_entry))
+      
       mapping = table_entry.to_dict()
       logging.info("Updated mapping entry lifetime: {0}".format(mapping))
       
       return mapping
     else:
-      raise MappingError("Mapping entry '{0}, {1}' does not exist"
-                         .format(internal_ip, internal_port))
+      raise MappingError("Mapping entry '{0}, {1}, {2}' does not exist"
+                         .format(internal_ip, internal_port, protocol))
   
   def remove_mapping(self, internal_ip, internal_port,
-    mapping_removal_type=MappingRemovalType.FLOW_ENTRY_REMOVED_BY_FORWARDER):
+    mapping_removal_type=MappingRemovalType.FLOW_ENTRY_REMOVED_BY_FORWARDER,
+    protocol=nattable.IpUpperProtocol.UDP):
     """
     Remove mapping entry.
     
@@ -100,22 +433,178 @@ class NatHandler(object):
     False.
     
     If `mapping_removal_type` is `MappingRemovalType.REQUESTED_BY_CLIENT`,
-    remove flow entries in the NAT forwarder. Otherwise, it is assumed that the
-    flow entries expired or were removed by other means.
+    `MappingRemovalType.EXPIRED` or
+    `MappingRemovalType.FLOW_ENTRY_INSTALLATION_FAILED`, remove flow entries in
+    the NAT forwarder. Otherwise, it is assumed that the flow entries expired or
+    were removed by other means.
     """
     
-    table_entry = self._nat_table.find_entry(internal_ip, internal_port)
+    key = nattable.get_key(internal_ip, internal_port, protocol)
+    table_entry = self._nat_table.find_entry_by_key(key)
     if table_entry is None:
-      logging.info("Mapping entry not removed (mapping does not exist): {0}, {1}"
-                   .format(internal_ip, internal_port))
+      logging.info("Mapping entry not removed (mapping does not exist): {0}, {1}, {2}"
+                   .format(internal_ip, internal_port, protocol))
       return False
     else:
-      if mapping_removal_type == MappingRemovalType.REQUESTED_BY_CLIENT:
-        self._nat_installer.uninstall_nat_entry(table_entry)
-      
-      self._nat_table.remove_entry(internal_ip, internal_port)
+      self._remove_mapping(key, table_entry, mapping_removal_type)
       
       logging.info("Removed mapping entry: {0}".format(table_entry))
       
       return True
-    
\ No newline at end of file
+  
+  def handle_flow_removed(self, msg):
+    """
+    Process the `OFPFlowRemoved` message. If a NAT flow entry expired, remove
+    its mapping entry, found by the internal or the external key depending on
+    the flow table, and uninstall the other flow entry of the mapping entry.
+    
+    Return True if a mapping entry was removed, False otherwise.
+    
+    Flow entries of a mapping entry produce a pair of flow removal messages.
+    The message of the flow entry uninstalled by this method, or of the flow
+    entry that expired at the same time, is ignored, so that each mapping entry
+    is removed once. Messages of flow entries uninstalled by other methods (e.g.
+    `remove_mapping`) are ignored as well.
+    """
+    
+    flow_entry_match_key = self._nat_installer.get_flow_entry_match_key(msg.table_id, msg.match)
+    if flow_entry_match_key is None:
+      return False
+    
+    if flow_entry_match_key in self._uninstalled_partner_flow_entries:
+      self._uninstalled_partner_flow_entries.remove(flow_entry_match_key)
+      return False
+    
+    ofproto = msg.datapath.ofproto
+    if msg.reason not in [ofproto.OFPRR_IDLE_TIMEOUT, ofproto.OFPRR_HARD_TIMEOUT]:
+      return False
+    
+    translation_direction, matched_key = flow_entry_match_key
+    if translation_direction == natinstaller.NatTranslationDirection.INTERNAL_TO_EXTERNAL:
+      table_entry = self._nat_table.find_entry_by_key(matched_key)
+    else:
+      table_entry = self._nat_table.find_entry_by_external_key(matched_key)
+    
+    if table_entry is None:
+      return False
+    
+    for flow_entry_id in self._nat_installer.get_nat_flow_entry_ids(table_entry):
+      if flow_entry_id[:2] != flow_entry_match_key:
+        self._nat_installer.uninstall_nat_flow_entry(table_entry, flow_entry_id)
+        self._uninstalled_partner_flow_entries.add(flow_entry_id[:2])
+    
+    if translation_direction == natinstaller.NatTranslationDirection.INTERNAL_TO_EXTERNAL:
+      self._nat_table.remove_entry_by_key(matched_key)
+    else:
+      self._nat_table.remove_entry_by_external_key(matched_key)
+    
+    if self._journal is not None:
+      self._journal.record_remove(table_entry)
+    self._notify_mapping_removed(table_entry)
+    
+    logging.info("Flow entry expired, removed mapping entry: {0}".format(table_entry))
+    
+    return True
+  
+  def remove_mappings_by_internal_ip(self, internal_ip):
+    """
+    Remove all mapping entries of the internal host along with their flow
+    entries in the NAT forwarder. Return the number of removed mapping entries.
+    """
+    
+    table_entries = self._nat_table.remove_entries_by_internal_ip(internal_ip)
+    self._record_removed_entries(table_entries)
+    if table_entries:
+      self._nat_installer.uninstall_nat_entries_by_internal_ip(internal_ip, table_entries)
+    
+    logging.info("Removed {0} mapping entries of internal IP address {1}".format(
+                 len(table_entries), internal_ip))
+    
+    return len(table_entries)
+  
+  def drain_external_ip(self, external_ip):
+    """
+    Remove all mapping entries using the external IP address along with their
+    flow entries in the NAT forwarder. Return the number of removed mapping
+    entries.
+    """
+    
+    table_entries = self._nat_table.remove_entries_by_external_ip(external_ip)
+    self._record_removed_entries(table_entries)
+    if table_entries:
+      self._nat_installer.uninstall_nat_entries_by_external_ip(external_ip, table_entries)
+    
+    logging.info("Removed {0} mapping entries of external IP address {1}".format(
+                 len(table_entries), external_ip))
+    
+    return len(table_entries)
+  
+  def remove_all_mappings(self):
+    """
+    Remove all mapping entries along with all NAT flow entries in the NAT
+    forwarder. Return the number of removed mapping entries.
+    """
+    
+    table_entries = self._nat_table.remove_all_entries()
+    self._record_removed_entries(table_entries)
+    self._nat_installer.uninstall_all_nat_entries()
+    
+    logging.info("Removed all {0} mapping entries".format(len(table_entries)))
+    
+    return len(table_entries)
+  
+  def expire_mappings(self, now=None):
+    """
+    Remove mapping entries whose lifetime has expired, along with their flow
+    entries in the NAT forwarder. Return the number of removed mapping entries.
+    
+    This method should be called periodically so that mapping entries are
+    removed even if the NAT forwarder fails to notify the controller about
+    expired flow entries.
+    
+    If `now` is None, use the current time from the clock.
+    """
+    
+    if now is None:
+      now = self._clock()
+    
+    num_removed_mappings = 0
+    
+    for key, table_entry in self._expiry_timer_wheel.advance(now):
+      if self._nat_table.find_entry_by_key(key) is not table_entry:
+        # The mapping entry has been removed in the meantime.
+        continue
+      
+      if table_entry.expiry_time > now:
+        # The lifetime has been extended in the meantime.
+        self._expiry_timer_wheel.schedule(table_entry.expiry_time, (key, table_entry))
+        continue
+      
+      self._remove_mapping(key, table_entry, MappingRemovalType.EXPIRED)
+      num_removed_mappings += 1
+    
+    if num_removed_mappings > 0:
+      logging.info("Removed {0} expired mapping entries".format(num_removed_mappings))
+    
+    return num_removed_mappings
+  
+  def _remove_mapping(self, key, table_entry, mapping_removal_type):
+    if mapping_removal_type in [MappingRemovalType.REQUESTED_BY_CLIENT, MappingRemovalType.EXPIRED,
+                                MappingRemovalType.FLOW_ENTRY_INSTALLATION_FAILED]:
+      self._nat_installer.uninstall_nat_entry(table_entry)
+    
+    self._nat_table.remove_entry_by_key(key)
+    
+    if self._journal is not None:
+      self._journal.record_remove(table_entry)
+    self._notify_mapping_removed(table_entry)
+  
+  def _record_removed_entries(self, table_entries):
+    if self._journal is not None and table_entries:
+      self._journal.record_remove_entries(table_entries)
+    for table_entry in table_entries:
+      self._notify_mapping_removed(table_entry)
+  
+  def _notify_mapping_removed(self, table_entry):
+    if self._mapping_removal_callback is not None:
+      self._mapping_removal_callback(self.forwarder_id, table_entry)
@@ -4,6 +4,10 @@ This module installs flow tables and flow table entries to the NAT forwarder.
 
 #===============================================================================
 
+import operator
+import socket
+import struct
+
 from .. import dphelper
 from . import nattable
 
@@ -36,6 +40,228 @@ MATCH_FIELD_NAME_MAPS = {
 
 #===============================================================================
 
+# Layout of cookies of NAT flow entries:
+#
+#   bits 56-63 - marker identifying NAT flow entries
+#   bit  48    - translation direction
+#   bits 24-47 - index of the external IP address in the NAT pool
+#   bits 0-23  - index of the internal IP address in the NAT pool
+#
+# Flow entries of IP addresses whose index does not fit in 24 bits use the
+# `_COOKIE_NO_IP_INDEX` index and cannot be removed in bulk by IP address.
+NAT_COOKIE_MARKER = 0x4e << 56
+NAT_COOKIE_MARKER_MASK = 0xff << 56
+
+_COOKIE_DIRECTION_SHIFT = 48
+_COOKIE_EXTERNAL_IP_INDEX_SHIFT = 24
+_COOKIE_IP_INDEX_MASK = (1 << 24) - 1
+_COOKIE_NO_IP_INDEX = _COOKIE_IP_INDEX_MASK
+
+# Number of IP indexes, starting from 0, that can be stored in cookies
+NUM_COOKIE_IP_INDEXES = _COOKIE_NO_IP_INDEX
+
+
+def get_nat_cookie(internal_ip_index, external_ip_index, translation_direction):
+  """
+  Return the cookie of a NAT flow entry.
+  """
+  
+  return (NAT_COOKIE_MARKER |
+          (translation_direction << _COOKIE_DIRECTION_SHIFT) |
+          (external_ip_index << _COOKIE_EXTERNAL_IP_INDEX_SHIFT) |
+          internal_ip_index)
+
+
+def parse_nat_cookie(cookie):
+  """
+  Return the (internal IP index, external IP index, translation direction) tuple
+  from the cookie of a NAT flow entry. If the cookie does not belong to a NAT
+  flow entry, return None.
+  """
+  
+  if cookie & NAT_COOKIE_MARKER_MASK != NAT_COOKIE_MARKER:
+    return None
+  
+  return (cookie & _COOKIE_IP_INDEX_MASK,
+          (cookie >> _COOKIE_EXTERNAL_IP_INDEX_SHIFT) & _COOKIE_IP_INDEX_MASK,
+          (cookie >> _COOKIE_DIRECTION_SHIFT) & 1)
+
+
+def get_nat_cookie_filter_by_internal_ip_indexes(first_internal_ip_index, num_internal_ip_indexes):
+  """
+  Return the (cookie, cookie mask) pair matching cookies of NAT flow entries of
+  `num_internal_ip_indexes` consecutive internal IP indexes starting from
+  `first_internal_ip_index`.
+  
+  `num_internal_ip_indexes` must be a power of two and `first_internal_ip_index`
+  must be its multiple.
+  """
+  
+  return (NAT_COOKIE_MARKER | first_internal_ip_index,
+          NAT_COOKIE_MARKER_MASK | (_COOKIE_IP_INDEX_MASK & ~(num_internal_ip_indexes - 1)))
+
+
+#===============================================================================
+
+
+class NatFlowRefreshMode(object):
+  
+  """
+  Modes of refreshing the lifetime of NAT flow entries:
+  
+  * `REINSTALL` - remove the flow entries and add them back with the new
+    lifetime (four flow modifications per refresh),
+  * `SKIP_WITHIN_TOLERANCE` - keep the flow entries if the new expiry time is
+    within a tolerance of the current one, otherwise overwrite them with the new
+    lifetime (zero or two flow modifications per refresh),
+  * `CONTROLLER_EXPIRY` - install flow entries without a timeout and let the
+    controller remove them once the mapping expires (no flow modification per
+    refresh).
+  """
+  
+  MODES = REINSTALL, SKIP_WITHIN_TOLERANCE, CONTROLLER_EXPIRY = (0, 1, 2)
+
+
+#===============================================================================
+
+
+class NatTranslationDirection(object):
+  DIRECTIONS = INTERNAL_TO_EXTERNAL, EXTERNAL_TO_INTERNAL = (0, 1)
+
+
+#===============================================================================
+
+
+class _NatFlowModTemplate(object):
+  
+  """
+  This class builds flow modifications adding NAT flow entries of one address
+  family, protocol and translation direction.
+  
+  The `OFPFlowMod` message is serialized once with placeholder values. For each
+  NAT table entry, the serialized message is copied and only the variable
+  values (matched IP address and port, translated IP address and port, cookie
+  and idle timeout) are written at their offsets, without building the match
+  fields, actions and instructions again.
+  """
+  
+  _PORT_STRUCT = struct.Struct("!H")
+  _COOKIE_STRUCT = struct.Struct("!Q")
+  _IDLE_TIMEOUT_STRUCT = struct.Struct("!H")
+  
+  def __init__(self, forwarder, table_id, next_table_id, address_family, protocol,
+               translation_direction, priority):
+    # Action fields set the IP address and port of the opposite side (e.g.
+    # source internal IP address is set to external).
+    if translation_direction == NatTranslationDirection.INTERNAL_TO_EXTERNAL:
+      field_name_direction_suffix = 'src'
+      matched_attr_name_prefix, translated_attr_name_prefix = 'internal', 'external'
+    elif translation_direction == NatTranslationDirection.EXTERNAL_TO_INTERNAL:
+      field_name_direction_suffix = 'dst'
+      matched_attr_name_prefix, translated_attr_name_prefix = 'external', 'internal'
+    else:
+      raise ValueError("invalid translation direction: {0}".format(translation_direction))
+    
+    self._forwarder = forwarder
+    
+    self._get_matched_ip_and_port = operator.attrgetter(
+      matched_attr_name_prefix + '_ip', matched_attr_name_prefix + '_port')
+    self._get_translated_ip_and_port = operator.attrgetter(
+      translated_attr_name_prefix + '_ip', translated_attr_name_prefix + '_port')
+    
+    if address_family == nattable.AddressFamily.IPv6:
+      self._socket_address_family = socket.AF_INET6
+      min_ip, max_ip = "::", "ffff:ffff:ffff:ffff:ffff:ffff:ffff:ffff"
+    else:
+      self._socket_address_family = socket.AF_INET
+      min_ip, max_ip = "0.0.0.0", "255.255.255.255"
+    self._ip_length = len(socket.inet_pton(self._socket_address_family, min_ip))
+    
+    self._match_data = {
+      'eth_type': address_family,
+      'ip_proto': protocol,
+    }
+    ip_field_name = MATCH_FIELD_NAME_MAPS['ip_' + field_name_direction_suffix][address_family]
+    port_field_name = MATCH_FIELD_NAME_MAPS['port_' + field_name_direction_suffix][protocol]
+    self._ip_field_name = ip_field_name
+    self._port_field_name = port_field_name
+    
+    def serialize_flow_mod(matched_ip=min_ip, matched_port=0, translated_ip=min_ip,
+                           translated_port=0, cookie=0, idle_timeout=0):
+      ofproto = forwarder.ofproto
+      parser = forwarder.ofproto_parser
+      
+      match = parser.OFPMatch(**dict(
+        self._match_data, **{ip_field_name: matched_ip, port_field_name: matched_port}))
+      actions = [parser.OFPActionSetField(**{ip_field_name: translated_ip}),
+                 parser.OFPActionSetField(**{port_field_name: translated_port})]
+      instructions = [
+        parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions),
+        parser.OFPInstructionGotoTable(next_table_id)
+      ]
+      flow_mod = parser.OFPFlowMod(forwarder, command=ofproto.OFPFC_ADD, match=match,
+        instructions=instructions, table_id=table_id, idle_timeout=idle_timeout,
+        priority=priority, cookie=cookie, flags=ofproto.OFPFF_SEND_FLOW_REM)
+      flow_mod.xid = 0
+      flow_mod.serialize()
+      
+      return bytes(flow_mod.buf)
+    
+    self._buf = serialize_flow_mod()
+    
+    # The offset of each variable value is the first byte that differs from the
+    # placeholder when the value is set to its maximum.
+    offsets = {}
+    for value_name, max_value in [
+        ('matched_ip', max_ip), ('matched_port', 0xffff),
+        ('translated_ip', max_ip), ('translated_port', 0xffff),
+        ('cookie', 0xffffffffffffffff), ('idle_timeout', 0xffff)]:
+      buf = serialize_flow_mod(**{value_name: max_value})
+      offsets[value_name] = next(
+        offset for offset, (byte_, max_byte) in enumerate(zip(self._buf, buf)) if byte_ != max_byte)
+    
+    self._matched_ip_offset = offsets['matched_ip']
+    self._matched_port_offset = offsets['matched_port']
+    self._translated_ip_offset = offsets['translated_ip']
+    self._translated_port_offset = offsets['translated_port']
+    self._cookie_offset = offsets['cookie']
+    self._idle_timeout_offset = offsets['idle_timeout']
+  
+  def build_flow_mod(self, nat_table_entry, idle_timeout, cookie):
+    """
+    Return the flow modification (`dphelper.PreserializedMsg`) adding the NAT
+    flow entry of the NAT table entry.
+    """
+    
+    matched_ip, matched_port = self._get_matched_ip_and_port(nat_table_entry)
+    translated_ip, translated_port = self._get_translated_ip_and_port(nat_table_entry)
+    
+    buf = bytearray(self._buf)
+    buf[self._matched_ip_offset:self._matched_ip_offset + self._ip_length] = (
+      socket.inet_pton(self._socket_address_family, matched_ip))
+    buf[self._translated_ip_offset:self._translated_ip_offset + self._ip_length] = (
+      socket.inet_pton(self._socket_address_family, translated_ip))
+    self._PORT_STRUCT.pack_into(buf, self._matched_port_offset, matched_port)
+    self._PORT_STRUCT.pack_into(buf, self._translated_port_offset, translated_port)
+    self._COOKIE_STRUCT.pack_into(buf, self._cookie_offset, cookie)
+    self._IDLE_TIMEOUT_STRUCT.pack_into(buf, self._idle_timeout_offset, idle_timeout)
+    
+    return dphelper.PreserializedMsg(self._forwarder, buf)
+  
+  def get_match_data(self, nat_table_entry):
+    """
+    Return the match fields of the NAT flow entry of the NAT table entry as
+    keyword arguments of `OFPMatch`.
+    """
+    
+    matched_ip, matched_port = self._get_matched_ip_and_port(nat_table_entry)
+    
+    return dict(
+      self._match_data, **{self._ip_field_name: matched_ip, self._port_field_name: matched_port})
+
+
+#===============================================================================
+
 
 class NatInstaller(object):
   
@@ -44,13 +270,29 @@ class NatInstaller(object):
   
   * installs NAT flow tables into the specified forwarder
   * installs NAT flow entries
-  * uninstalls NAT flow entries
+  * uninstalls NAT flow entries, individually or in bulk by internal or
+    external IP address
   * updates lifetime of existing NAT flow entries
+  * requests NAT flow entries installed in the forwarder, e.g. to reconcile them
+    with the NAT table
+  * requests the capacity of the NAT flow tables
+  
+  NAT flow entries are tagged with cookies (see `get_nat_cookie`) so that the
+  flow entries of an internal or external IP address can be removed with a
+  single flow modification.
+  
+  Flow modifications adding NAT flow entries are built from templates
+  serialized once per forwarder for each address family, protocol, translation
+  direction and priority.
   """
   
-  _TRANSLATION_DIRECTIONS = (_INTERNAL_TO_EXTERNAL, _EXTERNAL_TO_INTERNAL) = (0, 1)
+  _TRANSLATION_DIRECTIONS = (_INTERNAL_TO_EXTERNAL, _EXTERNAL_TO_INTERNAL) = (
+    NatTranslationDirection.DIRECTIONS)
   
-  def __init__(self, forwarder, external_port, table_ids, next_table_id):
+  def __init__(self, forwarder, external_port, table_ids, next_table_id,
+               refresh_mode=app_config['nat_flow_refresh_mode'],
+               refresh_tolerance=app_config['nat_flow_refresh_tolerance_seconds'],
+               nat_pool_config=app_config['default_nat_pool_config']):
     """
     Install NAT tables on the specified forwarder.
     
@@ -62,11 +304,23 @@ class NatInstaller(object):
     
     `next_table_id` is the table ID where packets should be forwarded to if they
     don't match the flow entries in tables specified in `table_ids`. 
+    
+    `refresh_mode` is one of the `NatFlowRefreshMode` modes. `refresh_tolerance`
+    is the tolerance in seconds used in the `SKIP_WITHIN_TOLERANCE` mode.
+    
+    `nat_pool_config` is the NAT pool configuration (see `NatTable`) used to
+    compute IP address indexes in cookies.
     """
     
     self._forwarder = forwarder
     self._external_port = external_port
     
+    self._refresh_mode = refresh_mode
+    self._refresh_tolerance = refresh_tolerance
+    
+    self._internal_ip_low_end_value = nattable.ip_to_int(nat_pool_config['internal_ip_low_end'])
+    self._external_ip_low_end_value = nattable.ip_to_int(nat_pool_config['external_ip_low_end'])
+    
     self._table_ids = {
       'nat_port_match': table_ids[0],
       'nat_internal_to_external': table_ids[1],
@@ -74,21 +328,81 @@ class NatInstaller(object):
     }
     self._next_table_id = next_table_id
     
+    # Key: (address family, protocol, translation direction, priority)
+    # Value: _NatFlowModTemplate
+    self._flow_mod_templates = {}
+    
+    self._install_table_port_matching()
+  
+  @property
+  def refresh_mode(self):
+    return self._refresh_mode
+  
+  @property
+  def forwarder_id(self):
+    return self._forwarder.id
+  
+  def is_lifetime_refresh_needed(self, nat_table_entry, new_expiry_time):
+    """
+    Return False if the NAT flow entries and the NAT table entry should be kept
+    intact despite the lifetime refresh, True otherwise.
+    
+    In the `SKIP_WITHIN_TOLERANCE` mode, the refresh is skipped if
+    `new_expiry_time` extends the current expiry time of the NAT table entry by
+    at most the tolerance and by less than half of the lifetime. The remaining
+    lifetime after a skipped refresh is thus more than half of the lifetime, so
+    a client refreshing the mapping entry at least every half of its lifetime
+    never lets it expire, even if the lifetime is shorter than the tolerance.
+    """
+    
+    if self._refresh_mode != NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE:
+      return True
+    
+    expiry_time_extension = new_expiry_time - nat_table_entry.expiry_time
+    return not (
+      0 <= expiry_time_extension <= self._refresh_tolerance and
+      expiry_time_extension < nat_table_entry.lifetime / 2.0)
+  
+  def set_forwarder(self, forwarder):
+    """
+    Install NAT tables on a new forwarder (e.g. after the forwarder reconnected)
+    and use it for subsequent flow entry modifications.
+    """
+    
+    self._forwarder = forwarder
+    self._flow_mod_templates = {}
     self._install_table_port_matching()
   
+  def flush(self):
+    """
+    Send the flow modifications held back by the forwarder (see
+    `dphelper.FlowModBatcher`) right away.
+    """
+    
+    self._forwarder.flush()
+  
   def install_nat_entry(self, nat_table_entry, priority=app_config['default_nat_flow_entry_priority']):
     """
     Install new flow entries to the NAT forwarder matching the NAT table entry.
+    Return the XIDs of the sent flow modifications.
     
     `priority` defines the flow entry priority. Make sure the priority is higher
     than the no-match entry, otherwise the no-match entry may be preferred. The
     default priority value ensures that the NAT flow entries will be preferred.
     """
     
-    self._install_nat_entry(self._table_ids['nat_internal_to_external'],
-      nat_table_entry, self._INTERNAL_TO_EXTERNAL, priority)
-    self._install_nat_entry(self._table_ids['nat_external_to_internal'],
-      nat_table_entry, self._EXTERNAL_TO_INTERNAL, priority)
+    return [
+      self._install_nat_entry(nat_table_entry, self._INTERNAL_TO_EXTERNAL, priority),
+      self._install_nat_entry(nat_table_entry, self._EXTERNAL_TO_INTERNAL, priority)]
+  
+  def install_nat_flow_entry(self, nat_table_entry, flow_entry_id,
+                             priority=app_config['default_nat_flow_entry_priority']):
+    """
+    Install only the flow entry of the NAT table entry identified by
+    `flow_entry_id` (see `get_nat_flow_entry_ids`).
+    """
+    
+    self._install_nat_entry(nat_table_entry, flow_entry_id[0], priority)
   
   def uninstall_nat_entry(self, nat_table_entry, priority=app_config['default_nat_flow_entry_priority']):
     """
@@ -100,101 +414,292 @@ class NatInstaller(object):
     self._uninstall_nat_entry(self._table_ids['nat_external_to_internal'],
       nat_table_entry, self._EXTERNAL_TO_INTERNAL, priority)
   
-  def modify_nat_entry_lifetime(self, nat_table_entry, priority=app_config['default_nat_flow_entry_priority']):
+  def uninstall_nat_flow_entry(self, nat_table_entry, flow_entry_id,
+                               priority=app_config['default_nat_flow_entry_priority']):
+    """
+    Uninstall only the flow entry of the NAT table entry identified by
+    `flow_entry_id` (see `get_nat_flow_entry_ids`).
     """
-    Modify the lifetime of existing NAT flow entries matching the NAT table entry.
     
-    Implementation note:
+    translation_direction = flow_entry_id[0]
+    self._uninstall_nat_entry(self._get_table_id(translation_direction),
+      nat_table_entry, translation_direction, priority)
+  
+  def uninstall_nat_entries_by_internal_ip(self, internal_ip, nat_table_entries,
+                                          priority=app_config['default_nat_flow_entry_priority']):
+    """
+    Uninstall flow entries of all NAT table entries of the internal IP address.
     
-    To update the lifetime on the flow entries, `idle_timeout` has to be
-    modified. According to the OpenFlow switch specification 1.3,
-    `OFPFC_MODIFY` does not modify `idle_timeout`. To work around this, the flow
-    entries are simply removed and added back (with the modified timeout value)
-    so that the modification of `idle_timeout` takes effect.
+    `nat_table_entries` are the NAT table entries of the internal IP address.
+    They are uninstalled individually only if the index of the IP address does
+    not fit in the cookie.
     """
     
-    self.uninstall_nat_entry(nat_table_entry, priority)
-    self.install_nat_entry(nat_table_entry, priority)
+    internal_ip_index = self._get_ip_index(internal_ip, self._internal_ip_low_end_value)
+    if internal_ip_index != _COOKIE_NO_IP_INDEX:
+      self._uninstall_nat_table_entries_by_cookie(
+        get_nat_cookie(internal_ip_index, 0, 0),
+        NAT_COOKIE_MARKER_MASK | _COOKIE_IP_INDEX_MASK)
+    else:
+      for nat_table_entry in nat_table_entries:
+        self.uninstall_nat_entry(nat_table_entry, priority)
   
-  def _install_nat_entry(self, table_id, nat_table_entry, translation_direction, priority):
-    match_data = self._get_match_data(nat_table_entry, translation_direction)
-    action_set_data = self._get_action_set_data(nat_table_entry, translation_direction)
-    self._install_nat_table_entry(table_id, match_data, action_set_data,
-                                  nat_table_entry.lifetime, priority)
+  def uninstall_nat_entries_by_external_ip(self, external_ip, nat_table_entries,
+                                          priority=app_config['default_nat_flow_entry_priority']):
+    """
+    Uninstall flow entries of all NAT table entries of the external IP address.
+    
+    `nat_table_entries` are the NAT table entries of the external IP address.
+    They are uninstalled individually only if the index of the IP address does
+    not fit in the cookie.
+    """
+    
+    external_ip_index = self._get_ip_index(external_ip, self._external_ip_low_end_value)
+    if external_ip_index != _COOKIE_NO_IP_INDEX:
+      self._uninstall_nat_table_entries_by_cookie(
+        get_nat_cookie(0, external_ip_index, 0),
+        NAT_COOKIE_MARKER_MASK | (_COOKIE_IP_INDEX_MASK << _COOKIE_EXTERNAL_IP_INDEX_SHIFT))
+    else:
+      for nat_table_entry in nat_table_entries:
+        self.uninstall_nat_entry(nat_table_entry, priority)
   
-  def _uninstall_nat_entry(self, table_id, nat_table_entry, translation_direction, priority):
-    match_data = self._get_match_data(nat_table_entry, translation_direction)
-    self._uninstall_nat_table_entry(table_id, match_data, priority)
+  def uninstall_all_nat_entries(self):
+    """
+    Uninstall all NAT flow entries.
+    """
+    
+    self._uninstall_nat_table_entries_by_cookie(NAT_COOKIE_MARKER, NAT_COOKIE_MARKER_MASK)
   
-  def _get_match_data(self, nat_table_entry, translation_direction):
-    if translation_direction == self._INTERNAL_TO_EXTERNAL:
+  def uninstall_flow_entry(self, flow_stats):
+    """
+    Uninstall the flow entry described by `flow_stats` (`OFPFlowStats`). Flow
+    entries with the same match fields and a different priority are kept.
+    """
+    
+    dphelper.remove_flow_entry(self._forwarder, flow_stats.match, strict=True,
+                               table_id=flow_stats.table_id, priority=flow_stats.priority)
+  
+  def request_nat_flow_entries(self, cookie=NAT_COOKIE_MARKER, cookie_mask=NAT_COOKIE_MARKER_MASK):
+    """
+    Request statistics of the flow entries in the translation tables whose
+    cookie matches `cookie` under `cookie_mask`. Return the XIDs of the sent
+    `OFPFlowStatsRequest` messages; the flow entries are received in
+    `OFPFlowStatsReply` messages with the same XIDs.
+    """
+    
+    parser = self._forwarder.ofproto_parser
+    
+    xids = []
+    for translation_direction in self._TRANSLATION_DIRECTIONS:
+      request = parser.OFPFlowStatsRequest(self._forwarder,
+        table_id=self._get_table_id(translation_direction),
+        cookie=cookie, cookie_mask=cookie_mask)
+      self._forwarder.send_msg(request)
+      xids.append(request.xid)
+    
+    return xids
+  
+  def request_nat_table_features(self):
+    """
+    Request features of all flow tables of the forwarder. Return the XID of the
+    sent `OFPTableFeaturesStatsRequest` message. Pass the bodies of the replies
+    to `get_nat_table_max_entries`.
+    """
+    
+    # A request with an empty body only queries the table features.
+    request = self._forwarder.ofproto_parser.OFPTableFeaturesStatsRequest(self._forwarder)
+    self._forwarder.send_msg(request)
+    
+    return request.xid
+  
+  def get_nat_table_max_entries(self, table_features_list):
+    """
+    Return the maximum number of flow entries both translation tables can hold
+    given the list of `OFPTableFeaturesStats`, or None if the list does not
+    contain the translation tables.
+    """
+    
+    translation_table_ids = [self._get_table_id(translation_direction)
+                             for translation_direction in self._TRANSLATION_DIRECTIONS]
+    max_entries = [table_features.max_entries for table_features in table_features_list
+                   if table_features.table_id in translation_table_ids]
+    
+    return min(max_entries) if max_entries else None
+  
+  def get_nat_flow_entry_ids(self, nat_table_entry):
+    """
+    Return the identifiers of the two flow entries of the NAT table entry.
+    
+    A flow entry identifier is a (translation direction, key of the matched IP
+    address and port, key of the translated IP address and port) tuple, where
+    keys are computed by `nattable.get_key`.
+    """
+    
+    internal_key = nattable.get_key(
+      nat_table_entry.internal_ip, nat_table_entry.internal_port, nat_table_entry.protocol)
+    external_key = nattable.get_key(
+      nat_table_entry.external_ip, nat_table_entry.external_port, nat_table_entry.protocol)
+    
+    return [(self._INTERNAL_TO_EXTERNAL, internal_key, external_key),
+            (self._EXTERNAL_TO_INTERNAL, external_key, internal_key)]
+  
+  def get_flow_entry_match_key(self, table_id, match):
+    """
+    Return the (translation direction, key of the matched IP address and port)
+    tuple of the NAT flow entry in the table `table_id` with match fields
+    `match` (`OFPMatch`), e.g. from an `OFPFlowRemoved` message. The tuple is
+    the prefix of the flow entry identifier (see `get_nat_flow_entry_ids`).
+    
+    If the flow entry is not a NAT flow entry, return None.
+    """
+    
+    if table_id == self._table_ids['nat_internal_to_external']:
+      translation_direction = self._INTERNAL_TO_EXTERNAL
       field_name_direction_suffix = 'src'
-      nat_table_entry_attr_name_prefix = 'internal'
-    elif translation_direction == self._EXTERNAL_TO_INTERNAL:
+    elif table_id == self._table_ids['nat_external_to_internal']:
+      translation_direction = self._EXTERNAL_TO_INTERNAL
       field_name_direction_suffix = 'dst'
-      nat_table_entry_attr_name_prefix = 'external'
     else:
-      raise ValueError("invalid translation direction: {0}".format(translation_direction))
+      return None
     
-    ip_field_name = MATCH_FIELD_NAME_MAPS['ip_' + field_name_direction_suffix][nat_table_entry.address_family]
-    port_field_name = MATCH_FIELD_NAME_MAPS['port_' + field_name_direction_suffix][nat_table_entry.protocol]
+    try:
+      protocol = match['ip_proto']
+      ip_field_name = MATCH_FIELD_NAME_MAPS['ip_' + field_name_direction_suffix][match['eth_type']]
+      port_field_name = MATCH_FIELD_NAME_MAPS['port_' + field_name_direction_suffix][protocol]
+      
+      return (translation_direction,
+              nattable.get_key(match[ip_field_name], match[port_field_name], protocol))
+    except KeyError:
+      return None
+  
+  def get_flow_entry_id(self, flow_stats):
+    """
+    Return the identifier (see `get_nat_flow_entry_ids`) of the flow entry
+    described by `flow_stats` (`OFPFlowStats`). If the flow entry does not
+    translate addresses as installed by this class, return None.
+    """
     
-    match_data = {
-      'eth_type': nat_table_entry.address_family,
-      'ip_proto': nat_table_entry.protocol,
-      ip_field_name: getattr(nat_table_entry, nat_table_entry_attr_name_prefix + '_ip'),
-      port_field_name: getattr(nat_table_entry, nat_table_entry_attr_name_prefix + '_port')
-    }
+    flow_entry_match_key = self.get_flow_entry_match_key(flow_stats.table_id, flow_stats.match)
+    if flow_entry_match_key is None:
+      return None
     
-    return match_data
-  
-  def _get_action_set_data(self, nat_table_entry, translation_direction):
-    # `nat_table_entry_attr_name_prefix` is intentionally switched since action
-    # fields set the IP addresses and ports to the opposite direction (e.g.
-    # source internal IP address is set to external).
+    translation_direction = flow_entry_match_key[0]
     if translation_direction == self._INTERNAL_TO_EXTERNAL:
       field_name_direction_suffix = 'src'
-      nat_table_entry_attr_name_prefix = 'external'
-    elif translation_direction == self._EXTERNAL_TO_INTERNAL:
-      field_name_direction_suffix = 'dst'
-      nat_table_entry_attr_name_prefix = 'internal'
     else:
-      raise ValueError("invalid translation direction: {0}".format(translation_direction))
+      field_name_direction_suffix = 'dst'
     
-    ip_field_name = MATCH_FIELD_NAME_MAPS['ip_' + field_name_direction_suffix][nat_table_entry.address_family]
-    port_field_name = MATCH_FIELD_NAME_MAPS['port_' + field_name_direction_suffix][nat_table_entry.protocol]
+    parser = self._forwarder.ofproto_parser
     
-    action_set_data = {
-      ip_field_name: getattr(nat_table_entry, nat_table_entry_attr_name_prefix + '_ip'),
-      port_field_name: getattr(nat_table_entry, nat_table_entry_attr_name_prefix + '_port')
-    }
+    action_set_field_data = {}
+    for instruction in flow_stats.instructions:
+      if isinstance(instruction, parser.OFPInstructionActions):
+        for action in instruction.actions:
+          if isinstance(action, parser.OFPActionSetField):
+            action_set_field_data[action.key] = action.value
     
-    return action_set_data
+    # Match fields and action fields refer to the same direction (e.g. the
+    # source internal IP address is matched and set to the external one).
+    match = flow_stats.match
+    protocol = match['ip_proto']
+    ip_field_name = MATCH_FIELD_NAME_MAPS['ip_' + field_name_direction_suffix][match['eth_type']]
+    port_field_name = MATCH_FIELD_NAME_MAPS['port_' + field_name_direction_suffix][protocol]
+    try:
+      return flow_entry_match_key + (
+        nattable.get_key(action_set_field_data[ip_field_name],
+                         action_set_field_data[port_field_name], protocol),)
+    except KeyError:
+      return None
   
-  def _install_nat_table_entry(self, table_id, match_data, action_set_field_data,
-                               lifetime, priority):
+  def modify_nat_entry_lifetime(self, nat_table_entry, priority=app_config['default_nat_flow_entry_priority']):
     """
-    Install the NAT table entry.
+    Modify the lifetime of existing NAT flow entries matching the NAT table entry.
+    
+    Implementation note:
     
-    Once the flow entry expires (defined by `lifetime`), the controller is
+    To update the lifetime on the flow entries, `idle_timeout` has to be
+    modified. According to the OpenFlow switch specification 1.3,
+    `OFPFC_MODIFY` does not modify `idle_timeout`. To work around this, the
+    following is performed depending on the refresh mode:
+    
+    * `REINSTALL` - the flow entries are simply removed and added back (with the
+      modified timeout value) so that the modification of `idle_timeout` takes
+      effect.
+    * `SKIP_WITHIN_TOLERANCE` - the flow entries are added again. `OFPFC_ADD`
+      replaces a flow entry with identical match fields and priority, including
+      its timeouts, without a window where the translation is missing.
+    * `CONTROLLER_EXPIRY` - the flow entries have no timeout, nothing is sent.
+    """
+    
+    if self._refresh_mode == NatFlowRefreshMode.CONTROLLER_EXPIRY:
+      return
+    elif self._refresh_mode == NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE:
+      self.install_nat_entry(nat_table_entry, priority)
+    else:
+      self.uninstall_nat_entry(nat_table_entry, priority)
+      self.install_nat_entry(nat_table_entry, priority)
+  
+  def _install_nat_entry(self, nat_table_entry, translation_direction, priority):
+    """
+    Install the NAT flow entry of the NAT table entry. Return the XID of the
+    flow modification.
+    
+    Once the flow entry expires (defined by the idle timeout), the controller is
     notified of the removal (using the `OFPFF_SEND_FLOW_REM` flag when
-    installing the flow entry).
+    installing the flow entry). In the `CONTROLLER_EXPIRY` refresh mode, the
+    flow entry does not expire.
     """
     
-    ofproto = self._forwarder.ofproto
-    parser = self._forwarder.ofproto_parser
+    if self._refresh_mode == NatFlowRefreshMode.CONTROLLER_EXPIRY:
+      idle_timeout = 0
+    else:
+      idle_timeout = nat_table_entry.lifetime
     
-    match = parser.OFPMatch(**match_data)
-    actions = [parser.OFPActionSetField(**{field_name: field_value})
-               for field_name, field_value in action_set_field_data.items()]
-    instructions = [
-      parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions),
-      parser.OFPInstructionGotoTable(self._next_table_id)
-    ]
-    dphelper.add_flow_entry(
-      self._forwarder, match, actions, instructions=instructions,
-      table_id=table_id, idle_timeout=lifetime, priority=priority,
-      flags=ofproto.OFPFF_SEND_FLOW_REM)
+    flow_mod_template = self._get_flow_mod_template(nat_table_entry, translation_direction, priority)
+    flow_mod = flow_mod_template.build_flow_mod(
+      nat_table_entry, idle_timeout, self._get_cookie(nat_table_entry, translation_direction))
+    self._forwarder.send_msg(flow_mod)
+    
+    return flow_mod.xid
+  
+  def _uninstall_nat_entry(self, table_id, nat_table_entry, translation_direction, priority):
+    flow_mod_template = self._get_flow_mod_template(nat_table_entry, translation_direction, priority)
+    self._uninstall_nat_table_entry(
+      table_id, flow_mod_template.get_match_data(nat_table_entry), priority)
+  
+  def _get_flow_mod_template(self, nat_table_entry, translation_direction, priority):
+    key = (nat_table_entry.address_family, nat_table_entry.protocol, translation_direction, priority)
+    
+    flow_mod_template = self._flow_mod_templates.get(key)
+    if flow_mod_template is None:
+      flow_mod_template = _NatFlowModTemplate(self._forwarder,
+        self._get_table_id(translation_direction), self._next_table_id,
+        nat_table_entry.address_family, nat_table_entry.protocol,
+        translation_direction, priority)
+      self._flow_mod_templates[key] = flow_mod_template
+    
+    return flow_mod_template
+  
+  def _get_table_id(self, translation_direction):
+    if translation_direction == self._INTERNAL_TO_EXTERNAL:
+      return self._table_ids['nat_internal_to_external']
+    elif translation_direction == self._EXTERNAL_TO_INTERNAL:
+      return self._table_ids['nat_external_to_internal']
+    else:
+      raise ValueError("invalid translation direction: {0}".format(translation_direction))
+  
+  def _get_cookie(self, nat_table_entry, translation_direction):
+    return get_nat_cookie(
+      self._get_ip_index(nat_table_entry.internal_ip, self._internal_ip_low_end_value),
+      self._get_ip_index(nat_table_entry.external_ip, self._external_ip_low_end_value),
+      translation_direction)
+  
+  def _get_ip_index(self, ip, ip_low_end_value):
+    ip_index = nattable.ip_to_int(ip) - ip_low_end_value
+    if 0 <= ip_index < _COOKIE_NO_IP_INDEX:
+      return ip_index
+    else:
+      return _COOKIE_NO_IP_INDEX
   
   def _uninstall_nat_table_entry(self, table_id, match_data, priority):
     parser = self._forwarder.ofproto_parser
@@ -203,6 +708,14 @@ class NatInstaller(object):
     dphelper.remove_flow_entry(self._forwarder, match, table_id=table_id,
                                priority=priority)
   
+  def _uninstall_nat_table_entries_by_cookie(self, cookie, cookie_mask):
+    ofproto = self._forwarder.ofproto
+    parser = self._forwarder.ofproto_parser
+    
+    dphelper.remove_flow_entry(self._forwarder, parser.OFPMatch(),
+                               table_id=ofproto.OFPTT_ALL,
+                               cookie=cookie, cookie_mask=cookie_mask)
+  
   def _install_table_port_matching(self):
     parser = self._forwarder.ofproto_parser
     
@@ -0,0 +1,257 @@
+"""
+This module persists NAT table entries in an append-only binary journal so that
+mapping entries can be recovered after the controller restarts.
+"""
+
+#===============================================================================
+
+import mmap
+import os
+import socket
+import struct
+import time
+import zlib
+
+from . import nattable
+
+from ..app_config import app_config
+
+import logging
+
+#===============================================================================
+
+
+class NatJournalRecordType(object):
+  RECORD_TYPES = CREATE, REFRESH, REMOVE = (1, 2, 3)
+
+
+class NatJournalError(Exception):
+  pass
+
+
+#===============================================================================
+
+_FILE_MAGIC = b"PCPJ"
+_FILE_VERSION = 1
+# magic, version
+_FILE_HEADER_STRUCT = struct.Struct("!4sH")
+
+# record type, protocol, address family, internal IP address, internal port,
+# external IP address, external port, lifetime, expiry time
+_RECORD_STRUCT = struct.Struct("!BBH16sH16sHLd")
+_RECORD_CHECKSUM_STRUCT = struct.Struct("!L")
+_RECORD_LENGTH = _RECORD_STRUCT.size + _RECORD_CHECKSUM_STRUCT.size
+
+_IPV4_MAPPED_IPV6_PREFIX = b"\x00" * 10 + b"\xff\xff"
+
+
+def _ip_addr_to_packed_str(ip_addr):
+  if ':' in ip_addr:
+    return socket.inet_pton(socket.AF_INET6, ip_addr)
+  else:
+    return _IPV4_MAPPED_IPV6_PREFIX + socket.inet_aton(ip_addr)
+
+
+def _packed_str_to_ip_addr(ip_addr_packed):
+  if ip_addr_packed[:12] == _IPV4_MAPPED_IPV6_PREFIX:
+    return socket.inet_ntoa(ip_addr_packed[12:])
+  else:
+    return socket.inet_ntop(socket.AF_INET6, ip_addr_packed)
+
+
+#===============================================================================
+
+
+class NatJournal(object):
+  
+  """
+  This class records creation, refresh and removal of NAT table entries in an
+  append-only journal file and keeps compacted snapshots of the NAT table.
+  
+  The journal is stored in `<path_prefix>.journal` and the snapshot in
+  `<path_prefix>.snapshot`. Both files consist of a header followed by
+  fixed-size records. Each record carries a CRC-32 checksum; replay stops at
+  the first truncated or corrupted record, which can only be the last record
+  written before a crash.
+  
+  Records are flushed to the operating system after each write, so they
+  survive a crash of the controller. Snapshots are synced to the disk and
+  atomically replace the previous snapshot.
+  
+  Once the journal contains `compaction_threshold` records, `compact_if_due`
+  writes a new snapshot and empties the journal.
+  """
+  
+  def __init__(self, path_prefix, clock=time.time,
+               compaction_threshold=app_config['nat_journal_compaction_threshold']):
+    self._journal_path = path_prefix + ".journal"
+    self._snapshot_path = path_prefix + ".snapshot"
+    self._clock = clock
+    self._compaction_threshold = compaction_threshold
+    
+    self._journal_file = None
+    self._num_journal_records = 0
+  
+  @property
+  def num_journal_records(self):
+    return self._num_journal_records
+  
+  def load(self):
+    """
+    Replay the snapshot and the journal and return the list of NAT table
+    entries (`NatTableEntry`) that have not expired yet. Open the journal for
+    recording afterwards.
+    
+    This method must be called before any record is written.
+    """
+    
+    # Key: `nattable.get_key(internal IP, internal port, protocol)`
+    # Value: NatTableEntry
+    entries = {}
+    
+    self._replay(self._snapshot_path, entries)
+    valid_journal_length, self._num_journal_records = self._replay(self._journal_path, entries)
+    
+    self._open_journal(valid_journal_length)
+    
+    now = self._clock()
+    return [entry for entry in entries.values() if entry.expiry_time > now]
+  
+  def record_create(self, nat_table_entry):
+    self._append(NatJournalRecordType.CREATE, nat_table_entry)
+  
+  def record_refresh(self, nat_table_entry):
+    self._append(NatJournalRecordType.REFRESH, nat_table_entry)
+  
+  def record_remove(self, nat_table_entry):
+    self._append(NatJournalRecordType.REMOVE, nat_table_entry)
+  
+  def record_remove_entries(self, nat_table_entries):
+    for nat_table_entry in nat_table_entries:
+      self._append(NatJournalRecordType.REMOVE, nat_table_entry, flush=False)
+    self._journal_file.flush()
+  
+  def compact_if_due(self, nat_table_entries_getter):
+    """
+    If the journal reached the compaction threshold, call
+    `compact(nat_table_entries_getter())`. Return True if the journal was
+    compacted, False otherwise.
+    """
+    
+    if self._num_journal_records < self._compaction_threshold:
+      return False
+    
+    self.compact(nat_table_entries_getter())
+    return True
+  
+  def compact(self, nat_table_entries):
+    """
+    Write the NAT table entries as a new snapshot and empty the journal.
+    """
+    
+    temp_snapshot_path = self._snapshot_path + ".tmp"
+    
+    with open(temp_snapshot_path, 'wb') as snapshot_file:
+      snapshot_file.write(_FILE_HEADER_STRUCT.pack(_FILE_MAGIC, _FILE_VERSION))
+      for nat_table_entry in nat_table_entries:
+        snapshot_file.write(self._pack_record(NatJournalRecordType.CREATE, nat_table_entry))
+      snapshot_file.flush()
+      os.fsync(snapshot_file.fileno())
+    
+    os.rename(temp_snapshot_path, self._snapshot_path)
+    
+    # Records in the journal are already contained in the snapshot.
+    self._journal_file.seek(0)
+    self._journal_file.truncate(_FILE_HEADER_STRUCT.size)
+    self._journal_file.seek(0, os.SEEK_END)
+    self._journal_file.flush()
+    self._num_journal_records = 0
+    
+    logging.info("Compacted NAT journal '{0}'".format(self._journal_path))
+  
+  def close(self):
+    if self._journal_file is not None:
+      self._journal_file.flush()
+      os.fsync(self._journal_file.fileno())
+      self._journal_file.close()
+      self._journal_file = None
+  
+  def _append(self, record_type, nat_table_entry, flush=True):
+    self._journal_file.write(self._pack_record(record_type, nat_table_entry))
+    if flush:
+      self._journal_file.flush()
+    self._num_journal_records += 1
+  
+  def _pack_record(self, record_type, nat_table_entry):
+    record = _RECORD_STRUCT.pack(record_type, nat_table_entry.protocol,
+      nat_table_entry.address_family,
+      _ip_addr_to_packed_str(nat_table_entry.internal_ip), nat_table_entry.internal_port,
+      _ip_addr_to_packed_str(nat_table_entry.external_ip), nat_table_entry.external_port,
+      nat_table_entry.lifetime, nat_table_entry.expiry_time)
+    
+    return record + _RECORD_CHECKSUM_STRUCT.pack(zlib.crc32(record) & 0xffffffff)
+  
+  def _replay(self, path, entries):
+    """
+    Apply records from the file to `entries`. Return the length of the valid
+    part of the file in bytes and the number of valid records.
+    """
+    
+    if not os.path.exists(path) or os.path.getsize(path) < _FILE_HEADER_STRUCT.size:
+      return 0, 0
+    
+    with open(path, 'rb') as file_:
+      data = mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        magic, version = _FILE_HEADER_STRUCT.unpack_from(data, 0)
+        if magic != _FILE_MAGIC or version != _FILE_VERSION:
+          raise NatJournalError("invalid NAT journal file '{0}'".format(path))
+        
+        offset = _FILE_HEADER_STRUCT.size
+        num_records = 0
+        while offset + _RECORD_LENGTH <= len(data):
+          record = data[offset:offset + _RECORD_STRUCT.size]
+          checksum = _RECORD_CHECKSUM_STRUCT.unpack_from(data, offset + _RECORD_STRUCT.size)[0]
+          if zlib.crc32(record) & 0xffffffff != checksum:
+            break
+          
+          self._apply_record(_RECORD_STRUCT.unpack(record), entries)
+          offset += _RECORD_LENGTH
+          num_records += 1
+      finally:
+        data.close()
+    
+    if offset < os.path.getsize(path):
+      logging.warning("Ignored incomplete records at the end of NAT journal file '{0}'".format(path))
+    
+    return offset, num_records
+  
+  def _apply_record(self, record_fields, entries):
+    (record_type, protocol, address_family, internal_ip_packed, internal_port,
+     external_ip_packed, external_port, lifetime, expiry_time) = record_fields
+    
+    internal_ip = _packed_str_to_ip_addr(internal_ip_packed)
+    key = nattable.get_key(internal_ip, internal_port, protocol)
+    
+    if record_type == NatJournalRecordType.CREATE:
+      entries[key] = nattable.NatTableEntry(address_family, protocol,
+        internal_ip, internal_port, _packed_str_to_ip_addr(external_ip_packed), external_port,
+        lifetime, expiry_time)
+    elif record_type == NatJournalRecordType.REFRESH:
+      entry = entries.get(key)
+      if entry is not None:
+        entry.lifetime = lifetime
+        entry.expiry_time = expiry_time
+    elif record_type == NatJournalRecordType.REMOVE:
+      entries.pop(key, None)
+  
+  def _open_journal(self, valid_journal_length):
+    if valid_journal_length == 0:
+      self._journal_file = open(self._journal_path, 'wb')
+      self._journal_file.write(_FILE_HEADER_STRUCT.pack(_FILE_MAGIC, _FILE_VERSION))
+      self._journal_file.flush()
+    else:
+      # Discard incomplete records at the end of the journal.
+      self._journal_file = open(self._journal_path, 'r+b')
+      self._journal_file.truncate(valid_journal_length)
+      self._journal_file.seek(0, os.SEEK_END)
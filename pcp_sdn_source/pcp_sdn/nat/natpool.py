@@ -0,0 +1,48 @@
+"""
+This module partitions the NAT pool, e.g. among forwarders or among shards of
+the NAT table.
+"""
+
+#===============================================================================
+
+import netaddr
+
+#===============================================================================
+
+
+def partition_nat_pool_config(nat_pool_config, num_partitions):
+  """
+  Split the external IP address range of the NAT pool into `num_partitions`
+  contiguous ranges of (nearly) equal size. Return a list of NAT pool
+  configurations, one for each range. Other parameters are copied.
+  
+  Raise `ValueError` if the range contains fewer IP addresses than
+  `num_partitions`.
+  """
+  
+  external_ip_low_end = netaddr.IPAddress(nat_pool_config['external_ip_low_end'])
+  external_ip_high_end = netaddr.IPAddress(nat_pool_config['external_ip_high_end'])
+  num_external_ips = int(external_ip_high_end) - int(external_ip_low_end) + 1
+  
+  if num_partitions < 1 or num_external_ips < num_partitions:
+    raise ValueError(
+      "cannot split {0} external IP addresses into {1} partitions".format(
+        num_external_ips, num_partitions))
+  
+  nat_pool_configs = []
+  partition_low_end = int(external_ip_low_end)
+  for partition_index in range(num_partitions):
+    partition_size = num_external_ips // num_partitions
+    if partition_index < num_external_ips % num_partitions:
+      partition_size += 1
+    
+    partition_nat_pool_config = dict(nat_pool_config)
+    partition_nat_pool_config['external_ip_low_end'] = str(
+      netaddr.IPAddress(partition_low_end, external_ip_low_end.version))
+    partition_nat_pool_config['external_ip_high_end'] = str(
+      netaddr.IPAddress(partition_low_end + partition_size - 1, external_ip_low_end.version))
+    nat_pool_configs.append(partition_nat_pool_config)
+    
+    partition_low_end += partition_size
+  
+  return nat_pool_configs
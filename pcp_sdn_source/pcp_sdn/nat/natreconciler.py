@@ -0,0 +1,251 @@
+"""
+This module reconciles NAT flow entries installed in the NAT forwarder with the
+NAT table.
+"""
+
+#===============================================================================
+
+import logging
+import time
+
+from . import natinstaller
+from . import nattable
+
+from ..app_config import app_config
+
+#===============================================================================
+
+
+class NatFlowReconciler(object):
+  
+  """
+  This class converges the NAT flow entries installed in the forwarder to the
+  NAT table entries.
+  
+  Reconciliation can cover either all NAT flow entries (`start`, e.g. after the
+  forwarder reconnected or the controller restarted), or one page of NAT flow
+  entries at a time (`start_next_page`, to periodically detect drift caused by
+  lost flow modifications or flow removal messages).
+  
+  Flow entries are requested from the forwarder. Once all flow statistics
+  replies are passed to `handle_flow_stats_reply`, flow entries not matching any
+  NAT table entry are uninstalled and missing flow entries are installed. Flow
+  entries already in place are left intact, so that packets keep being
+  translated during reconciliation.
+  
+  Flow modifications sent after the flow statistics request are not reflected
+  in the replies. Such flow entries are at worst installed again or uninstalled
+  again, which leaves the forwarder consistent with the NAT table.
+  """
+  
+  def __init__(self, nat_table, nat_installer,
+               page_size=app_config['nat_reconciliation_page_size'],
+               max_flow_mods_per_page=app_config['nat_reconciliation_max_flow_mods_per_cycle'],
+               priority=app_config['default_nat_flow_entry_priority'],
+               timeout=app_config['nat_reconciliation_timeout_seconds'], clock=time.time):
+    """
+    A page contains NAT flow entries of `page_size` consecutive internal IP
+    addresses of the NAT pool, selected by the cookie of the flow entries (see
+    `natinstaller.get_nat_cookie`). `page_size` must be a power of two. Flow
+    entries of internal IP addresses outside the NAT pool are only reconciled by
+    `start`.
+    
+    At most `max_flow_mods_per_page` flow modifications are sent per page. If
+    more are needed, the same page is reconciled again by the next call to
+    `start_next_page`.
+    
+    `priority` is the priority of the NAT flow entries. Flow entries with a
+    different priority are uninstalled.
+    
+    A reconciliation whose flow statistics replies have not all arrived within
+    `timeout` seconds (as measured by `clock`) is abandoned, so that a lost
+    reply does not block later reconciliations.
+    """
+    
+    if page_size <= 0 or page_size & (page_size - 1):
+      raise ValueError("page size must be a power of two")
+    
+    self._nat_table = nat_table
+    self._nat_installer = nat_installer
+    self._page_size = page_size
+    self._max_flow_mods_per_page = max_flow_mods_per_page
+    self._priority = priority
+    self._timeout = timeout
+    self._clock = clock
+    
+    nat_pool_config = nat_table.nat_pool_config
+    self._internal_ip_low_end_value = nattable.ip_to_int(nat_pool_config['internal_ip_low_end'])
+    # IP indexes starting from `NUM_COOKIE_IP_INDEXES` are not stored in cookies.
+    self._num_internal_ip_indexes = min(
+      nattable.ip_to_int(nat_pool_config['internal_ip_high_end']) -
+      self._internal_ip_low_end_value + 1,
+      natinstaller.NUM_COOKIE_IP_INDEXES)
+    
+    self._pending_xids = set()
+    # Items: `OFPFlowStats` instances received so far
+    self._flow_stats = []
+    self._deadline = None
+    
+    # Internal IP index of the first IP address of the page being reconciled, or
+    # None if all NAT flow entries are being reconciled
+    self._page_first_index = None
+    self._next_page_first_index = 0
+  
+  @property
+  def in_progress(self):
+    return bool(self._pending_xids)
+  
+  def start(self):
+    """
+    Request all NAT flow entries from the forwarder. A reconciliation in
+    progress is restarted; replies to its requests are ignored.
+    """
+    
+    self._page_first_index = None
+    self._request_flow_entries(
+      natinstaller.NAT_COOKIE_MARKER, natinstaller.NAT_COOKIE_MARKER_MASK)
+  
+  def start_next_page(self):
+    """
+    Request NAT flow entries of the next page from the forwarder. Pages are
+    walked in the order of internal IP addresses, starting over after the last
+    page.
+    
+    Return True if the request was sent, False if a reconciliation is still in
+    progress. A reconciliation past its deadline is abandoned and its page is
+    requested again.
+    """
+    
+    if self.in_progress:
+      if self._clock() < self._deadline:
+        return False
+      
+      logging.warning("Abandoned NAT flow entry reconciliation, flow statistics replies timed out")
+      self._abandon()
+    
+    if self._next_page_first_index >= self._num_internal_ip_indexes:
+      self._next_page_first_index = 0
+    
+    self._page_first_index = self._next_page_first_index
+    self._request_flow_entries(*natinstaller.get_nat_cookie_filter_by_internal_ip_indexes(
+      self._page_first_index, self._page_size))
+    
+    return True
+  
+  def handle_flow_stats_reply(self, msg):
+    """
+    Process the `OFPFlowStatsReply` message. Return True if the message replies
+    to a pending request, False otherwise.
+    
+    Once the last reply is received, send the flow modifications needed to
+    converge the forwarder to the NAT table.
+    """
+    
+    if msg.xid not in self._pending_xids:
+      return False
+    
+    self._flow_stats.extend(msg.body)
+    
+    if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+      self._pending_xids.remove(msg.xid)
+      if not self._pending_xids:
+        self._converge()
+    
+    return True
+  
+  def handle_error(self, msg):
+    """
+    Process the `OFPErrorMsg` message. If the message refers to a pending
+    request, abandon the reconciliation without sending any flow modifications
+    and return True. Otherwise, return False.
+    """
+    
+    if msg.xid not in self._pending_xids:
+      return False
+    
+    logging.warning(
+      "Abandoned NAT flow entry reconciliation, flow statistics request failed "
+      "(type {0}, code {1})".format(msg.type, msg.code))
+    self._abandon()
+    
+    return True
+  
+  def _request_flow_entries(self, cookie, cookie_mask):
+    self._flow_stats = []
+    self._pending_xids = set(self._nat_installer.request_nat_flow_entries(cookie, cookie_mask))
+    self._deadline = self._clock() + self._timeout
+  
+  def _abandon(self):
+    # The page is not advanced, hence `start_next_page` requests it again.
+    self._pending_xids = set()
+    self._flow_stats = []
+  
+  def _converge(self):
+    if self._page_first_index is None:
+      table_entries = self._nat_table.get_all_entries()
+      flow_stats_list = self._flow_stats
+      max_flow_mods = None
+    else:
+      table_entries = self._nat_table.get_entries_by_internal_ip_range(
+        self._internal_ip_low_end_value + self._page_first_index,
+        min(self._page_size, self._num_internal_ip_indexes - self._page_first_index))
+      # The cookie filter of the last page may include flow entries of internal
+      # IP addresses outside the NAT pool.
+      flow_stats_list = [
+        flow_stats for flow_stats in self._flow_stats
+        if natinstaller.parse_nat_cookie(flow_stats.cookie)[0] < self._num_internal_ip_indexes]
+      max_flow_mods = self._max_flow_mods_per_page
+    
+    self._flow_stats = []
+    
+    # Key: flow entry ID (see `NatInstaller.get_nat_flow_entry_ids`)
+    # Value: NatTableEntry
+    expected_table_entries = {}
+    for table_entry in table_entries:
+      for flow_entry_id in self._nat_installer.get_nat_flow_entry_ids(table_entry):
+        expected_table_entries[flow_entry_id] = table_entry
+    
+    installed_flow_entry_ids = set()
+    orphaned_flow_stats = []
+    for flow_stats in flow_stats_list:
+      flow_entry_id = self._nat_installer.get_flow_entry_id(flow_stats)
+      if flow_entry_id in expected_table_entries and flow_stats.priority == self._priority:
+        installed_flow_entry_ids.add(flow_entry_id)
+      else:
+        orphaned_flow_stats.append((flow_entry_id, flow_stats))
+    
+    missing_flow_entry_ids = [
+      flow_entry_id for flow_entry_id in expected_table_entries
+      if flow_entry_id not in installed_flow_entry_ids]
+    
+    # Flow entries with the same match fields and priority as a missing flow
+    # entry are overwritten by `OFPFC_ADD` rather than uninstalled first.
+    overwritten_matches = set(flow_entry_id[:2] for flow_entry_id in missing_flow_entry_ids)
+    
+    uninstalled_flow_stats = [
+      flow_stats for flow_entry_id, flow_stats in orphaned_flow_stats
+      if (flow_entry_id is None or flow_stats.priority != self._priority or
+          flow_entry_id[:2] not in overwritten_matches)]
+    
+    num_flow_mods = len(uninstalled_flow_stats) + len(missing_flow_entry_ids)
+    is_complete = max_flow_mods is None or num_flow_mods <= max_flow_mods
+    if not is_complete:
+      uninstalled_flow_stats = uninstalled_flow_stats[:max_flow_mods]
+      missing_flow_entry_ids = missing_flow_entry_ids[
+        :max_flow_mods - len(uninstalled_flow_stats)]
+    
+    for flow_stats in uninstalled_flow_stats:
+      self._nat_installer.uninstall_flow_entry(flow_stats)
+    
+    for flow_entry_id in missing_flow_entry_ids:
+      self._nat_installer.install_nat_flow_entry(
+        expected_table_entries[flow_entry_id], flow_entry_id, self._priority)
+    
+    if self._page_first_index is not None and is_complete:
+      self._next_page_first_index = self._page_first_index + self._page_size
+    
+    if self._page_first_index is None or num_flow_mods > 0:
+      logging.info(
+        "Reconciled NAT flow entries: {0} kept, {1} uninstalled, {2} installed{3}".format(
+          len(installed_flow_entry_ids), len(uninstalled_flow_stats), len(missing_flow_entry_ids),
+          "" if is_complete else " (flow modification budget exhausted)"))
@@ -4,6 +4,12 @@ This module defines the NAT table and its entries.
 
 #===============================================================================
 
+import collections
+import random
+import socket
+import struct
+import time
+
 import netaddr
 
 from ..app_config import app_config
@@ -23,6 +29,56 @@ class NatTableAllocationType(object):
   TYPES = ROUND_ROBIN, RANDOM = (0, 1)
 
 
+class NatPoolDepletedError(Exception):
+  pass
+
+
+#===============================================================================
+
+# Set in the integer form of IPv6 addresses so that they never produce the same
+# key as IPv4 addresses.
+_IPV6_KEY_FLAG = 1 << 128
+
+
+def ip_to_int(ip):
+  """
+  Return the IP address in human-readable format as an integer.
+  
+  IPv4-mapped IPv6 addresses are converted to IPv4 addresses. Integers of IPv6
+  addresses are distinct from integers of IPv4 addresses.
+  """
+  
+  try:
+    return struct.unpack("!I", socket.inet_pton(socket.AF_INET, ip))[0]
+  except socket.error:
+    high, low = struct.unpack("!QQ", socket.inet_pton(socket.AF_INET6, ip))
+    if high == 0 and low >> 32 == 0xffff:
+      return low & 0xffffffff
+    else:
+      return _IPV6_KEY_FLAG | (high << 64) | low
+
+
+def get_address_family(ip_value):
+  """
+  Return the address family (one of `AddressFamily`) of the IP address
+  converted to an integer by `ip_to_int`.
+  """
+  
+  return AddressFamily.IPv6 if ip_value & _IPV6_KEY_FLAG else AddressFamily.IPv4
+
+
+def get_key(ip, port, protocol):
+  """
+  Return the key identifying a NAT table entry by the IP address, port and
+  upper-layer protocol as a single integer.
+  
+  Use this function to compute the key once and pass it to the `NatTable`
+  methods accepting keys (e.g. `NatTable.find_entry_by_key`).
+  """
+  
+  return (ip_to_int(ip) << 24) | (protocol << 16) | port
+
+
 #===============================================================================
 
 
@@ -30,18 +86,26 @@ class NatTable(object):
   
   """
   This class:
-  * contains a table of ((internal IP address, internal port), NAT table entry)
-  pairs
+  * contains a table of ((internal IP address, internal port, protocol), NAT
+  table entry) pairs
   * can add, find and remove table entries
-  """
   
-  # FIXME: For now, only `ROUND_ROBIN` is implemented for both external IP and
-  # port allocation.
+  External IP addresses and ports are allocated according to 'ip_allocation_type'
+  and 'port_allocation_type' (`NatTableAllocationType`):
+  
+  * `ROUND_ROBIN` - IP addresses and ports are allocated in ascending order,
+  * `RANDOM` - IP addresses and ports are allocated in the order given by a
+    keyed pseudo-random permutation of the range, hence no collision can occur
+    and the allocation takes the same time regardless of how full the pool is.
+  """
   
-  def __init__(self, **nat_pool_config):
+  def __init__(self, clock=time.time, **nat_pool_config):
     """
     Create a NAT table.
     
+    `clock` is a function returning the current time in seconds. The expiry time
+    of table entries is computed from the time returned by `clock`.
+    
     `**nat_pool_config` contains configuration parameters for the NAT pool. The
     NAT pool contains the following parameter names:
     
@@ -59,15 +123,26 @@ class NatTable(object):
     Default values are taken from the configuration file (`app_config` module).
     """
     
-    # Key: Internal IP + internal port
+    self._clock = clock
+    
+    # Key: `get_key(internal IP, internal port, protocol)`
     # Value: NatTableEntry
     self._table = {}
     
-    # Key: External IP + external port
+    # Key: `get_key(external IP, external port, protocol)`
     # Value: NatTableEntry (the same entry as in `self._table` for the
-    # corresponding internal IP and internal port)
+    # corresponding internal IP, internal port and protocol)
     self._table_external = {}
     
+    # Key: `ip_to_int(internal IP)`
+    # Value: dict of (key, NatTableEntry) pairs of the internal IP address
+    self._entries_by_internal_ip = {}
+    
+    # Key: `ip_to_int(external IP)`
+    # Value: dict of (external key, NatTableEntry) pairs of the external IP
+    # address
+    self._entries_by_external_ip = {}
+    
     # Make a copy to be able to modify it.
     self._nat_pool_config = dict(app_config['default_nat_pool_config'])
     
@@ -76,11 +151,34 @@ class NatTable(object):
         raise TypeError("invalid keyword argument '{0}'".format(config_param_name))
       self._nat_pool_config[config_param_name] = value
     
+    self._external_ip_low_end_value = netaddr.IPAddress(
+      self._nat_pool_config['external_ip_low_end']).value
+    self._external_ip_high_end_value = netaddr.IPAddress(
+      self._nat_pool_config['external_ip_high_end']).value
+    
     # Key: external IP address
-    # Value: last port allocated
-    self._allocated_external_ips_and_ports = {}
+    # Value: `_ExternalPortPool` tracking allocated ports for the IP address
+    self._external_port_pools = {}
     
-    self._last_external_ip = self._nat_pool_config['external_ip_low_end']
+    # External IP addresses whose port pool became available again after being
+    # depleted. These are preferred over IP addresses not used yet so that the
+    # number of external IP addresses in use stays steady.
+    self._external_ips_with_released_ports = collections.deque()
+    
+    self._random = random.Random()
+    
+    if self._nat_pool_config['ip_allocation_type'] == NatTableAllocationType.RANDOM:
+      self._external_ip_order = _KeyedPermutation(
+        self._external_ip_high_end_value - self._external_ip_low_end_value + 1,
+        self._random.getrandbits(64))
+    else:
+      self._external_ip_order = None
+    
+    self._next_unused_external_ip_index = 0
+    self._last_external_ip = self._get_next_unused_external_ip()
+  
+  def __len__(self):
+    return len(self._table)
   
   def add_entry(self, internal_ip, internal_port, lifetime, external_ip=None, external_port=None,
                 protocol=IpUpperProtocol.UDP, address_family=AddressFamily.IPv4):
@@ -109,8 +207,17 @@ class NatTable(object):
     
     If the specified combination of `external_ip` and `external_port` is
     already in use, allocate an IP address and port from the NAT pool.
+    
+    Ports released by removed entries are allocated again once the port pool of
+    the external IP address has been used up. A new external IP address is only
+    used when all ports of the IP addresses in use are allocated. If the NAT
+    pool has no free external IP address and port left, raise
+    `NatPoolDepletedError`.
     """
     
+    if get_key(internal_ip, internal_port, protocol) in self._table:
+      raise ValueError("cannot add a NAT table entry: entry already exists")
+    
     # Use None as the unspecified value.
     if not external_ip:
       external_ip = None
@@ -118,12 +225,13 @@ class NatTable(object):
       external_ip_netaddr = netaddr.IPAddress(external_ip)
       if external_ip_netaddr.is_ipv4_mapped():
         external_ip_netaddr = external_ip_netaddr.ipv4()
-      if external_ip_netaddr.value == 0:
-        external_ip = None
       
-      if (external_ip < self._nat_pool_config['external_ip_low_end'] or
-          external_ip > self._nat_pool_config['external_ip_high_end']):
+      if (external_ip_netaddr.value == 0 or
+          external_ip_netaddr.value < self._external_ip_low_end_value or
+          external_ip_netaddr.value > self._external_ip_high_end_value):
         external_ip = None
+      else:
+        external_ip = str(external_ip_netaddr)
     
     # Use None as the unspecified value.
     if not external_port:
@@ -133,137 +241,474 @@ class NatTable(object):
           external_port > self._nat_pool_config['external_port_high_end']):
         external_port = None
     
-    if self.find_entry_by_external(external_ip, external_port):
-      external_ip = None
-      external_port = None
-    
     external_ip, external_port = self._allocate_entry(external_ip, external_port)
     
     nat_table_entry = NatTableEntry(address_family, protocol,
-      internal_ip, internal_port, external_ip, external_port, lifetime)
+      internal_ip, internal_port, external_ip, external_port, lifetime,
+      self._clock() + lifetime)
     
     self._add_entry(nat_table_entry)
     
     return nat_table_entry
   
-  def find_entry(self, internal_ip, internal_port):
+  def find_entry(self, internal_ip, internal_port, protocol=IpUpperProtocol.UDP):
     """
-    Find table entry by the specified internal IP and internal port.
+    Find table entry by the specified internal IP, internal port and protocol.
     """
     
-    try:
-      entry = self._table[self._get_key(internal_ip, internal_port)]
-    except KeyError:
-      entry = None
+    return self._table.get(get_key(internal_ip, internal_port, protocol))
+  
+  def find_entry_by_key(self, key):
+    """
+    Find table entry by the key (as returned by `get_key`) of the internal IP,
+    internal port and protocol.
+    """
     
-    return entry
+    return self._table.get(key)
   
-  def find_entry_by_external(self, external_ip, external_port):
+  def find_entry_by_external(self, external_ip, external_port, protocol=IpUpperProtocol.UDP):
     """
-    Find table entry by the specified external IP and external port.
+    Find table entry by the specified external IP, external port and protocol.
     """
     
-    try:
-      entry = self._table_external[self._get_key(external_ip, external_port)]
-    except KeyError:
-      entry = None
+    return self._table_external.get(get_key(external_ip, external_port, protocol))
+  
+  def find_entry_by_external_key(self, external_key):
+    """
+    Find table entry by the key (as returned by `get_key`) of the external IP,
+    external port and protocol.
+    """
     
-    return entry
+    return self._table_external.get(external_key)
   
-  def update_entry_lifetime(self, internal_ip, internal_port, lifetime):
+  def update_entry_lifetime(self, internal_ip, internal_port, lifetime,
+                            protocol=IpUpperProtocol.UDP):
     """
     Update the lifetime of the table entry. Return the updated entry.
     """
     
-    entry = self._table[self._get_key(internal_ip, internal_port)]
+    return self.update_entry_lifetime_by_key(
+      get_key(internal_ip, internal_port, protocol), lifetime)
+  
+  def update_entry_lifetime_by_key(self, key, lifetime):
+    """
+    Update the lifetime of the table entry specified by the key of the internal
+    IP, internal port and protocol. Return the updated entry.
     
-    entry_dict = entry.to_dict()
-    entry_dict['lifetime'] = lifetime
+    The entry is updated in place, i.e. no new entry is created and the table
+    indexes are left intact.
+    """
     
-    new_entry = NatTableEntry(**entry_dict)
-    self._table[self._get_key(internal_ip, internal_port)] = new_entry
-    self._table_external[self._get_key(entry.external_ip, entry.external_port)] = new_entry
+    entry = self._table[key]
+    entry.lifetime = lifetime
+    entry.expiry_time = self._clock() + lifetime
     
-    return new_entry
+    return entry
   
-  def remove_entry(self, internal_ip, internal_port):
-    entry = self.find_entry(internal_ip, internal_port)
+  def remove_entry(self, internal_ip, internal_port, protocol=IpUpperProtocol.UDP):
+    self.remove_entry_by_key(get_key(internal_ip, internal_port, protocol))
+  
+  def remove_entry_by_key(self, key):
+    entry = self._table.get(key)
     if entry is not None:
-      del self._table[self._get_key(internal_ip, internal_port)]
-      del self._table_external[self._get_key(entry.external_ip, entry.external_port)]
+      self._remove_entry(key, self._get_external_key(entry), entry)
+  
+  def remove_entry_by_external(self, external_ip, external_port, protocol=IpUpperProtocol.UDP):
+    self.remove_entry_by_external_key(get_key(external_ip, external_port, protocol))
   
-  def remove_entry_by_external(self, external_ip, external_port):
-    entry = self.find_entry_by_external(external_ip, external_port)
+  def remove_entry_by_external_key(self, external_key):
+    entry = self._table_external.get(external_key)
     if entry is not None:
-      del self._table[self._get_key(entry.internal_ip, entry.internal_port)]
-      del self._table_external[self._get_key(external_ip, external_port)]
+      self._remove_entry(self._get_key(entry), external_key, entry)
+  
+  def remove_entries_by_internal_ip(self, internal_ip):
+    """
+    Remove all table entries of the specified internal IP address. Return the
+    list of removed entries.
+    """
+    
+    entries = self._entries_by_internal_ip.get(ip_to_int(internal_ip), {})
+    return self._remove_entries([(key, self._get_external_key(entry), entry)
+                                 for key, entry in entries.items()])
+  
+  def remove_entries_by_external_ip(self, external_ip):
+    """
+    Remove all table entries of the specified external IP address. Return the
+    list of removed entries.
+    """
+    
+    entries = self._entries_by_external_ip.get(ip_to_int(external_ip), {})
+    return self._remove_entries([(self._get_key(entry), external_key, entry)
+                                 for external_key, entry in entries.items()])
+  
+  def count_entries_by_internal_ip(self, internal_ip):
+    """
+    Return the number of table entries of the specified internal IP address.
+    """
+    
+    return len(self._entries_by_internal_ip.get(ip_to_int(internal_ip), ()))
+  
+  def get_entries_by_internal_ip_range(self, internal_ip_value, num_ips):
+    """
+    Return the list of table entries whose internal IP address is one of
+    `num_ips` consecutive IP addresses starting from `internal_ip_value` (IP
+    address as an integer, see `ip_to_int`). Table entries are ordered by the
+    internal IP address.
+    """
+    
+    entries = []
+    for ip_value in range(internal_ip_value, internal_ip_value + num_ips):
+      entries_of_ip = self._entries_by_internal_ip.get(ip_value)
+      if entries_of_ip:
+        entries.extend(entries_of_ip.values())
+    
+    return entries
+  
+  def get_all_entries(self):
+    """
+    Return the list of all table entries.
+    """
+    
+    return list(self._table.values())
+  
+  def remove_all_entries(self):
+    """
+    Remove all table entries. Return the list of removed entries.
+    """
+    
+    return self._remove_entries([(key, self._get_external_key(entry), entry)
+                                 for key, entry in self._table.items()])
+  
+  @property
+  def nat_pool_config(self):
+    """
+    Return a copy of the NAT pool configuration used by this table.
+    """
+    
+    return dict(self._nat_pool_config)
   
   def _allocate_entry(self, external_ip, external_port):
     if external_ip is None and external_port is None:
-      ip, port = self._allocate_ip_and_port()
-      return ip, port
+      return self._allocate_ip_and_port()
     elif external_ip is not None and external_port is None:
-      ip, port = self._allocate_ip_and_port(external_ip)
-      return ip, port
+      return self._allocate_ip_and_port(external_ip)
     elif external_ip is None and external_port is not None:
       ip = self._allocate_ip()
-      return ip, external_port
+      if self._get_port_pool(ip).reserve(external_port):
+        return ip, external_port
+      else:
+        return self._allocate_ip_and_port()
     elif external_ip is not None and external_port is not None:
-      return external_ip, external_port
+      if self._get_port_pool(external_ip).reserve(external_port):
+        return external_ip, external_port
+      else:
+        return self._allocate_ip_and_port()
   
   def _allocate_ip_and_port(self, external_ip=None):
-    if external_ip is None:
-      ip = self._last_external_ip
-    else:
-      ip = external_ip
+    if external_ip is not None:
+      port = self._get_port_pool(external_ip).allocate()
+      if port is not None:
+        return external_ip, port
+    
+    ip = self._last_external_ip
+    port_pool = self._get_port_pool(ip)
+    if port_pool.is_depleted():
+      ip = self._get_next_external_ip()
+      port_pool = self._get_port_pool(ip)
+      self._last_external_ip = ip
+    
+    return ip, port_pool.allocate()
+  
+  def _allocate_ip(self):
+    return self._last_external_ip
+  
+  def _get_next_external_ip(self):
+    """
+    Return an external IP address with at least one free port.
     
-    if ip not in self._allocated_external_ips_and_ports:
-      self._allocated_external_ips_and_ports[ip] = self._nat_pool_config['external_port_low_end']
-    else:
-      self._allocated_external_ips_and_ports[ip] += 1
-      if self._is_port_pool_depleted(ip):
-        ip = self._get_incremented_ip(ip)
-        self._allocated_external_ips_and_ports[ip] = self._nat_pool_config['external_port_low_end']
-        self._last_external_ip = ip
+    IP addresses whose ports were released are preferred over IP addresses not
+    used yet.
+    """
     
-    return ip, self._allocated_external_ips_and_ports[ip]
+    while self._external_ips_with_released_ports:
+      ip = self._external_ips_with_released_ports.popleft()
+      if not self._get_port_pool(ip).is_depleted():
+        return ip
+    
+    while True:
+      ip = self._get_next_unused_external_ip()
+      if not self._get_port_pool(ip).is_depleted():
+        return ip
   
-  def _is_port_pool_depleted(self, external_ip):
-    return (self._allocated_external_ips_and_ports[external_ip] >
-            self._nat_pool_config['external_port_high_end'])
+  def _get_next_unused_external_ip(self):
+    num_external_ips = self._external_ip_high_end_value - self._external_ip_low_end_value + 1
+    if self._next_unused_external_ip_index >= num_external_ips:
+      raise NatPoolDepletedError("no external IP address and port available in the NAT pool")
+    
+    index = self._next_unused_external_ip_index
+    self._next_unused_external_ip_index += 1
+    
+    if self._external_ip_order is not None:
+      index = self._external_ip_order[index]
+    
+    return str(netaddr.IPAddress(self._external_ip_low_end_value + index))
   
-  def _allocate_ip(self):
-    return self._last_external_ip
+  def _get_port_pool(self, external_ip):
+    try:
+      return self._external_port_pools[external_ip]
+    except KeyError:
+      port_pool = _ExternalPortPool(self._nat_pool_config['external_port_low_end'],
+                                    self._nat_pool_config['external_port_high_end'],
+                                    self._create_port_allocation_random())
+      self._external_port_pools[external_ip] = port_pool
+      return port_pool
   
-  def _get_incremented_ip(self, ip):
-    return str(netaddr.IPAddress(ip) + 1)
+  def _create_port_allocation_random(self):
+    if self._nat_pool_config['port_allocation_type'] == NatTableAllocationType.RANDOM:
+      return random.Random(self._random.getrandbits(64))
+    else:
+      return None
+  
+  def _release_external_port(self, external_ip, external_port):
+    port_pool = self._get_port_pool(external_ip)
+    was_depleted = port_pool.is_depleted()
+    
+    port_pool.release(external_port)
+    
+    if was_depleted and external_ip != self._last_external_ip:
+      self._external_ips_with_released_ports.append(external_ip)
   
   def _add_entry(self, nat_table_entry):
-    key = self._get_key(nat_table_entry.internal_ip, nat_table_entry.internal_port)
+    key = self._get_key(nat_table_entry)
+    external_key = self._get_external_key(nat_table_entry)
+    
+    self._table[key] = nat_table_entry
+    self._table_external[external_key] = nat_table_entry
+    
+    self._entries_by_internal_ip.setdefault(key >> 24, {})[key] = nat_table_entry
+    self._entries_by_external_ip.setdefault(external_key >> 24, {})[external_key] = nat_table_entry
+  
+  def _remove_entry(self, key, external_key, nat_table_entry):
+    del self._table[key]
+    del self._table_external[external_key]
+    
+    self._remove_from_ip_index(self._entries_by_internal_ip, key)
+    self._remove_from_ip_index(self._entries_by_external_ip, external_key)
+    
+    self._release_external_port(nat_table_entry.external_ip, nat_table_entry.external_port)
+  
+  def _remove_entries(self, keys_and_entries):
+    for key, external_key, nat_table_entry in keys_and_entries:
+      self._remove_entry(key, external_key, nat_table_entry)
+    
+    return [nat_table_entry for unused_, unused_, nat_table_entry in keys_and_entries]
+  
+  def _remove_from_ip_index(self, ip_index, key):
+    # The upper bits of the key contain the IP address (see `get_key`).
+    ip_value = key >> 24
+    entries = ip_index[ip_value]
+    del entries[key]
+    if not entries:
+      del ip_index[ip_value]
+  
+  def _get_key(self, nat_table_entry):
+    return get_key(nat_table_entry.internal_ip, nat_table_entry.internal_port,
+                   nat_table_entry.protocol)
+  
+  def _get_external_key(self, nat_table_entry):
+    return get_key(nat_table_entry.external_ip, nat_table_entry.external_port,
+                   nat_table_entry.protocol)
+
+
+class _ExternalPortPool(object):
+  
+  """
+  This class keeps track of allocated ports of a single external IP address.
+  
+  Allocated ports are marked in a bitmap. Ports not allocated yet are handed out
+  sequentially. Once the whole port range has been handed out, released ports
+  are allocated again in the order they were released.
+  
+  If `random_` (a `random.Random` instance) is specified, ports not allocated
+  yet are handed out in the order of a keyed permutation of the port range and
+  released ports are picked at random.
+  """
+  
+  def __init__(self, port_low_end, port_high_end, random_=None):
+    self._port_low_end = port_low_end
+    self._num_ports = port_high_end - port_low_end + 1
+    
+    self._bitmap = bytearray((self._num_ports + 7) // 8)
+    self._num_allocated_ports = 0
+    
+    self._random = random_
+    if self._random is not None:
+      self._port_order = _KeyedPermutation(self._num_ports, self._random.getrandbits(64))
+    else:
+      self._port_order = None
+    
+    self._next_unused_index = 0
+    # Released ports may be reserved again before being popped, hence each
+    # popped port must be checked against the bitmap. Each offset is queued at
+    # most once (see `_released_bitmap`), so the queue never holds more than
+    # `_num_ports` offsets.
+    self._released_bitmap = bytearray(len(self._bitmap))
+    if self._random is None:
+      self._released_offsets = collections.deque()
+    else:
+      self._released_offsets = []
+  
+  def is_depleted(self):
+    return self._num_allocated_ports >= self._num_ports
+  
+  def is_allocated(self, port):
+    return self._is_offset_allocated(port - self._port_low_end)
+  
+  def allocate(self):
+    """
+    Allocate a free port and return it. If no port is free, return None.
+    """
+    
+    if self.is_depleted():
+      return None
     
-    if key not in self._table:
-      self._table[key] = nat_table_entry
+    while self._next_unused_index < self._num_ports:
+      offset = self._next_unused_index
+      self._next_unused_index += 1
+      if self._port_order is not None:
+        offset = self._port_order[offset]
       
-      key_external = self._get_key(nat_table_entry.external_ip, nat_table_entry.external_port)
-      self._table_external[key_external] = nat_table_entry
+      if not self._is_offset_allocated(offset):
+        return self._allocate_offset(offset)
+    
+    while self._released_offsets:
+      offset = self._pop_released_offset()
+      if not self._is_offset_allocated(offset):
+        return self._allocate_offset(offset)
+    
+    return None
+  
+  def reserve(self, port):
+    """
+    Allocate the specified port. Return True on success, False if the port is
+    already allocated.
+    """
+    
+    offset = port - self._port_low_end
+    if self._is_offset_allocated(offset):
+      return False
+    
+    self._allocate_offset(offset)
+    return True
+  
+  def release(self, port):
+    offset = port - self._port_low_end
+    if not self._is_offset_allocated(offset):
+      return
+    
+    self._bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xff
+    self._num_allocated_ports -= 1
+    
+    if not self._released_bitmap[offset >> 3] & (1 << (offset & 7)):
+      self._released_bitmap[offset >> 3] |= 1 << (offset & 7)
+      self._released_offsets.append(offset)
+  
+  def _pop_released_offset(self):
+    if self._random is None:
+      offset = self._released_offsets.popleft()
     else:
-      raise ValueError("cannot add a NAT table entry: entry already exists")
+      # Swap a randomly chosen offset with the last one to pop it in O(1).
+      index = self._random.randrange(len(self._released_offsets))
+      self._released_offsets[index], self._released_offsets[-1] = (
+        self._released_offsets[-1], self._released_offsets[index])
+      offset = self._released_offsets.pop()
+    
+    self._released_bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xff
+    return offset
+  
+  def _is_offset_allocated(self, offset):
+    return bool(self._bitmap[offset >> 3] & (1 << (offset & 7)))
   
-  def _get_key(self, internal_ip, internal_port):
-    return str(internal_ip) + str(internal_port)
+  def _allocate_offset(self, offset):
+    self._bitmap[offset >> 3] |= 1 << (offset & 7)
+    self._num_allocated_ports += 1
+    return self._port_low_end + offset
+
+
+class _KeyedPermutation(object):
+  
+  """
+  This class represents a pseudo-random permutation of integers in the range
+  [0, `size`) determined by `key`.
+  
+  The permutation is computed by a balanced Feistel network over the smallest
+  power-of-4 domain covering the range. Values falling outside the range are
+  encrypted again until they fall inside (cycle walking). Since the domain is
+  less than four times the size of the range, the expected number of rounds
+  is constant.
+  """
+  
+  _NUM_ROUNDS = 4
+  
+  def __init__(self, size, key):
+    self._size = size
+    self._half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+    self._half_mask = (1 << self._half_bits) - 1
+    
+    random_ = random.Random(key)
+    self._round_keys = [random_.getrandbits(32) for unused_ in range(self._NUM_ROUNDS)]
+  
+  def __len__(self):
+    return self._size
+  
+  def __getitem__(self, index):
+    if not 0 <= index < self._size:
+      raise IndexError("permutation index out of range: {0}".format(index))
+    
+    value = self._encrypt(index)
+    while value >= self._size:
+      value = self._encrypt(value)
+    
+    return value
+  
+  def _encrypt(self, value):
+    left = value >> self._half_bits
+    right = value & self._half_mask
+    
+    for round_key in self._round_keys:
+      round_value = (((right ^ round_key) * 0x9e3779b1) >> 7) & self._half_mask
+      left, right = right, left ^ round_value
+    
+    return (left << self._half_bits) | right
 
 
 class NatTableEntry(object):
   
+  # Large NAT tables contain millions of entries, hence the entries avoid
+  # per-instance `__dict__`.
+  __slots__ = (
+    '_address_family',
+    '_protocol',
+    '_internal_ip',
+    '_internal_port',
+    '_external_ip',
+    '_external_port',
+    'lifetime',
+    'expiry_time',
+  )
+  
   def __init__(self, address_family, protocol, internal_ip, internal_port,
-               external_ip, external_port, lifetime):
+               external_ip, external_port, lifetime, expiry_time=None):
     self._address_family = address_family
     self._protocol = protocol
     self._internal_ip = internal_ip
     self._internal_port = internal_port
     self._external_ip = external_ip
     self._external_port = external_port
-    self._lifetime = lifetime
+    # `lifetime` and `expiry_time` are modified in place when the entry is
+    # refreshed.
+    self.lifetime = lifetime
+    self.expiry_time = expiry_time
   
   @property
   def address_family(self):
@@ -289,10 +734,6 @@ class NatTableEntry(object):
   def external_port(self):
     return self._external_port
   
-  @property
-  def lifetime(self):
-    return self._lifetime
-  
   def __str__(self):
     return str(self.to_dict())
   
@@ -305,4 +746,5 @@ class NatTableEntry(object):
       'external_ip': self.external_ip,
       'external_port': self.external_port,
       'lifetime': self.lifetime,
+      'expiry_time': self.expiry_time,
     }
@@ -0,0 +1,214 @@
+"""
+This module defines a NAT table split into shards that can be modified by
+concurrent writers.
+"""
+
+#===============================================================================
+
+import threading
+import time
+
+import netaddr
+
+from . import natpool
+from . import nattable
+
+from ..app_config import app_config
+
+#===============================================================================
+
+
+class ShardedNatTable(object):
+  
+  """
+  This class provides the interface of `NatTable`, with table entries split
+  into `num_shards` shards. Each shard is a `NatTable` with its own lock and its
+  own allocator of external IP addresses and ports.
+  
+  Table entries are assigned to shards by their internal IP address. Each shard
+  allocates external IP addresses from its own contiguous partition of the NAT
+  pool, so lookups by either the internal or the external key are routed to the
+  owning shard in constant time, and writers of different shards never contend
+  for the same lock.
+  
+  An external IP address explicitly requested in `add_entry` is only used if it
+  belongs to the partition of the shard; otherwise, an external IP address is
+  allocated from the partition.
+  
+  Lookups do not acquire locks; a single dictionary lookup is atomic in
+  CPython.
+  """
+  
+  def __init__(self, num_shards, clock=time.time, **nat_pool_config):
+    """
+    Create a sharded NAT table. `clock` and `**nat_pool_config` have the same
+    meaning as in `NatTable`. The external IP address range of the NAT pool must
+    contain at least `num_shards` IP addresses.
+    """
+    
+    full_nat_pool_config = dict(app_config['default_nat_pool_config'])
+    for config_param_name, value in nat_pool_config.items():
+      if config_param_name not in full_nat_pool_config:
+        raise TypeError("invalid keyword argument '{0}'".format(config_param_name))
+      full_nat_pool_config[config_param_name] = value
+    
+    self._nat_pool_config = full_nat_pool_config
+    
+    self._shards = [
+      nattable.NatTable(clock=clock, **shard_nat_pool_config)
+      for shard_nat_pool_config in natpool.partition_nat_pool_config(
+        full_nat_pool_config, num_shards)]
+    self._locks = [threading.Lock() for unused_ in self._shards]
+    
+    # Partitions are ordered by the external IP address. The first
+    # `num_external_ips % num_shards` partitions contain one more IP address
+    # than the others (see `partition_nat_pool_config`).
+    self._external_ip_low_end_value = netaddr.IPAddress(
+      full_nat_pool_config['external_ip_low_end']).value
+    num_external_ips = (
+      netaddr.IPAddress(full_nat_pool_config['external_ip_high_end']).value -
+      self._external_ip_low_end_value + 1)
+    self._num_external_ips = num_external_ips
+    self._small_partition_size = num_external_ips // num_shards
+    self._num_large_partitions = num_external_ips % num_shards
+  
+  @property
+  def num_shards(self):
+    return len(self._shards)
+  
+  def __len__(self):
+    return sum(len(shard) for shard in self._shards)
+  
+  def add_entry(self, internal_ip, internal_port, lifetime, external_ip=None, external_port=None,
+                protocol=nattable.IpUpperProtocol.UDP, address_family=nattable.AddressFamily.IPv4):
+    """
+    Add a new entry to the NAT table. See `NatTable.add_entry` for details.
+    """
+    
+    shard_index = self._get_shard_index(nattable.ip_to_int(internal_ip))
+    
+    with self._locks[shard_index]:
+      return self._shards[shard_index].add_entry(internal_ip, internal_port, lifetime,
+        external_ip, external_port, protocol, address_family)
+  
+  def find_entry(self, internal_ip, internal_port, protocol=nattable.IpUpperProtocol.UDP):
+    return self.find_entry_by_key(nattable.get_key(internal_ip, internal_port, protocol))
+  
+  def find_entry_by_key(self, key):
+    return self._shards[self._get_shard_index(key >> 24)].find_entry_by_key(key)
+  
+  def find_entry_by_external(self, external_ip, external_port,
+                             protocol=nattable.IpUpperProtocol.UDP):
+    return self.find_entry_by_external_key(
+      nattable.get_key(external_ip, external_port, protocol))
+  
+  def find_entry_by_external_key(self, external_key):
+    shard_index = self._get_external_shard_index(external_key >> 24)
+    if shard_index is None:
+      return None
+    
+    return self._shards[shard_index].find_entry_by_external_key(external_key)
+  
+  def update_entry_lifetime(self, internal_ip, internal_port, lifetime,
+                            protocol=nattable.IpUpperProtocol.UDP):
+    return self.update_entry_lifetime_by_key(
+      nattable.get_key(internal_ip, internal_port, protocol), lifetime)
+  
+  def update_entry_lifetime_by_key(self, key, lifetime):
+    shard_index = self._get_shard_index(key >> 24)
+    
+    with self._locks[shard_index]:
+      return self._shards[shard_index].update_entry_lifetime_by_key(key, lifetime)
+  
+  def remove_entry(self, internal_ip, internal_port, protocol=nattable.IpUpperProtocol.UDP):
+    self.remove_entry_by_key(nattable.get_key(internal_ip, internal_port, protocol))
+  
+  def remove_entry_by_key(self, key):
+    shard_index = self._get_shard_index(key >> 24)
+    
+    with self._locks[shard_index]:
+      self._shards[shard_index].remove_entry_by_key(key)
+  
+  def remove_entry_by_external(self, external_ip, external_port,
+                               protocol=nattable.IpUpperProtocol.UDP):
+    self.remove_entry_by_external_key(nattable.get_key(external_ip, external_port, protocol))
+  
+  def remove_entry_by_external_key(self, external_key):
+    shard_index = self._get_external_shard_index(external_key >> 24)
+    if shard_index is None:
+      return
+    
+    with self._locks[shard_index]:
+      self._shards[shard_index].remove_entry_by_external_key(external_key)
+  
+  def remove_entries_by_internal_ip(self, internal_ip):
+    shard_index = self._get_shard_index(nattable.ip_to_int(internal_ip))
+    
+    with self._locks[shard_index]:
+      return self._shards[shard_index].remove_entries_by_internal_ip(internal_ip)
+  
+  def remove_entries_by_external_ip(self, external_ip):
+    shard_index = self._get_external_shard_index(nattable.ip_to_int(external_ip))
+    if shard_index is None:
+      return []
+    
+    with self._locks[shard_index]:
+      return self._shards[shard_index].remove_entries_by_external_ip(external_ip)
+  
+  def count_entries_by_internal_ip(self, internal_ip):
+    return self._shards[
+      self._get_shard_index(nattable.ip_to_int(internal_ip))].count_entries_by_internal_ip(internal_ip)
+  
+  def get_entries_by_internal_ip_range(self, internal_ip_value, num_ips):
+    entries = []
+    for ip_value in range(internal_ip_value, internal_ip_value + num_ips):
+      entries.extend(self._shards[self._get_shard_index(ip_value)].get_entries_by_internal_ip_range(
+        ip_value, 1))
+    
+    return entries
+  
+  def get_all_entries(self):
+    entries = []
+    for shard, lock in zip(self._shards, self._locks):
+      with lock:
+        entries.extend(shard.get_all_entries())
+    
+    return entries
+  
+  def remove_all_entries(self):
+    entries = []
+    for shard, lock in zip(self._shards, self._locks):
+      with lock:
+        entries.extend(shard.remove_all_entries())
+    
+    return entries
+  
+  @property
+  def nat_pool_config(self):
+    """
+    Return a copy of the NAT pool configuration of the whole table.
+    """
+    
+    return dict(self._nat_pool_config)
+  
+  def _get_shard_index(self, internal_ip_value):
+    return internal_ip_value % len(self._shards)
+  
+  def _get_external_shard_index(self, external_ip_value):
+    """
+    Return the index of the shard whose partition contains the external IP
+    address, or None if the IP address is outside the NAT pool.
+    """
+    
+    offset = external_ip_value - self._external_ip_low_end_value
+    if offset < 0 or offset >= self._num_external_ips:
+      return None
+    
+    large_partition_size = self._small_partition_size + 1
+    large_partitions_end = self._num_large_partitions * large_partition_size
+    
+    if offset < large_partitions_end:
+      return offset // large_partition_size
+    else:
+      return (self._num_large_partitions +
+              (offset - large_partitions_end) // self._small_partition_size)
@@ -0,0 +1,85 @@
+"""
+This module classifies raw packets sent to the controller (packet-in messages)
+by reading header fields at fixed offsets, without building a
+`ryu.lib.packet.Packet` object.
+"""
+
+#===============================================================================
+
+import struct
+
+from app_config import app_config
+
+#===============================================================================
+
+_ETHERNET_HEADER_LENGTH = 14
+_ETHERTYPE_OFFSET = 12
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_ARP = 0x0806
+
+_IPV4_MIN_HEADER_LENGTH = 20
+_IPV4_VERSION_IHL_OFFSET = _ETHERNET_HEADER_LENGTH
+_IPV4_FLAGS_FRAGMENT_OFFSET_OFFSET = _ETHERNET_HEADER_LENGTH + 6
+_IPV4_PROTOCOL_OFFSET = _ETHERNET_HEADER_LENGTH + 9
+_IPV4_FRAGMENT_OFFSET_MASK = 0x1fff
+
+_IP_PROTOCOL_UDP = 17
+
+_UDP_HEADER_LENGTH = 8
+_UDP_DST_PORT_OFFSET = 2
+
+_UINT8_STRUCT = struct.Struct("!B")
+_UINT16_STRUCT = struct.Struct("!H")
+
+#===============================================================================
+
+
+class PacketClass(object):
+  CLASSES = OTHER, PCP, ARP = (0, 1, 2)
+
+
+def classify(data, pcp_server_port=app_config['pcp_server_listening_port']):
+  """
+  Return the `PacketClass` of the raw Ethernet frame `data`.
+  
+  A frame is classified as PCP if it is an IPv4 packet (not a non-first
+  fragment) carrying a UDP datagram destined to `pcp_server_port`. Only untagged
+  Ethernet frames are recognized, since responses to PCP and ARP messages are
+  built without VLAN tags. Truncated frames are classified as `OTHER`.
+  """
+  
+  if len(data) < _ETHERNET_HEADER_LENGTH:
+    return PacketClass.OTHER
+  
+  ethertype = _UINT16_STRUCT.unpack_from(data, _ETHERTYPE_OFFSET)[0]
+  
+  if ethertype == _ETHERTYPE_ARP:
+    return PacketClass.ARP
+  elif ethertype != _ETHERTYPE_IPV4:
+    return PacketClass.OTHER
+  
+  if len(data) < _ETHERNET_HEADER_LENGTH + _IPV4_MIN_HEADER_LENGTH:
+    return PacketClass.OTHER
+  
+  version_ihl = _UINT8_STRUCT.unpack_from(data, _IPV4_VERSION_IHL_OFFSET)[0]
+  header_length = (version_ihl & 0xf) * 4
+  if version_ihl >> 4 != 4 or header_length < _IPV4_MIN_HEADER_LENGTH:
+    return PacketClass.OTHER
+  
+  if _UINT8_STRUCT.unpack_from(data, _IPV4_PROTOCOL_OFFSET)[0] != _IP_PROTOCOL_UDP:
+    return PacketClass.OTHER
+  
+  flags_fragment_offset = _UINT16_STRUCT.unpack_from(data, _IPV4_FLAGS_FRAGMENT_OFFSET_OFFSET)[0]
+  if flags_fragment_offset & _IPV4_FRAGMENT_OFFSET_MASK:
+    return PacketClass.OTHER
+  
+  udp_header_offset = _ETHERNET_HEADER_LENGTH + header_length
+  if len(data) < udp_header_offset + _UDP_HEADER_LENGTH:
+    return PacketClass.OTHER
+  
+  udp_dst_port = _UINT16_STRUCT.unpack_from(data, udp_header_offset + _UDP_DST_PORT_OFFSET)[0]
+  if udp_dst_port == pcp_server_port:
+    return PacketClass.PCP
+  else:
+    return PacketClass.OTHER
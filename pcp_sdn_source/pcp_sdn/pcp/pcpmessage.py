@@ -8,6 +8,8 @@ This module contains the following components:
 
 #===============================================================================
 
+import binascii
+import socket
 import struct
 import netaddr
 
@@ -21,15 +23,14 @@ from ..app_config import app_config
 #===============================================================================
 
  
+_IPV4_MAPPED_IPV6_PREFIX = '\x00' * 10 + '\xff\xff'
+
+
 def packed_str_to_int(packed_str):
-  int_bytes = struct.unpack("{0}B".format(len(packed_str)), packed_str)
-  
-  int_to_return = 0
-  for byte_ in int_bytes:
-    int_to_return <<= 8
-    int_to_return += byte_
+  if not packed_str:
+    return 0
   
-  return int_to_return
+  return int(binascii.hexlify(packed_str), 16)
  
  
 def ip_addr_to_packed_str(ip_addr_string):
@@ -57,12 +58,82 @@ def packed_str_to_ip_addr(ip_addr_packed):
   address, pass it as an IPv4-mapped IPv6 address.
   """
   
-  ip_addr = netaddr.IPAddress(packed_str_to_int(ip_addr_packed), version=6)
+  if ip_addr_packed[:12] == _IPV4_MAPPED_IPV6_PREFIX:
+    return socket.inet_ntoa(ip_addr_packed[12:16])
+  
+  return str(netaddr.IPAddress(packed_str_to_int(ip_addr_packed), version=6))
+  
+
+def _ip_addr_to_packed_str_or_none(ip_addr_string):
+  """
+  Same as `ip_addr_to_packed_str`, but return None if `ip_addr_string` is not a
+  valid IP address.
+  """
+  
+  try:
+    if ':' in ip_addr_string:
+      return socket.inet_pton(socket.AF_INET6, ip_addr_string)
+    else:
+      return _IPV4_MAPPED_IPV6_PREFIX + socket.inet_pton(socket.AF_INET, ip_addr_string)
+  except (socket.error, TypeError):
+    return None
+
+
+# Key: IP address in human-readable format
+# Value: IP address as a packed string
+_packed_external_ip_addrs = {}
+_PACKED_EXTERNAL_IP_ADDRS_MAX_SIZE = 1024
+
+
+def _ip_addr_field_to_packed_str(ip_addr, cache=None):
+  """
+  Return the IP address field value as a packed string.
+  
+  If `cache` is not None, look up the packed string in `cache` first and store
+  newly converted addresses in it.
+  """
+  
+  if type(ip_addr) is _PackedIpAddress:
+    return ip_addr.packed
+  
+  if cache is not None:
+    ip_addr_packed = cache.get(ip_addr)
+    if ip_addr_packed is not None:
+      return ip_addr_packed
+  
+  ip_addr_packed = _ip_addr_to_packed_str_or_none(ip_addr)
+  if ip_addr_packed is None:
+    ip_addr_packed = ip_addr_to_packed_str(ip_addr)
+  
+  if cache is not None:
+    if len(cache) >= _PACKED_EXTERNAL_IP_ADDRS_MAX_SIZE:
+      cache.clear()
+    cache[ip_addr] = ip_addr_packed
+  
+  return ip_addr_packed
+
+
+class _PackedIpAddress(object):
+  
+  """
+  This class stores a parsed IP address as a packed string until the address is
+  requested in human-readable format.
+  """
+  
+  __slots__ = ('packed', '_str')
   
-  if ip_addr.is_ipv4_mapped():
-    ip_addr = ip_addr.ipv4()
+  def __init__(self, packed):
+    self.packed = packed
+    self._str = None
   
-  return str(ip_addr)
+  def to_str(self):
+    if self._str is None:
+      self._str = packed_str_to_ip_addr(self.packed)
+    return self._str
+
+
+# Placeholder for missing fields of `PcpMessage` objects
+_MISSING_FIELD = object()
  
  
 #===============================================================================
@@ -113,6 +184,20 @@ class PcpResultCodes(object):
  
 #===============================================================================
  
+# Precompiled structures of PCP message fields, unpacked and packed at fixed
+# offsets. IP addresses are stored as 16-byte packed strings.
+_UINT8_STRUCT = struct.Struct("!B")
+# version, R + opcode, reserved, lifetime, PCP client's IP address
+_REQUEST_HEADER_STRUCT = struct.Struct("!BB2xL16s")
+# version, R + opcode, reserved, result code, lifetime, epoch time, reserved
+_RESPONSE_HEADER_STRUCT = struct.Struct("!BBxBLL12s")
+# mapping nonce, protocol, reserved, internal port, external port, external IP address
+_OPCODE_COMMON_STRUCT = struct.Struct("!12sB3xHH16s")
+# remote peer port, reserved, remote peer IP address
+_OPCODE_PEER_STRUCT = struct.Struct("!H2x16s")
+
+#===============================================================================
+
  
 class PcpMessage(message.Message):
   
@@ -142,32 +227,95 @@ class PcpMessage(message.Message):
   remote_peer_ip        Remote peer IP address                   PEER
   ===================== ======================================== ===============
   
+  Fields are stored in fixed attributes (`__slots__`) and can be accessed either
+  as attributes (e.g. `pcp_message.lifetime`) or as items (e.g.
+  `pcp_message['lifetime']`). A field that has not been set is missing - reading
+  it raises `AttributeError` or `KeyError`, respectively. Only the fields listed
+  above are allowed.
+  
   For more information about PCP message format and fields, consult RFC 6887.
   """
   
+  FIELD_NAMES = (
+    'version',
+    'message_type',
+    'opcode',
+    'lifetime',
+    'pcp_client_ip',
+    'result_code',
+    'epoch_time',
+    'pcp_client_ip_part',
+    'mapping_nonce',
+    'protocol',
+    'internal_port',
+    'external_port',
+    'external_ip',
+    'remote_peer_port',
+    'remote_peer_ip',
+  )
+  
+  # IP address fields are stored in private attributes and exposed through
+  # properties, since parsed IP addresses are converted to human-readable format
+  # only when accessed.
+  _FIELD_ATTRIBUTE_NAMES = (
+    'version',
+    'message_type',
+    'opcode',
+    'lifetime',
+    '_pcp_client_ip',
+    'result_code',
+    'epoch_time',
+    'pcp_client_ip_part',
+    'mapping_nonce',
+    'protocol',
+    'internal_port',
+    'external_port',
+    '_external_ip',
+    'remote_peer_port',
+    '_remote_peer_ip',
+  )
+  _FIELD_NAMES_AND_ATTRIBUTE_NAMES = dict(zip(FIELD_NAMES, _FIELD_ATTRIBUTE_NAMES))
+  
+  __slots__ = _FIELD_ATTRIBUTE_NAMES + (
+    '_serialized',
+    # PCP client's IP address from the IP header
+    '_pcp_client_ip_address',
+    '_parse_result',
+    '_should_discard',
+  )
+  
   _COMMON_LENGTH = 24
   _MAP_OPCODE_LENGTH = 36
   _PEER_OPCODE_LENGTH = 56
   
+  _OPCODE_LENGTHS = {
+    PcpMessageOpcodes.MAP: _MAP_OPCODE_LENGTH,
+    PcpMessageOpcodes.PEER: _PEER_OPCODE_LENGTH,
+  }
+  
   _MINIMUM_MESSAGE_LENGTH = 2
   _MAXIMUM_MESSAGE_LENGTH = 1100
   
   def __init__(self, **fields):
-    super(PcpMessage, self).__init__()
-    
-    self._fields = fields
+    # Fields are not stored in the dict of the parent class.
     self._serialized = ""
-    # PCP client's IP address from the IP header
     self._pcp_client_ip_address = ""
     
     self._parse_result = PcpResultCodes.SUCCESS
     self._should_discard = False
+    
+    for field_name, field_value in fields.items():
+      self[field_name] = field_value
   
   @classmethod
   def parse(cls, data, pcp_client_ip_address):
     """
     Parse the PCP message from the specified payload data.
     
+    `data` can be a string or any object supporting the buffer protocol (e.g.
+    `memoryview` or `bytearray`); the data is not copied. IP addresses are
+    converted to human-readable format only when accessed.
+    
     `pcp_client_ip_address` is the PCP client's IP address from the IP header
     (which must be the same as the IP address specified in the payload).
     
@@ -186,13 +334,15 @@ class PcpMessage(message.Message):
         the type of the error).
     """
     
+    data = memoryview(data)
+    
     pcp_message = PcpMessage()
     pcp_message._pcp_client_ip_address = pcp_client_ip_address
     
     if len(data) < cls._MINIMUM_MESSAGE_LENGTH:
       return None
     
-    message_type = ord(data[1]) >> 7
+    message_type = _UINT8_STRUCT.unpack_from(data, 1)[0] >> 7
     
     if message_type != PcpMessageTypes.REQUEST:
       return None
@@ -209,13 +359,94 @@ class PcpMessage(message.Message):
     
     return pcp_message
   
+  def __getitem__(self, field_name):
+    if field_name in self._FIELD_NAMES_AND_ATTRIBUTE_NAMES:
+      try:
+        return getattr(self, field_name)
+      except AttributeError:
+        pass
+    
+    raise KeyError("invalid message field: '{0}'".format(field_name))
+    
+  def __setitem__(self, field_name, field_value):
+    if field_name not in self._FIELD_NAMES_AND_ATTRIBUTE_NAMES:
+      raise KeyError("invalid message field: '{0}'".format(field_name))
+    
+    setattr(self, field_name, field_value)
+  
+  def __delitem__(self, field_name):
+    try:
+      delattr(self, self._FIELD_NAMES_AND_ATTRIBUTE_NAMES[field_name])
+    except (KeyError, AttributeError):
+      raise KeyError("invalid message field: '{0}'".format(field_name))
+  
+  def __contains__(self, field_name):
+    attribute_name = self._FIELD_NAMES_AND_ATTRIBUTE_NAMES.get(field_name)
+    return attribute_name is not None and hasattr(self, attribute_name)
+  
+  def __iter__(self):
+    for field_name, attribute_name in zip(self.FIELD_NAMES, self._FIELD_ATTRIBUTE_NAMES):
+      if hasattr(self, attribute_name):
+        yield field_name
+  
+  def values(self):
+    for field_name in self:
+      yield getattr(self, field_name)
+  
+  def items(self):
+    for field_name in self:
+      yield field_name, getattr(self, field_name)
+  
+  def update(self, fields):
+    for field_name, field_value in fields.items():
+      self[field_name] = field_value
+  
+  def copy(self):
+    """
+    Return a new `PcpMessage` object with the same fields. Parsed IP addresses
+    are copied without being converted to human-readable format.
+    """
+    
+    pcp_message = PcpMessage()
+    for attribute_name in self._FIELD_ATTRIBUTE_NAMES:
+      field_value = getattr(self, attribute_name, _MISSING_FIELD)
+      if field_value is not _MISSING_FIELD:
+        setattr(pcp_message, attribute_name, field_value)
+    
+    return pcp_message
+  
+  @property
+  def pcp_client_ip(self):
+    return self._get_ip_addr_field(self._pcp_client_ip)
+  
+  @pcp_client_ip.setter
+  def pcp_client_ip(self, ip_addr):
+    self._pcp_client_ip = ip_addr
+  
+  @property
+  def external_ip(self):
+    return self._get_ip_addr_field(self._external_ip)
+  
+  @external_ip.setter
+  def external_ip(self, ip_addr):
+    self._external_ip = ip_addr
+  
+  @property
+  def remote_peer_ip(self):
+    return self._get_ip_addr_field(self._remote_peer_ip)
+  
+  @remote_peer_ip.setter
+  def remote_peer_ip(self, ip_addr):
+    self._remote_peer_ip = ip_addr
+  
   @property
   def parse_result(self):
     return self._parse_result
   
   def serialize(self):
     """
-    Serialize the PCP message, ready to be inserted into a packet.
+    Serialize the PCP message, ready to be inserted into a packet. Return the
+    serialized message as a `bytearray`.
     
     All required fields must be present, and all fields must have valid values.
     
@@ -226,172 +457,179 @@ class PcpMessage(message.Message):
       * MessageSerializationError - invalid field value(s)
     """
     
-    if self['message_type'] == PcpMessageTypes.REQUEST:
-      self._serialize_request()
-    elif self['message_type'] == PcpMessageTypes.RESPONSE:
-      self._serialize_response()
-    else:
-      raise message.MessageSerializationError(
-        "invalid message type; must be one of [{0}, {1}]".format(
-           PcpMessageTypes.REQUEST, PcpMessageTypes.RESPONSE))
+    serialized = bytearray(self.get_serialized_length())
+    self.serialize_into(serialized)
+    self._serialized = serialized
     
     return self._serialized
   
+  def serialize_into(self, buffer_, offset=0):
+    """
+    Serialize the PCP message into the writable buffer `buffer_` (e.g. a
+    `bytearray`) starting at `offset`. The buffer must have at least
+    `get_serialized_length()` bytes past `offset`.
+    
+    Raise the same exceptions as `serialize`.
+    """
+    
+    try:
+      if self.message_type == PcpMessageTypes.REQUEST:
+        self._serialize_request(buffer_, offset)
+      elif self.message_type == PcpMessageTypes.RESPONSE:
+        self._serialize_response(buffer_, offset)
+      else:
+        raise message.MessageSerializationError(
+          "invalid message type; must be one of [{0}, {1}]".format(
+             PcpMessageTypes.REQUEST, PcpMessageTypes.RESPONSE))
+    except AttributeError as e:
+      raise KeyError("missing message field: {0}".format(e))
+    
+  def get_serialized_length(self):
+    """
+    Return the length of the serialized PCP message in bytes.
+    """
+    
+    return self._COMMON_LENGTH + self._OPCODE_LENGTHS.get(self['opcode'], 0)
+  
+  def _get_ip_addr_field(self, ip_addr):
+    if type(ip_addr) is _PackedIpAddress:
+      return ip_addr.to_str()
+    else:
+      return ip_addr
+  
   @classmethod
   def _parse_request(cls, data, pcp_message):
-    pcp_message['version'] = ord(data[0])
+    pcp_message.version = version = _UINT8_STRUCT.unpack_from(data, 0)[0]
     
-    if pcp_message['version'] not in pcp_data.SUPPORTED_PCP_VERSIONS:
+    if version not in pcp_data.SUPPORTED_PCP_VERSIONS:
       pcp_message._parse_result = PcpResultCodes.UNSUPP_VERSION
     
     if len(data) < cls._COMMON_LENGTH:
       pcp_message._should_discard = True
       return
     
-    fields = struct.unpack("!BHL", data[1:8])
-    # fields[1] is `Reserved` field, which is ignored.
-    pcp_message['message_type'] = fields[0] >> 7
-    pcp_message['opcode'] = fields[0] & 0x7f
-    pcp_message['lifetime'] = fields[2]
-    pcp_message['pcp_client_ip'] = packed_str_to_ip_addr(data[8:8+16])
+    (unused_, message_type_and_opcode, pcp_message.lifetime,
+     pcp_client_ip_packed) = _REQUEST_HEADER_STRUCT.unpack_from(data, 0)
+    pcp_message.message_type = message_type_and_opcode >> 7
+    pcp_message.opcode = message_type_and_opcode & 0x7f
+    pcp_message._pcp_client_ip = _PackedIpAddress(pcp_client_ip_packed)
     
-    if pcp_message['opcode'] not in PcpMessageOpcodes.OPCODES:
+    if pcp_message.opcode not in PcpMessageOpcodes.OPCODES:
       pcp_message._parse_result = PcpResultCodes.UNSUPP_OPCODE
     
-    if pcp_message._pcp_client_ip_address != pcp_message['pcp_client_ip']:
+    # Compare packed addresses to avoid converting the PCP client's IP address
+    # to human-readable format.
+    if _ip_addr_to_packed_str_or_none(pcp_message._pcp_client_ip_address) != pcp_client_ip_packed:
       pcp_message._parse_result = PcpResultCodes.ADDRESS_MISMATCH
     
-    cls._parse_opcode(data[cls._COMMON_LENGTH:], pcp_message)
+    cls._parse_opcode(data, cls._COMMON_LENGTH, pcp_message)
   
   @classmethod
   def _parse_response(cls, data, pcp_message):
-    pcp_message['version'] = ord(data[0])
+    pcp_message.version = version = _UINT8_STRUCT.unpack_from(data, 0)[0]
     
-    if pcp_message['version'] not in pcp_data.SUPPORTED_PCP_VERSIONS:
+    if version not in pcp_data.SUPPORTED_PCP_VERSIONS:
       pcp_message._parse_result = PcpResultCodes.UNSUPP_VERSION
     
     if len(data) < cls._COMMON_LENGTH:
       pcp_message._should_discard = True
       return
     
-    fields = struct.unpack("!BBBLL", data[1:12])
-    
-    # fields[1] is `Reserved` field, which is ignored.
-    pcp_message['message_type'] = fields[0] >> 7
-    pcp_message['opcode'] = fields[0] & 0x7f
-    pcp_message['result_code'] = fields[2]
-    pcp_message['lifetime'] = fields[3]
-    pcp_message['epoch_time'] = fields[4]
+    # As per RFC 6887, the last `Reserved` field may contain the last 96 bits of
+    # a PCP client's IP address in case of an unsuccessfully parsed PCP request.
+    (unused_, message_type_and_opcode, pcp_message.result_code, pcp_message.lifetime,
+     pcp_message.epoch_time,
+     pcp_message.pcp_client_ip_part) = _RESPONSE_HEADER_STRUCT.unpack_from(data, 0)
+    pcp_message.message_type = message_type_and_opcode >> 7
+    pcp_message.opcode = message_type_and_opcode & 0x7f
     
-    # As per RFC 6887, `Reserved` field may contain the last 96 bits of a PCP
-    # client's IP address in case of an unsuccessfully parsed PCP request.
-    pcp_message['pcp_client_ip_part'] = data[12:12+12]
-    
-    if pcp_message['opcode'] not in PcpMessageOpcodes.OPCODES:
+    if pcp_message.opcode not in PcpMessageOpcodes.OPCODES:
       pcp_message._parse_result = PcpResultCodes.UNSUPP_OPCODE
     
-    cls._parse_opcode(data[cls._COMMON_LENGTH:], pcp_message)
+    cls._parse_opcode(data, cls._COMMON_LENGTH, pcp_message)
   
   @classmethod
-  def _parse_opcode(cls, data, pcp_message):
-    if pcp_message['opcode'] == PcpMessageOpcodes.MAP:
-      cls._parse_opcode_map(data, pcp_message)
-    elif pcp_message['opcode'] == PcpMessageOpcodes.PEER:
-      cls._parse_opcode_peer(data, pcp_message)
+  def _parse_opcode(cls, data, offset, pcp_message):
+    if pcp_message.opcode == PcpMessageOpcodes.MAP:
+      cls._parse_opcode_map(data, offset, pcp_message)
+    elif pcp_message.opcode == PcpMessageOpcodes.PEER:
+      cls._parse_opcode_peer(data, offset, pcp_message)
   
   @classmethod
-  def _parse_opcode_common(cls, data, pcp_message):
-    # data[13:16] is `Reserved` field, which is ignored.
-    pcp_message['mapping_nonce'] = data[:12].encode('hex')
-    pcp_message['protocol'] = ord(data[12])
-    (pcp_message['internal_port'],
-     pcp_message['external_port']) = struct.unpack("!HH", data[16:20])
-    pcp_message['external_ip'] = packed_str_to_ip_addr(data[20:36])
+  def _parse_opcode_common(cls, data, offset, pcp_message):
+    (mapping_nonce, pcp_message.protocol, pcp_message.internal_port,
+     pcp_message.external_port, external_ip_packed) = _OPCODE_COMMON_STRUCT.unpack_from(data, offset)
+    pcp_message.mapping_nonce = binascii.hexlify(mapping_nonce)
+    pcp_message._external_ip = _PackedIpAddress(external_ip_packed)
   
   @classmethod
-  def _parse_opcode_map(cls, data, pcp_message):
-    if len(data) < cls._MAP_OPCODE_LENGTH:
+  def _parse_opcode_map(cls, data, offset, pcp_message):
+    if len(data) - offset < cls._MAP_OPCODE_LENGTH:
       pcp_message._parse_result = PcpResultCodes.MALFORMED_REQUEST
       return
     
-    cls._parse_opcode_common(data, pcp_message)
+    cls._parse_opcode_common(data, offset, pcp_message)
     
-    if (pcp_message['lifetime'] != 0 and pcp_message['protocol'] == 0 and
-        pcp_message['internal_port']) != 0:
+    if (pcp_message.lifetime != 0 and pcp_message.protocol == 0 and
+        pcp_message.internal_port) != 0:
       pcp_message._parse_result = PcpResultCodes.MALFORMED_REQUEST
       return
     
-    if pcp_message['internal_port'] == 0:
+    if pcp_message.internal_port == 0:
       pcp_message._parse_result = PcpResultCodes.UNSUPP_PROTOCOL
       return
   
   @classmethod
-  def _parse_opcode_peer(cls, data, pcp_message):
-    if len(data) < cls._PEER_OPCODE_LENGTH:
+  def _parse_opcode_peer(cls, data, offset, pcp_message):
+    if len(data) - offset < cls._PEER_OPCODE_LENGTH:
       pcp_message._parse_result = PcpResultCodes.MALFORMED_REQUEST
       return
     
-    cls._parse_opcode_common(data, pcp_message)
+    cls._parse_opcode_common(data, offset, pcp_message)
     
-    pcp_message['remote_peer_port'] = struct.unpack("!H", data[36:38])[0]
-    pcp_message['remote_peer_ip'] = packed_str_to_ip_addr(data[40:56])
+    (pcp_message.remote_peer_port,
+     remote_peer_ip_packed) = _OPCODE_PEER_STRUCT.unpack_from(data, offset + cls._MAP_OPCODE_LENGTH)
+    pcp_message._remote_peer_ip = _PackedIpAddress(remote_peer_ip_packed)
   
-  def _serialize_request(self):
-    message_fields = []
-    message_fields.append(self['version'])
-    message_fields.append(self['opcode'])
-    message_fields[-1] = message_fields[-1] | (self['message_type'] << 7)
-    message_fields.append(0)      # `Reserved` field, must be zero
-    message_fields.append(self['lifetime'])
+  def _serialize_request(self, buffer_, offset):
+    _REQUEST_HEADER_STRUCT.pack_into(buffer_, offset,
+      self.version, self.opcode | (self.message_type << 7), self.lifetime,
+      _ip_addr_field_to_packed_str(self._pcp_client_ip))
     
-    self._serialized = struct.pack("!BBHL", *message_fields)
-    self._serialized += ip_addr_to_packed_str(self['pcp_client_ip'])
+    self._serialize_opcode(buffer_, offset + self._COMMON_LENGTH)
     
-    self._serialize_opcode()
+  def _serialize_response(self, buffer_, offset):
+    pcp_client_ip = getattr(self, '_pcp_client_ip', None)
+    if self.result_code != PcpResultCodes.SUCCESS and pcp_client_ip is not None:
+      pcp_client_ip_part = _ip_addr_field_to_packed_str(pcp_client_ip)[4:]
+    else:
+      pcp_client_ip_part = ''
   
-  def _serialize_response(self):
-    message_fields = []
-    message_fields.append(self['version'])
-    message_fields.append(self['opcode'])
-    message_fields[-1] = message_fields[-1] | (self['message_type'] << 7)
-    message_fields.append(0)      # `Reserved` field, must be zero
-    message_fields.append(self['result_code'])
-    message_fields.append(self['lifetime'])
-    message_fields.append(self['epoch_time'])
+    # The `Reserved` fields are zeroed.
+    _RESPONSE_HEADER_STRUCT.pack_into(buffer_, offset,
+      self.version, self.opcode | (self.message_type << 7), self.result_code,
+      self.lifetime, self.epoch_time, pcp_client_ip_part)
     
-    self._serialized = struct.pack("!BBBBLL", *message_fields)
+    self._serialize_opcode(buffer_, offset + self._COMMON_LENGTH)
     
-    if self['result_code'] == PcpResultCodes.SUCCESS:
-      self._serialized += '\x00' * 12
-    else:
-      if 'pcp_client_ip' in self:
-        self._serialized += ip_addr_to_packed_str(self['pcp_client_ip'])[4:]
-      else:
-        self._serialized += '\x00' * 12
-    
-    self._serialize_opcode()
-  
-  def _serialize_opcode(self):
-    if self['opcode'] == PcpMessageOpcodes.MAP:
-      self._serialize_opcode_map()
-    elif self['opcode'] == PcpMessageOpcodes.PEER:
-      self._serialize_opcode_peer()
-  
-  def _serialize_opcode_common(self):
-    self._serialized += self['mapping_nonce'].decode('hex')
-    self._serialized += chr(self['protocol'])
-    self._serialized += '\x00' * 3     # `Reserved` field, set to zero
-    self._serialized += struct.pack(
-      "!HH", self['internal_port'], self['external_port'])
-    self._serialized += ip_addr_to_packed_str(self['external_ip'])
-  
-  def _serialize_opcode_map(self):
-    self._serialize_opcode_common()
-  
-  def _serialize_opcode_peer(self):
-    self._serialize_opcode_common()
-    
-    self._serialized += struct.pack("!H", self['remote_peer_port'])
-    self._serialized += '\x00' * 2     # `Reserved` field, set to zero
-    self._serialized += ip_addr_to_packed_str(self['remote_peer_ip'])
-    
\ No newline at end of file
+  def _serialize_opcode(self, buffer_, offset):
+    if self.opcode == PcpMessageOpcodes.MAP:
+      self._serialize_opcode_map(buffer_, offset)
+    elif self.opcode == PcpMessageOpcodes.PEER:
+      self._serialize_opcode_peer(buffer_, offset)
+    
+  def _serialize_opcode_common(self, buffer_, offset):
+    _OPCODE_COMMON_STRUCT.pack_into(buffer_, offset,
+      binascii.unhexlify(self.mapping_nonce), self.protocol,
+      self.internal_port, self.external_port,
+      _ip_addr_field_to_packed_str(self._external_ip, _packed_external_ip_addrs))
+  
+  def _serialize_opcode_map(self, buffer_, offset):
+    self._serialize_opcode_common(buffer_, offset)
+  
+  def _serialize_opcode_peer(self, buffer_, offset):
+    self._serialize_opcode_common(buffer_, offset)
+    
+    _OPCODE_PEER_STRUCT.pack_into(buffer_, offset + self._MAP_OPCODE_LENGTH,
+      self.remote_peer_port, _ip_addr_field_to_packed_str(self._remote_peer_ip))
+  
\ No newline at end of file
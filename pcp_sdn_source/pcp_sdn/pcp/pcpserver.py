@@ -6,13 +6,20 @@ The behavior of the PCP server aims to follow the RFC 6887 specification.
 
 #===============================================================================
 
+import socket
+import struct
 import time
 
+from collections import OrderedDict
+
+from ryu.lib import addrconv
 from ryu.lib import packet
+from ryu.lib.packet import packet_utils
 
 from .. import dphelper
 from . import pcpmessage
 from ..nat import nathandler
+from ..nat import nattable
 
 from ..app_config import app_config
 
@@ -20,28 +27,269 @@ import logging
 
 #===============================================================================
 
+_ETHERNET_HEADER_STRUCT = struct.Struct("!6s6sH")
+# version + IHL, DSCP + ECN, total length, identification, flags + fragment
+# offset, TTL, protocol, header checksum, source IP, destination IP
+_IPV4_HEADER_STRUCT = struct.Struct("!BBHHHBBH4s4s")
+_IPV4_PSEUDO_HEADER_STRUCT = struct.Struct("!4s4sxBH")
+# source port, destination port, length, checksum
+_UDP_HEADER_STRUCT = struct.Struct("!HHHH")
+_UINT16_STRUCT = struct.Struct("!H")
+
+# lifetime, epoch time
+_PCP_RESPONSE_LIFETIME_AND_EPOCH_TIME_STRUCT = struct.Struct("!LL")
+
+_IPV4_VERSION_IHL = 0x45
+_IPV4_TTL = 255
+_IPV4_CHECKSUM_OFFSET = 10
+_UDP_CHECKSUM_OFFSET = 6
+_PCP_RESPONSE_LIFETIME_OFFSET = 4
+
+_IPV4_OFFSET = _ETHERNET_HEADER_STRUCT.size
+_UDP_OFFSET = _IPV4_OFFSET + _IPV4_HEADER_STRUCT.size
+_PCP_RESPONSE_OFFSET = _UDP_OFFSET + _UDP_HEADER_STRUCT.size
+
+#===============================================================================
+
+
+def load_epoch_start_time(path, clock=time.time):
+  """
+  Return the start time of the PCP server epoch stored in the file `path`. If
+  the file does not exist or is invalid, start a new epoch at the current time
+  and store it in the file.
+  
+  As per RFC 6887, the epoch must continue across restarts only if the mapping
+  state is recovered, hence the file should be stored alongside the NAT
+  journal.
+  """
+  
+  try:
+    with open(path, 'r') as epoch_file:
+      return float(epoch_file.read())
+  except (IOError, ValueError):
+    pass
+  
+  start_time = clock()
+  with open(path, 'w') as epoch_file:
+    epoch_file.write(repr(start_time))
+  
+  return start_time
+
+#===============================================================================
+
+
+class PcpResponseCache(object):
+  
+  """
+  Bounded LRU cache of serialized PCP responses, used to answer retransmitted
+  PCP requests without refreshing the mapping again.
+  
+  Keys are tuples (forwarder ID, PCP client IP, opcode, mapping nonce, internal
+  port, protocol, requested lifetime). Forwarders may serve overlapping internal
+  address spaces, hence their responses are kept apart. A cached response expires `ttl` seconds after
+  it was stored or once the lifetime assigned in the response elapses,
+  whichever comes first.
+  
+  If `max_size` is 0, no responses are cached.
+  """
+  
+  def __init__(self, max_size=app_config['pcp_response_cache_max_size'],
+               ttl=app_config['nat_flow_refresh_tolerance_seconds'], clock=time.time):
+    self._max_size = max_size
+    self._ttl = ttl
+    self._clock = clock
+    
+    # Key: cache key
+    # Value: (serialized PCP response, assigned lifetime, time of storing)
+    self._entries = OrderedDict()
+    # Key: (forwarder ID, PCP client IP, internal port, protocol)
+    # Value: set of cache keys
+    self._keys_by_mapping = {}
+    
+    self._hits = 0
+    self._misses = 0
+  
+  def __len__(self):
+    return len(self._entries)
+  
+  @property
+  def hits(self):
+    return self._hits
+  
+  @property
+  def misses(self):
+    return self._misses
+  
+  def get(self, key, epoch_time):
+    """
+    Return a copy of the serialized PCP response stored under `key` as a
+    `bytearray`, with the lifetime reduced by the time elapsed since storing the
+    response and the epoch time set to `epoch_time`.
+    
+    Return None if no response is cached or if the cached response expired.
+    """
+    
+    entry = self._entries.pop(key, None)
+    if entry is None:
+      self._misses += 1
+      return None
+    
+    pcp_response_data, lifetime, store_time = entry
+    elapsed_time = self._clock() - store_time
+    remaining_lifetime = lifetime - int(elapsed_time)
+    
+    if elapsed_time >= self._ttl or remaining_lifetime <= 0:
+      self._remove_from_mapping_index(key)
+      self._misses += 1
+      return None
+    
+    # Re-insert the entry to mark it as the most recently used.
+    self._entries[key] = entry
+    self._hits += 1
+    
+    pcp_response_data = bytearray(pcp_response_data)
+    _PCP_RESPONSE_LIFETIME_AND_EPOCH_TIME_STRUCT.pack_into(
+      pcp_response_data, _PCP_RESPONSE_LIFETIME_OFFSET, remaining_lifetime, epoch_time)
+    
+    return pcp_response_data
+  
+  def put(self, key, pcp_response_data, lifetime):
+    """
+    Store a copy of the serialized PCP response under `key`. `lifetime` is the
+    mapping lifetime assigned in the response. If the cache is full, the least
+    recently used response is discarded.
+    """
+    
+    if self._max_size <= 0:
+      return
+    
+    if key in self._entries:
+      self._remove(key)
+    
+    while len(self._entries) >= self._max_size:
+      least_recently_used_key = next(iter(self._entries))
+      self._remove(least_recently_used_key)
+    
+    self._entries[key] = (bytes(pcp_response_data), lifetime, self._clock())
+    self._keys_by_mapping.setdefault(self._get_mapping_key(key), set()).add(key)
+  
+  def invalidate(self, forwarder_id, pcp_client_ip, internal_port, protocol):
+    """
+    Discard all cached responses for the mapping of the forwarder specified by
+    the PCP client IP, internal port and protocol.
+    """
+    
+    for key in self._keys_by_mapping.pop((forwarder_id, pcp_client_ip, internal_port, protocol), ()):
+      del self._entries[key]
+  
+  def clear(self):
+    self._entries.clear()
+    self._keys_by_mapping.clear()
+  
+  def _remove(self, key):
+    del self._entries[key]
+    self._remove_from_mapping_index(key)
+  
+  def _remove_from_mapping_index(self, key):
+    mapping_key = self._get_mapping_key(key)
+    keys = self._keys_by_mapping[mapping_key]
+    keys.discard(key)
+    if not keys:
+      del self._keys_by_mapping[mapping_key]
+  
+  @staticmethod
+  def _get_mapping_key(key):
+    return key[0], key[1], key[4], key[5]
+
+
+#===============================================================================
+
 
 class PcpServer(object):
   
-  def __init__(self):
-    self._start_time = time.time()
+  def __init__(self, response_cache_max_size=app_config['pcp_response_cache_max_size'],
+               clock=time.time, start_time=None):
+    """
+    `start_time` is the time the epoch started (see `load_epoch_start_time`).
+    If None, a new epoch starts now.
+    """
+    
+    self._clock = clock
+    self._start_time = start_time if start_time is not None else self._clock()
+    self._response_cache = PcpResponseCache(max_size=response_cache_max_size, clock=clock)
+  
+  @property
+  def response_cache(self):
+    return self._response_cache
+  
+  def handle_mapping_removed(self, forwarder_id, nat_table_entry):
+    """
+    Discard cached responses for the mapping entry removed from the forwarder
+    so that retransmitted PCP requests do not report a mapping entry that no
+    longer exists. Pass this method as the mapping removal callback of
+    `NatHandler`.
+    """
+    
+    self._response_cache.invalidate(forwarder_id,
+      nat_table_entry.internal_ip, nat_table_entry.internal_port, nat_table_entry.protocol)
   
   # FIXME: For the time being, a physical switch port must be explicitly specified
   # as the output port. `ofdatapath` crashes when OFPP_TABLE is used as the output port.
   def process_pcp_request(self, forwarder, pcp_request_packet, pcp_response_out_port, nat_handler):
+    """
+    Process the PCP request received as a packet-in and send the PCP response
+    out `pcp_response_out_port`.
+    
+    `forwarder` should be the forwarder (e.g. `dphelper.FlowModBatcher`) the NAT
+    handler sends flow modifications to. The PCP response is then queued behind
+    the flow modifications of the mapping entry, and both are sent when the NAT
+    handler flushes its flow modifications.
+    """
+    
     pcp_request_ipv4 = pcp_request_packet.get_protocol(packet.ipv4.ipv4)
-    pcp_request = pcpmessage.PcpMessage.parse(pcp_request_packet[-1], pcp_request_ipv4.src)
+    pcp_response_data = self.process_pcp_request_payload(
+      pcp_request_packet[-1], pcp_request_ipv4.src, nat_handler)
+    
+    if pcp_response_data is None:
+      return
+    
+    pcp_response_packet = self._build_pcp_response_packet(pcp_request_packet, pcp_response_data)
+    
+    dphelper.send_packet(forwarder, pcp_response_packet, out_port=pcp_response_out_port)
+    nat_handler.flush_flow_mods()
+  
+  def process_pcp_request_payload(self, pcp_request_data, pcp_client_ip, nat_handler):
+    """
+    Process the PCP request payload sent from `pcp_client_ip` and return the
+    serialized PCP response as a `bytearray`. Return None if no response should
+    be sent.
+    
+    This method does not depend on how the PCP request was received, i.e. as a
+    packet-in from a forwarder or directly over UDP.
+    """
+    
+    pcp_request = pcpmessage.PcpMessage.parse(pcp_request_data, pcp_client_ip)
     
     if pcp_request is None:
       # Drop message silently
-      return
+      return None
     
     if pcp_request.parse_result != pcpmessage.PcpResultCodes.SUCCESS:
       # FIXME: Return a message with result code. Serialization must be updated
       # to avoid serializing incomplete opcode-specific fields.
       logging.info("Failed to parse PCP request; PCP client IP: "
-                   "{0}; result code: {1}".format(pcp_request_ipv4.src, pcp_request.parse_result))
-      return
+                   "{0}; result code: {1}".format(pcp_client_ip, pcp_request.parse_result))
+      return None
+    
+    response_cache_key = (nat_handler.forwarder_id, pcp_client_ip, pcp_request.opcode,
+                          pcp_request.mapping_nonce, pcp_request.internal_port,
+                          pcp_request.protocol, pcp_request.lifetime)
+    
+    if pcp_request.lifetime != 0:
+      # Answer retransmitted requests from the cache without refreshing the mapping.
+      pcp_response_data = self._response_cache.get(response_cache_key, self._calculate_epoch_time())
+      if pcp_response_data is not None:
+        return pcp_response_data
     
     mapping_params = {
       'internal_ip': pcp_request['pcp_client_ip'],
@@ -57,20 +305,67 @@ class PcpServer(object):
       mapping_params['lifetime'] = self._get_minimum_acceptable_mapping_lifetime(
         pcp_request['opcode'], mapping_params['lifetime'])
       
-      if nat_handler.find_mapping(mapping_params['internal_ip'], mapping_params['internal_port']):
+      if nat_handler.find_mapping(mapping_params['internal_ip'], mapping_params['internal_port'],
+                                  protocol=mapping_params['protocol']):
         # Update the lifetime according to RFC 6887.
         mapping = nat_handler.update_mapping_lifetime(mapping_params['internal_ip'],
-          mapping_params['internal_port'], mapping_params['lifetime'])
+          mapping_params['internal_port'], mapping_params['lifetime'],
+          protocol=mapping_params['protocol'])
       else:
-        mapping = nat_handler.create_mapping(**mapping_params)
+        try:
+          mapping = nat_handler.create_mapping(**mapping_params)
+        except nathandler.MappingQuotaExceededError as e:
+          logging.info(str(e))
+          return self._build_pcp_response_payload(
+            pcp_request, result=pcpmessage.PcpResultCodes.USER_EX_QUOTA).serialize()
+        except (nathandler.FlowTableFullError, nattable.NatPoolDepletedError) as e:
+          logging.info(str(e))
+          return self._build_pcp_response_payload(
+            pcp_request, result=pcpmessage.PcpResultCodes.NO_RESOURCES).serialize()
     else:
       nat_handler.remove_mapping(mapping_params['internal_ip'], mapping_params['internal_port'],
-        mapping_removal_type=nathandler.MappingRemovalType.REQUESTED_BY_CLIENT)
+        mapping_removal_type=nathandler.MappingRemovalType.REQUESTED_BY_CLIENT,
+        protocol=mapping_params['protocol'])
+      self._response_cache.invalidate(nat_handler.forwarder_id,
+        pcp_client_ip, mapping_params['internal_port'], mapping_params['protocol'])
     
-    pcp_response_packet = self._build_pcp_response_packet(pcp_request_packet, pcp_request, mapping)
+    pcp_response_data = self._build_pcp_response_payload(pcp_request, mapping).serialize()
+    
+    if mapping is not None and mapping['lifetime'] > 0:
+      self._response_cache.put(response_cache_key, pcp_response_data, mapping['lifetime'])
+    
+    return pcp_response_data
+  
+  def reject_pcp_request(self, forwarder, pcp_request_packet, pcp_response_out_port, result):
+    """
+    Send a PCP response with the specified error result code without processing
+    the PCP request.
+    """
+    
+    pcp_request_ipv4 = pcp_request_packet.get_protocol(packet.ipv4.ipv4)
+    pcp_response_data = self.reject_pcp_request_payload(
+      pcp_request_packet[-1], pcp_request_ipv4.src, result)
+    
+    if pcp_response_data is None:
+      return
+    
+    pcp_response_packet = self._build_pcp_response_packet(pcp_request_packet, pcp_response_data)
     
     dphelper.send_packet(forwarder, pcp_response_packet, out_port=pcp_response_out_port)
   
+  def reject_pcp_request_payload(self, pcp_request_data, pcp_client_ip, result):
+    """
+    Return the serialized PCP response with the specified error result code as a
+    `bytearray`. Return None if no response should be sent.
+    """
+    
+    pcp_request = pcpmessage.PcpMessage.parse(pcp_request_data, pcp_client_ip)
+    
+    if pcp_request is None or pcp_request.parse_result != pcpmessage.PcpResultCodes.SUCCESS:
+      return None
+    
+    return self._build_pcp_response_payload(pcp_request, result=result).serialize()
+  
   def _get_minimum_acceptable_mapping_lifetime(self, opcode, lifetime):
     """
     Return the minimum acceptable mapping lifetime given the PCP opcode. If
@@ -87,24 +382,61 @@ class PcpServer(object):
     else:
       return lifetime
   
-  def _build_pcp_response_packet(self, pcp_request_packet, pcp_request, mapping):
+  def _build_pcp_response_packet(self, pcp_request_packet, pcp_response):
+    """
+    Build the frame carrying the PCP response as a `bytearray`.
+    
+    `pcp_response` is either a `PcpMessage` object or an already serialized PCP
+    response.
+    
+    The Ethernet, IPv4 and UDP headers and the PCP response are written directly
+    into a single preallocated buffer.
+    """
+    
     pcp_request_ethernet = pcp_request_packet.get_protocol(packet.ethernet.ethernet)
     pcp_request_ipv4 = pcp_request_packet.get_protocol(packet.ipv4.ipv4)
     pcp_request_udp = pcp_request_packet.get_protocol(packet.udp.udp)
     
-    pcp_response_packet = packet.packet.Packet()
-    pcp_response_packet.add_protocol(packet.ethernet.ethernet(ethertype=pcp_request_ethernet.ethertype,
-      src=pcp_request_ethernet.dst, dst=pcp_request_ethernet.src))
-    pcp_response_packet.add_protocol(packet.ipv4.ipv4(proto=pcp_request_ipv4.proto,
-      src=pcp_request_ipv4.dst, dst=pcp_request_ipv4.src))
-    pcp_response_packet.add_protocol(packet.udp.udp(
-      src_port=pcp_request_udp.dst_port, dst_port=pcp_request_udp.src_port))
+    is_pcp_response_serialized = not isinstance(pcp_response, pcpmessage.PcpMessage)
+    if is_pcp_response_serialized:
+      pcp_response_length = len(pcp_response)
+    else:
+      pcp_response_length = pcp_response.get_serialized_length()
+    
+    ipv4_offset = _IPV4_OFFSET
+    udp_offset = _UDP_OFFSET
+    pcp_response_offset = _PCP_RESPONSE_OFFSET
+    frame = bytearray(pcp_response_offset + pcp_response_length)
+    
+    _ETHERNET_HEADER_STRUCT.pack_into(frame, 0,
+      addrconv.mac.text_to_bin(pcp_request_ethernet.src),
+      addrconv.mac.text_to_bin(pcp_request_ethernet.dst),
+      pcp_request_ethernet.ethertype)
     
-    pcp_response = self._build_pcp_response_payload(pcp_request, mapping)
+    ipv4_src = socket.inet_aton(pcp_request_ipv4.dst)
+    ipv4_dst = socket.inet_aton(pcp_request_ipv4.src)
+    _IPV4_HEADER_STRUCT.pack_into(frame, ipv4_offset,
+      _IPV4_VERSION_IHL, 0, len(frame) - ipv4_offset, 0, 0, _IPV4_TTL,
+      pcp_request_ipv4.proto, 0, ipv4_src, ipv4_dst)
+    _UINT16_STRUCT.pack_into(frame, ipv4_offset + _IPV4_CHECKSUM_OFFSET,
+      packet_utils.checksum(frame[ipv4_offset:udp_offset]))
+    
+    udp_length = len(frame) - udp_offset
+    _UDP_HEADER_STRUCT.pack_into(frame, udp_offset,
+      pcp_request_udp.dst_port, pcp_request_udp.src_port, udp_length, 0)
+    
+    if is_pcp_response_serialized:
+      frame[pcp_response_offset:] = pcp_response
+    else:
+      pcp_response.serialize_into(frame, pcp_response_offset)
     
-    pcp_response_packet.add_protocol(pcp_response.serialize())
+    udp_checksum = packet_utils.checksum(
+      _IPV4_PSEUDO_HEADER_STRUCT.pack(ipv4_src, ipv4_dst, pcp_request_ipv4.proto, udp_length) +
+      bytes(frame[udp_offset:]))
+    # As per RFC 768, a computed checksum of zero is transmitted as all ones.
+    _UINT16_STRUCT.pack_into(frame, udp_offset + _UDP_CHECKSUM_OFFSET, udp_checksum or 0xffff)
     
-    return pcp_response_packet
+    return frame
   
   def _build_pcp_response_payload(self, pcp_request, mapping=None,
                                   result=pcpmessage.PcpResultCodes.SUCCESS):
@@ -116,27 +448,23 @@ class PcpServer(object):
     IP address and port are left intact.
     """
     
-    pcp_response = pcpmessage.PcpMessage(**dict(pcp_request.items()))
-    pcp_response.update({
-      'version': 2,
-      'message_type': pcpmessage.PcpMessageTypes.RESPONSE,
-      'result_code': result,
-      'epoch_time': self._calculate_epoch_time()
-    })
+    pcp_response = pcp_request.copy()
+    pcp_response.version = 2
+    pcp_response.message_type = pcpmessage.PcpMessageTypes.RESPONSE
+    pcp_response.result_code = result
+    pcp_response.epoch_time = self._calculate_epoch_time()
     
     if mapping is not None:
-      pcp_response['lifetime'] = mapping['lifetime']
+      pcp_response.lifetime = mapping['lifetime']
       
-      if pcp_request['opcode'] in [pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpMessageOpcodes.PEER]:
-        pcp_response.update({
-          'external_ip': mapping['external_ip'],
-          'external_port': mapping['external_port'],
-        })
+      if pcp_request.opcode in [pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpMessageOpcodes.PEER]:
+        pcp_response.external_ip = mapping['external_ip']
+        pcp_response.external_port = mapping['external_port']
     else:
-      pcp_response['lifetime'] = 0
+      pcp_response.lifetime = 0
     
     return pcp_response
   
   def _calculate_epoch_time(self):
-    return int(round(time.time() - self._start_time))
+    return int(round(self._clock() - self._start_time))
   
\ No newline at end of file
@@ -0,0 +1,95 @@
+"""
+This module represents a listener serving PCP requests directly over UDP on the
+controller host.
+
+PCP clients that can reach the controller directly send PCP requests to the
+listener instead of having them forwarded as packet-ins. Responses are sent
+back over the same UDP socket, so no packet-out is needed. Mappings are still
+created by the `NatHandler` of the forwarder.
+"""
+
+#===============================================================================
+
+import socket
+
+from ..app_config import app_config
+
+import logging
+
+#===============================================================================
+
+# PCP messages must not exceed 1100 bytes as per RFC 6887. Whole datagrams are
+# received so that longer messages are rejected when parsed rather than
+# truncated.
+_MAX_UDP_PAYLOAD_LENGTH = 65535
+
+#===============================================================================
+
+
+class PcpUdpListener(object):
+  
+  """
+  Receive PCP requests on a UDP socket and process them by the PCP server.
+  
+  `get_nat_handler` is a function taking the PCP client's IP address and
+  returning the `NatHandler` that should process the request, or None if the
+  request should be dropped.
+  
+  If `listening_port` is 0, an unused port is selected.
+  
+  The listener uses blocking sockets. When running inside ryu, sockets are
+  patched by eventlet and `serve_forever` should be run in a green thread.
+  """
+  
+  def __init__(self, pcp_server, get_nat_handler,
+               listening_address=app_config['pcp_udp_listener_address'],
+               listening_port=app_config['pcp_server_listening_port']):
+    self._pcp_server = pcp_server
+    self._get_nat_handler = get_nat_handler
+    
+    self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._socket.bind((listening_address, listening_port))
+  
+  @property
+  def listening_address(self):
+    """
+    Return the (IP address, port) tuple the listener is bound to.
+    """
+    
+    return self._socket.getsockname()
+  
+  def serve_forever(self):
+    while True:
+      try:
+        self.handle_request()
+      except socket.error as e:
+        logging.warning("Failed to handle PCP request over UDP: {0}".format(e))
+      except Exception:
+        # Keep the listener running for subsequent requests.
+        logging.exception("Failed to process PCP request over UDP")
+  
+  def handle_request(self):
+    """
+    Receive one PCP request and send the PCP response, if any, back to the PCP
+    client.
+    """
+    
+    pcp_request_data, (pcp_client_ip, pcp_client_port) = self._socket.recvfrom(
+      _MAX_UDP_PAYLOAD_LENGTH)
+    
+    nat_handler = self._get_nat_handler(pcp_client_ip)
+    if nat_handler is None:
+      return
+    
+    pcp_response_data = self._pcp_server.process_pcp_request_payload(
+      pcp_request_data, pcp_client_ip, nat_handler)
+    
+    if pcp_response_data is not None:
+      # Install the flow entries of the mapping entry before the PCP client
+      # learns about the mapping entry.
+      nat_handler.flush_flow_mods()
+      self._socket.sendto(bytes(pcp_response_data), (pcp_client_ip, pcp_client_port))
+  
+  def close(self):
+    self._socket.close()
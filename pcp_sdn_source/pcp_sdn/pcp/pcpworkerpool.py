@@ -0,0 +1,84 @@
+"""
+This module provides a pool of green threads processing PCP requests outside
+ryu's event dispatcher.
+"""
+
+#===============================================================================
+
+from ryu.lib import hub
+
+from ..app_config import app_config
+
+import logging
+
+#===============================================================================
+
+
+class PcpWorkerPool(object):
+  
+  """
+  Pool of green threads processing PCP requests concurrently.
+  
+  Each worker has its own bounded queue. Requests are assigned to workers by
+  the PCP client's IP address, hence requests from the same PCP client are
+  processed in order by a single worker.
+  
+  The pool does not serialize all access to a `NatHandler`. Ryu event handlers,
+  the periodic threads of the controller and the PCP UDP listener use the NAT
+  handler outside the pool, and a NAT handler operation may yield to other
+  green threads while sending flow modifications (e.g. when the send queue of
+  the datapath is full). A single `NatTable` method does not yield, but a mapping
+  entry may be modified or removed by another green thread between the update
+  of the NAT table and the installation of its flow entries. Flow entries left
+  inconsistent this way are repaired by the periodic reconciliation.
+  
+  If the queue of a worker is full, the request is rejected so that the caller
+  can respond with the `NO_RESOURCES` result code.
+  """
+  
+  def __init__(self, num_workers=app_config['pcp_worker_pool_size'],
+               queue_max_size=app_config['pcp_worker_queue_max_size']):
+    if num_workers <= 0:
+      raise ValueError("number of workers must be positive")
+    
+    self._queues = [hub.Queue(maxsize=queue_max_size) for unused_ in range(num_workers)]
+    self._threads = [hub.spawn(self._process_requests, queue_) for queue_ in self._queues]
+    
+    self._num_rejected_requests = 0
+  
+  @property
+  def num_rejected_requests(self):
+    return self._num_rejected_requests
+  
+  def submit(self, pcp_client_ip, function, *args):
+    """
+    Schedule `function(*args)` to be called by the worker assigned to
+    `pcp_client_ip`.
+    
+    Return True if the request was queued, False if the queue of the worker is
+    full.
+    """
+    
+    queue_ = self._queues[hash(pcp_client_ip) % len(self._queues)]
+    
+    if queue_.full():
+      self._num_rejected_requests += 1
+      return False
+    
+    queue_.put((function, args))
+    return True
+  
+  def stop(self):
+    for thread in self._threads:
+      hub.kill(thread)
+    hub.joinall(self._threads)
+    self._threads = []
+  
+  def _process_requests(self, queue_):
+    while True:
+      function, args = queue_.get()
+      try:
+        function(*args)
+      except Exception:
+        # Keep the worker running for subsequent requests.
+        logging.exception("Failed to process PCP request")
@@ -1,5 +1,9 @@
+import struct
 import unittest
 
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
 from .. import dphelper
 
 #===============================================================================
@@ -54,4 +58,95 @@ class TestFlowTableHelper(unittest.TestCase):
     
     with self.assertRaises(ValueError):
       self.table_helper.next_table_id(self.table_names[-1])
-  
\ No newline at end of file
+
+
+#===============================================================================
+
+
+class _FakeDatapath(object):
+  
+  ofproto = ofproto_v1_3
+  ofproto_parser = ofproto_v1_3_parser
+  
+  def __init__(self):
+    self.id = 1
+    self.xid = 0
+    self.sent_buffers = []
+  
+  def set_xid(self, msg):
+    self.xid += 1
+    msg.set_xid(self.xid)
+    return self.xid
+  
+  def send(self, buf):
+    self.sent_buffers.append(bytes(buf))
+
+
+class TestFlowModBatcher(unittest.TestCase):
+  
+  def setUp(self):
+    self.datapath = _FakeDatapath()
+    self.time = 0.0
+    self.batcher = dphelper.FlowModBatcher(self.datapath, 3, 0.5, clock=lambda: self.time)
+  
+  def _add_flow_entry(self):
+    match = ofproto_v1_3_parser.OFPMatch(in_port=1)
+    dphelper.add_flow_entry(self.batcher, match, [])
+  
+  def _get_message_types(self, buf):
+    message_types = []
+    offset = 0
+    while offset < len(buf):
+      unused_, message_type, message_length, unused_ = struct.unpack_from("!BBHI", buf, offset)
+      message_types.append(message_type)
+      offset += message_length
+    
+    return message_types
+  
+  def test_send_msg_full_batch(self):
+    for unused_ in range(3):
+      self._add_flow_entry()
+    
+    self.assertEqual(len(self.datapath.sent_buffers), 1)
+    self.assertEqual(self._get_message_types(self.datapath.sent_buffers[0]),
+      [ofproto_v1_3.OFPT_FLOW_MOD] * 3 + [ofproto_v1_3.OFPT_BARRIER_REQUEST])
+  
+  def test_send_msg_preserialized(self):
+    flow_mod = ofproto_v1_3_parser.OFPFlowMod(
+      self.datapath, match=ofproto_v1_3_parser.OFPMatch(in_port=1))
+    flow_mod.xid = 0
+    flow_mod.serialize()
+    
+    self.batcher.send_msg(dphelper.PreserializedMsg(self.batcher, bytearray(flow_mod.buf)))
+    self.batcher.flush()
+    
+    buf = self.datapath.sent_buffers[0]
+    self.assertEqual(self._get_message_types(buf),
+      [ofproto_v1_3.OFPT_FLOW_MOD, ofproto_v1_3.OFPT_BARRIER_REQUEST])
+    # The XID assigned by the datapath is written into the header.
+    self.assertEqual(struct.unpack_from("!I", buf, 4)[0], 1)
+    self.assertEqual(buf[8:len(flow_mod.buf)], bytes(flow_mod.buf[8:]))
+  
+  def test_send_msg_partial_batch_not_sent(self):
+    self._add_flow_entry()
+    
+    self.assertEqual(self.datapath.sent_buffers, [])
+  
+  def test_flush_if_due(self):
+    self._add_flow_entry()
+    
+    self.time = 0.4
+    self.assertIsNone(self.batcher.flush_if_due())
+    
+    self.time = 0.5
+    self.assertIsNotNone(self.batcher.flush_if_due())
+    self.assertEqual(len(self.datapath.sent_buffers), 1)
+  
+  def test_handle_barrier_reply(self):
+    self._add_flow_entry()
+    barrier_request_xid = self.batcher.flush()
+    
+    self.assertEqual(self.batcher.num_pending_batches, 1)
+    self.assertEqual(self.batcher.handle_barrier_reply(barrier_request_xid), 1)
+    self.assertEqual(self.batcher.num_pending_batches, 0)
+    self.assertIsNone(self.batcher.handle_barrier_reply(barrier_request_xid))
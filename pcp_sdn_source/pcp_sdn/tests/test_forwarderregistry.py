@@ -0,0 +1,80 @@
+import unittest
+
+from .. import forwarderregistry
+
+#===============================================================================
+
+
+class TestForwarderRegistry(unittest.TestCase):
+  
+  def setUp(self):
+    self.registry = forwarderregistry.ForwarderRegistry(
+      nat_pool_config={
+        'external_ip_low_end': "200.0.0.1",
+        'external_ip_high_end': "200.0.0.4",
+      },
+      num_partitions=2)
+  
+  def test_get_nat_pool_config_assigns_partitions(self):
+    self.assertEqual(self.registry.get_nat_pool_config(1)['external_ip_low_end'], "200.0.0.1")
+    self.assertEqual(self.registry.get_nat_pool_config(2)['external_ip_low_end'], "200.0.0.3")
+    self.assertEqual(self.registry.get_nat_pool_config(1)['external_ip_low_end'], "200.0.0.1")
+  
+  def test_get_nat_pool_config_all_partitions_assigned(self):
+    self.registry.get_nat_pool_config(1)
+    self.registry.get_nat_pool_config(2)
+    with self.assertRaises(forwarderregistry.ForwarderRegistryFullError):
+      self.registry.get_nat_pool_config(3)
+  
+  def test_remove_releases_partition(self):
+    self.registry.get_nat_pool_config(1)
+    self.registry.get_nat_pool_config(2)
+    self.registry.remove(1)
+    
+    self.assertEqual(self.registry.get_nat_pool_config(3)['external_ip_low_end'], "200.0.0.1")
+  
+  def test_release_reassigns_partition(self):
+    self.registry.get_nat_pool_config(1)
+    self.registry.add(forwarderregistry.ForwarderContext(1, None, None, None))
+    self.registry.get_nat_pool_config(2)
+    self.registry.release(1)
+    
+    self.assertEqual(self.registry.get_nat_pool_config(3)['external_ip_low_end'], "200.0.0.1")
+    self.assertNotIn(1, self.registry)
+    with self.assertRaises(forwarderregistry.ForwarderRegistryFullError):
+      self.registry.get_nat_pool_config(1)
+  
+  def test_release_reconnected_forwarder_keeps_partition(self):
+    self.registry.get_nat_pool_config(1)
+    self.registry.get_nat_pool_config(2)
+    self.registry.release(1)
+    
+    self.assertEqual(self.registry.get_nat_pool_config(1)['external_ip_low_end'], "200.0.0.1")
+    with self.assertRaises(forwarderregistry.ForwarderRegistryFullError):
+      self.registry.get_nat_pool_config(3)
+  
+  def test_add_and_get(self):
+    context = forwarderregistry.ForwarderContext(1, None, None, None)
+    self.registry.add(context)
+    
+    self.assertIs(self.registry.get(1), context)
+    self.assertIsNone(self.registry.get(2))
+    self.assertIn(1, self.registry)
+    self.assertEqual(list(self.registry), [context])
+
+
+class TestPcpClientForwarderMap(unittest.TestCase):
+  
+  def setUp(self):
+    self.client_forwarders = forwarderregistry.PcpClientForwarderMap({
+      "172.16.0.0/16": 1,
+      "172.16.5.0/24": 2,
+    })
+  
+  def test_get_datapath_id_longest_prefix(self):
+    self.assertEqual(self.client_forwarders.get_datapath_id("172.16.1.1"), 1)
+    self.assertEqual(self.client_forwarders.get_datapath_id("172.16.5.1"), 2)
+  
+  def test_get_datapath_id_no_match(self):
+    self.assertIsNone(self.client_forwarders.get_datapath_id("10.0.0.1"))
+    self.assertIsNone(self.client_forwarders.get_datapath_id("fd00::1"))
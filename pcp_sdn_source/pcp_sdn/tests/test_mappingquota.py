@@ -0,0 +1,35 @@
+import unittest
+
+from ..nat import mappingquota
+
+#===============================================================================
+
+
+class TestMappingQuota(unittest.TestCase):
+  
+  def setUp(self):
+    self.quota = mappingquota.MappingQuota(default_quota=100, quota_overrides={
+      "172.16.0.0/16": 200,
+      "172.16.5.0/24": 300,
+      "172.17.0.0/16": 0,
+      "2001:db8::/32": 400,
+    })
+  
+  def test_get_quota_default(self):
+    self.assertEqual(self.quota.get_quota("10.0.0.1"), 100)
+    self.assertEqual(self.quota.get_quota("2001:db9::1"), 100)
+  
+  def test_get_quota_longest_prefix(self):
+    self.assertEqual(self.quota.get_quota("172.16.4.1"), 200)
+    self.assertEqual(self.quota.get_quota("172.16.5.1"), 300)
+  
+  def test_get_quota_unlimited(self):
+    self.assertIsNone(self.quota.get_quota("172.17.0.1"))
+    self.assertIsNone(mappingquota.MappingQuota(default_quota=0, quota_overrides={})
+                      .get_quota("10.0.0.1"))
+  
+  def test_get_quota_ipv6(self):
+    self.assertEqual(self.quota.get_quota("2001:db8::1"), 400)
+    self.assertEqual(self.quota.get_quota("::ffff:172.16.5.1"), 300)
+    # IPv4 prefixes do not match IPv6 addresses with the same low-order bits.
+    self.assertEqual(self.quota.get_quota("::172.16.5.1"), 100)
@@ -0,0 +1,412 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ryu.ofproto import ofproto_parser
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from .. import dphelper
+from ..nat import mappingquota
+from ..nat import nathandler
+from ..nat import natinstaller
+from ..nat import natjournal
+from ..nat import nattable
+
+#===============================================================================
+
+
+class _FakeForwarder(object):
+  
+  ofproto = ofproto_v1_3
+  ofproto_parser = ofproto_v1_3_parser
+  
+  def __init__(self, id_=1):
+    self.id = id_
+    self.sent_messages = []
+    self._xid = 0
+  
+  def send_msg(self, msg):
+    if msg.xid is None:
+      self._xid += 1
+      msg.xid = self._xid
+    if isinstance(msg, dphelper.PreserializedMsg):
+      # Parse the message the way the forwarder would receive it.
+      msg.serialize()
+      msg = ofproto_parser.msg(
+        self, msg.version, msg.msg_type, msg.msg_len, msg.xid, bytes(msg.buf))
+    self.sent_messages.append(msg)
+  
+  def flush(self):
+    # Messages are not batched.
+    pass
+
+
+class _FakeClock(object):
+  
+  def __init__(self, time_=1000.0):
+    self.time = time_
+  
+  def __call__(self):
+    return self.time
+
+
+#===============================================================================
+
+
+class TestNatHandler(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+    self.clock = _FakeClock()
+    self.nat_handler = nathandler.NatHandler(
+      self.forwarder, 2, [1, 2, 3], 4, clock=self.clock)
+    
+    self.mapping_args = {
+      'internal_ip': "172.16.1.1",
+      'internal_port': 2000,
+      'external_ip': None,
+      'external_port': None,
+      'protocol': nattable.IpUpperProtocol.TCP,
+      'lifetime': 30,
+    }
+  
+  def _get_sent_flow_mod_commands(self):
+    return [msg.command for msg in self.forwarder.sent_messages
+            if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+  
+  def test_expire_mappings_before_expiry(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    
+    self.clock.time += 29
+    self.assertEqual(self.nat_handler.expire_mappings(), 0)
+    self.assertIsNotNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+  
+  def test_expire_mappings_after_expiry(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    del self.forwarder.sent_messages[:]
+    
+    self.clock.time += 30
+    self.assertEqual(self.nat_handler.expire_mappings(), 1)
+    self.assertIsNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    self.assertEqual(self._get_sent_flow_mod_commands(), [ofproto_v1_3.OFPFC_DELETE] * 2)
+  
+  def test_expire_mappings_extended_lifetime(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    
+    self.clock.time += 20
+    self.nat_handler.update_mapping_lifetime(
+      "172.16.1.1", 2000, 30, protocol=nattable.IpUpperProtocol.TCP)
+    
+    self.clock.time += 20
+    self.assertEqual(self.nat_handler.expire_mappings(), 0)
+    
+    self.clock.time += 10
+    self.assertEqual(self.nat_handler.expire_mappings(), 1)
+  
+  def test_expire_mappings_refreshed_within_tolerance(self):
+    self.nat_handler._nat_installer = natinstaller.NatInstaller(self.forwarder, 2, [1, 2, 3], 4,
+      refresh_mode=natinstaller.NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE, refresh_tolerance=60)
+    self.nat_handler.create_mapping(**self.mapping_args)
+    
+    # The lifetime is shorter than the refresh tolerance.
+    for unused_ in range(12):
+      self.clock.time += 10
+      self.nat_handler.update_mapping_lifetime(
+        "172.16.1.1", 2000, 30, protocol=nattable.IpUpperProtocol.TCP)
+      self.assertEqual(self.nat_handler.expire_mappings(), 0)
+    
+    self.clock.time += 30
+    self.assertEqual(self.nat_handler.expire_mappings(), 1)
+  
+  def test_expire_mappings_shortened_lifetime(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    self.nat_handler.update_mapping_lifetime(
+      "172.16.1.1", 2000, 10, protocol=nattable.IpUpperProtocol.TCP)
+    
+    self.clock.time += 10
+    self.assertEqual(self.nat_handler.expire_mappings(), 1)
+  
+  def test_expire_mappings_removed_mapping(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    self.nat_handler.remove_mapping("172.16.1.1", 2000,
+      nathandler.MappingRemovalType.FLOW_ENTRY_REMOVED_BY_FORWARDER,
+      protocol=nattable.IpUpperProtocol.TCP)
+    
+    self.clock.time += 30
+    self.assertEqual(self.nat_handler.expire_mappings(), 0)
+  
+  def _create_mapping_and_get_flow_removed_messages(self, reason):
+    """
+    Create a mapping entry and return `OFPFlowRemoved` messages of its
+    internal -> external and external -> internal flow entries.
+    """
+    
+    del self.forwarder.sent_messages[:]
+    self.nat_handler.create_mapping(**self.mapping_args)
+    flow_mods = [msg for msg in self.forwarder.sent_messages
+                 if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+    del self.forwarder.sent_messages[:]
+    
+    return [
+      ofproto_v1_3_parser.OFPFlowRemoved(self.forwarder, cookie=flow_mod.cookie,
+        priority=flow_mod.priority, reason=reason, table_id=flow_mod.table_id,
+        match=flow_mod.match)
+      for flow_mod in flow_mods]
+  
+  def test_handle_flow_removed_internal_to_external(self):
+    flow_removed_msgs = self._create_mapping_and_get_flow_removed_messages(
+      ofproto_v1_3.OFPRR_IDLE_TIMEOUT)
+    
+    self.assertTrue(self.nat_handler.handle_flow_removed(flow_removed_msgs[0]))
+    self.assertIsNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    
+    flow_mods = [msg for msg in self.forwarder.sent_messages
+                 if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+    self.assertEqual([(flow_mod.command, flow_mod.table_id) for flow_mod in flow_mods],
+                     [(ofproto_v1_3.OFPFC_DELETE, 3)])
+  
+  def test_handle_flow_removed_external_to_internal(self):
+    flow_removed_msgs = self._create_mapping_and_get_flow_removed_messages(
+      ofproto_v1_3.OFPRR_IDLE_TIMEOUT)
+    mapping = self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP)
+    
+    self.assertTrue(self.nat_handler.handle_flow_removed(flow_removed_msgs[1]))
+    self.assertIsNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    
+    flow_mods = [msg for msg in self.forwarder.sent_messages
+                 if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+    self.assertEqual([(flow_mod.command, flow_mod.table_id) for flow_mod in flow_mods],
+                     [(ofproto_v1_3.OFPFC_DELETE, 2)])
+    
+    # The external IP address and port are released.
+    self.mapping_args['external_ip'] = mapping['external_ip']
+    self.mapping_args['external_port'] = mapping['external_port']
+    self.mapping_args['internal_port'] = 2001
+    new_mapping = self.nat_handler.create_mapping(**self.mapping_args)
+    self.assertEqual(new_mapping['external_port'], mapping['external_port'])
+  
+  def test_handle_flow_removed_partner_flow_entry_ignored(self):
+    flow_removed_msgs = self._create_mapping_and_get_flow_removed_messages(
+      ofproto_v1_3.OFPRR_IDLE_TIMEOUT)
+    
+    self.assertTrue(self.nat_handler.handle_flow_removed(flow_removed_msgs[1]))
+    
+    # The partner flow entry expired before it was uninstalled, and the mapping
+    # entry was created again in the meantime.
+    self.nat_handler.create_mapping(**self.mapping_args)
+    del self.forwarder.sent_messages[:]
+    
+    self.assertFalse(self.nat_handler.handle_flow_removed(flow_removed_msgs[0]))
+    self.assertIsNotNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    self.assertEqual(self.forwarder.sent_messages, [])
+    
+    # Subsequent expiry of the new mapping entry is processed.
+    self.assertTrue(self.nat_handler.handle_flow_removed(flow_removed_msgs[0]))
+  
+  def test_handle_flow_removed_deleted_by_controller_ignored(self):
+    flow_removed_msgs = self._create_mapping_and_get_flow_removed_messages(
+      ofproto_v1_3.OFPRR_DELETE)
+    
+    for flow_removed_msg in flow_removed_msgs:
+      self.assertFalse(self.nat_handler.handle_flow_removed(flow_removed_msg))
+    self.assertIsNotNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+  
+  def _set_max_num_mappings(self, max_entries):
+    self.nat_handler.request_flow_table_capacity()
+    request = self.forwarder.sent_messages[-1]
+    self.assertIsInstance(request, ofproto_v1_3_parser.OFPTableFeaturesStatsRequest)
+    
+    reply = ofproto_v1_3_parser.OFPTableFeaturesStatsReply(
+      self.forwarder, flags=ofproto_v1_3.OFPMPF_REPLY_MORE, body=[
+        ofproto_v1_3_parser.OFPTableFeaturesStats(table_id=1, max_entries=1000),
+        ofproto_v1_3_parser.OFPTableFeaturesStats(table_id=2, max_entries=max_entries)])
+    reply.xid = request.xid
+    self.assertTrue(self.nat_handler.handle_table_features_reply(reply))
+    self.assertIsNone(self.nat_handler.max_num_mappings)
+    
+    reply = ofproto_v1_3_parser.OFPTableFeaturesStatsReply(self.forwarder, flags=0, body=[
+      ofproto_v1_3_parser.OFPTableFeaturesStats(table_id=3, max_entries=max_entries + 1)])
+    reply.xid = request.xid
+    self.assertTrue(self.nat_handler.handle_table_features_reply(reply))
+    self.assertEqual(self.nat_handler.max_num_mappings, max_entries)
+  
+  def _get_flow_mod_error_msg(self, flow_mod, code):
+    error_msg = ofproto_v1_3_parser.OFPErrorMsg(
+      self.forwarder, type_=ofproto_v1_3.OFPET_FLOW_MOD_FAILED, code=code)
+    error_msg.xid = flow_mod.xid
+    return error_msg
+  
+  def test_create_mapping_flow_table_full(self):
+    self._set_max_num_mappings(1)
+    
+    self.nat_handler.create_mapping(**self.mapping_args)
+    self.mapping_args['internal_port'] = 2001
+    self.assertRaises(nathandler.FlowTableFullError,
+                      self.nat_handler.create_mapping, **self.mapping_args)
+    
+    self.nat_handler.remove_mapping("172.16.1.1", 2000,
+      nathandler.MappingRemovalType.REQUESTED_BY_CLIENT, protocol=nattable.IpUpperProtocol.TCP)
+    self.nat_handler.create_mapping(**self.mapping_args)
+  
+  def test_handle_error_removes_mapping(self):
+    del self.forwarder.sent_messages[:]
+    self.nat_handler.create_mapping(**self.mapping_args)
+    flow_mods = list(self.forwarder.sent_messages)
+    del self.forwarder.sent_messages[:]
+    
+    mapping = self.nat_handler.handle_error(
+      self._get_flow_mod_error_msg(flow_mods[1], ofproto_v1_3.OFPFMFC_TABLE_FULL))
+    
+    self.assertEqual((mapping['internal_ip'], mapping['internal_port']), ("172.16.1.1", 2000))
+    self.assertIsNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    self.assertEqual(self._get_sent_flow_mod_commands(), [ofproto_v1_3.OFPFC_DELETE] * 2)
+    self.assertEqual(self.nat_handler.max_num_mappings, 0)
+    
+    # The error of the other flow modification is ignored.
+    self.assertIsNone(self.nat_handler.handle_error(
+      self._get_flow_mod_error_msg(flow_mods[0], ofproto_v1_3.OFPFMFC_TABLE_FULL)))
+  
+  def test_handle_error_abandons_flow_entry_reconciliation(self):
+    del self.forwarder.sent_messages[:]
+    self.nat_handler.reconcile_flow_entries()
+    stats_requests = list(self.forwarder.sent_messages)
+    
+    error_msg = ofproto_v1_3_parser.OFPErrorMsg(
+      self.forwarder, type_=ofproto_v1_3.OFPET_BAD_REQUEST, code=ofproto_v1_3.OFPBRC_EPERM)
+    error_msg.xid = stats_requests[0].xid
+    self.assertIsNone(self.nat_handler.handle_error(error_msg))
+    
+    self.assertTrue(self.nat_handler.reconcile_next_flow_entry_page())
+  
+  def test_handle_error_after_barrier_reply_ignored(self):
+    del self.forwarder.sent_messages[:]
+    self.nat_handler.create_mapping(**self.mapping_args)
+    flow_mods = list(self.forwarder.sent_messages)
+    
+    self.nat_handler.handle_barrier_reply(flow_mods[-1].xid + 1)
+    
+    self.assertIsNone(self.nat_handler.handle_error(
+      self._get_flow_mod_error_msg(flow_mods[1], ofproto_v1_3.OFPFMFC_TABLE_FULL)))
+    self.assertIsNotNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    self.assertIsNone(self.nat_handler.max_num_mappings)
+  
+  def test_remove_mappings_by_internal_ip(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    self.mapping_args['internal_port'] = 2001
+    self.nat_handler.create_mapping(**self.mapping_args)
+    del self.forwarder.sent_messages[:]
+    
+    self.assertEqual(self.nat_handler.remove_mappings_by_internal_ip("172.16.1.1"), 2)
+    self.assertIsNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+    self.assertEqual(self._get_sent_flow_mod_commands(), [ofproto_v1_3.OFPFC_DELETE])
+    
+    self.clock.time += 30
+    self.assertEqual(self.nat_handler.expire_mappings(), 0)
+  
+  def test_create_mapping_quota_exceeded(self):
+    self.nat_handler = nathandler.NatHandler(self.forwarder, 2, [1, 2, 3], 4, clock=self.clock,
+      mapping_quota=mappingquota.MappingQuota(default_quota=1, quota_overrides={}))
+    
+    self.nat_handler.create_mapping(**self.mapping_args)
+    
+    self.mapping_args['internal_port'] = 2001
+    with self.assertRaises(nathandler.MappingQuotaExceededError):
+      self.nat_handler.create_mapping(**self.mapping_args)
+    
+    self.clock.time += 30
+    self.nat_handler.expire_mappings()
+    self.assertIsNotNone(self.nat_handler.create_mapping(**self.mapping_args))
+  
+  def test_drain_external_ip(self):
+    mapping = self.nat_handler.create_mapping(**self.mapping_args)
+    del self.forwarder.sent_messages[:]
+    
+    self.assertEqual(self.nat_handler.drain_external_ip(mapping['external_ip']), 1)
+    self.assertEqual(self._get_sent_flow_mod_commands(), [ofproto_v1_3.OFPFC_DELETE])
+  
+  def test_remove_all_mappings(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    del self.forwarder.sent_messages[:]
+    
+    self.assertEqual(self.nat_handler.remove_all_mappings(), 1)
+    self.assertEqual(self._get_sent_flow_mod_commands(), [ofproto_v1_3.OFPFC_DELETE])
+  
+  def test_set_forwarder_reconciles_mappings(self):
+    self.nat_handler.create_mapping(**self.mapping_args)
+    
+    forwarder = _FakeForwarder()
+    self.nat_handler.set_forwarder(forwarder)
+    
+    # Only flow entries of the port matching table are added.
+    self.assertEqual(
+      [msg.command for msg in forwarder.sent_messages
+       if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)],
+      [ofproto_v1_3.OFPFC_ADD] * 2)
+    
+    stats_requests = [msg for msg in forwarder.sent_messages
+                      if isinstance(msg, ofproto_v1_3_parser.OFPFlowStatsRequest)]
+    self.assertEqual([request.table_id for request in stats_requests], [2, 3])
+    del forwarder.sent_messages[:]
+    
+    for request in stats_requests:
+      reply = ofproto_v1_3_parser.OFPFlowStatsReply(forwarder, body=[], flags=0)
+      reply.xid = request.xid
+      self.assertTrue(self.nat_handler.handle_flow_stats_reply(reply))
+    
+    self.assertEqual(
+      [msg.command for msg in forwarder.sent_messages
+       if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)],
+      [ofproto_v1_3.OFPFC_ADD] * 2)
+    self.assertIsNotNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP))
+  
+  def test_recover_mappings(self):
+    journal_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, journal_dir)
+    path_prefix = os.path.join(journal_dir, "nat")
+    
+    journal = natjournal.NatJournal(path_prefix, clock=self.clock)
+    self.nat_handler = nathandler.NatHandler(
+      self.forwarder, 2, [1, 2, 3], 4, clock=self.clock, journal=journal)
+    self.assertEqual(self.nat_handler.recover_mappings(), 0)
+    
+    mapping = self.nat_handler.create_mapping(**self.mapping_args)
+    self.mapping_args['internal_port'] = 2001
+    self.mapping_args['lifetime'] = 10
+    self.nat_handler.create_mapping(**self.mapping_args)
+    journal.close()
+    
+    self.clock.time += 10
+    
+    forwarder = _FakeForwarder()
+    journal = natjournal.NatJournal(path_prefix, clock=self.clock)
+    self.addCleanup(journal.close)
+    self.nat_handler = nathandler.NatHandler(
+      forwarder, 2, [1, 2, 3], 4, clock=self.clock, journal=journal)
+    del forwarder.sent_messages[:]
+    
+    self.assertEqual(self.nat_handler.recover_mappings(), 1)
+    
+    self.assertEqual(self.nat_handler.find_mapping(
+      "172.16.1.1", 2000, protocol=nattable.IpUpperProtocol.TCP), mapping)
+    self.assertIsNone(self.nat_handler.find_mapping(
+      "172.16.1.1", 2001, protocol=nattable.IpUpperProtocol.TCP))
+    self.assertEqual(
+      [msg.command for msg in forwarder.sent_messages
+       if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)],
+      [ofproto_v1_3.OFPFC_ADD] * 2)
+    
+    self.clock.time += 20
+    self.assertEqual(self.nat_handler.expire_mappings(), 1)
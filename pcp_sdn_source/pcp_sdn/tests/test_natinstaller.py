@@ -0,0 +1,217 @@
+import unittest
+
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from ..nat import natinstaller
+from ..nat import nattable
+
+from .test_nathandler import _FakeForwarder
+
+#===============================================================================
+
+
+class TestNatInstallerRefresh(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+    self.table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.TCP,
+      "172.16.1.1", 2000, "200.0.0.1", 50000, 30, 1030.0)
+  
+  def _create_nat_installer(self, refresh_mode):
+    nat_installer = natinstaller.NatInstaller(self.forwarder, 2, [1, 2, 3], 4,
+      refresh_mode=refresh_mode, refresh_tolerance=10)
+    del self.forwarder.sent_messages[:]
+    return nat_installer
+  
+  def _get_sent_flow_mods(self):
+    return [msg for msg in self.forwarder.sent_messages
+            if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+  
+  def test_modify_nat_entry_lifetime_reinstall(self):
+    nat_installer = self._create_nat_installer(natinstaller.NatFlowRefreshMode.REINSTALL)
+    nat_installer.modify_nat_entry_lifetime(self.table_entry)
+    
+    self.assertEqual([flow_mod.command for flow_mod in self._get_sent_flow_mods()],
+      [ofproto_v1_3.OFPFC_DELETE] * 2 + [ofproto_v1_3.OFPFC_ADD] * 2)
+  
+  def test_modify_nat_entry_lifetime_skip_within_tolerance(self):
+    nat_installer = self._create_nat_installer(
+      natinstaller.NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE)
+    nat_installer.modify_nat_entry_lifetime(self.table_entry)
+    
+    self.assertEqual([flow_mod.command for flow_mod in self._get_sent_flow_mods()],
+      [ofproto_v1_3.OFPFC_ADD] * 2)
+  
+  def test_modify_nat_entry_lifetime_controller_expiry(self):
+    nat_installer = self._create_nat_installer(natinstaller.NatFlowRefreshMode.CONTROLLER_EXPIRY)
+    nat_installer.install_nat_entry(self.table_entry)
+    nat_installer.modify_nat_entry_lifetime(self.table_entry)
+    
+    flow_mods = self._get_sent_flow_mods()
+    self.assertEqual(len(flow_mods), 2)
+    self.assertEqual([flow_mod.idle_timeout for flow_mod in flow_mods], [0, 0])
+  
+  def test_is_lifetime_refresh_needed(self):
+    nat_installer = self._create_nat_installer(
+      natinstaller.NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE)
+    
+    self.assertFalse(nat_installer.is_lifetime_refresh_needed(self.table_entry, 1040.0))
+    self.assertTrue(nat_installer.is_lifetime_refresh_needed(self.table_entry, 1041.0))
+    
+    nat_installer = self._create_nat_installer(natinstaller.NatFlowRefreshMode.REINSTALL)
+    self.assertTrue(nat_installer.is_lifetime_refresh_needed(self.table_entry, 1030.0))
+  
+  def test_is_lifetime_refresh_needed_short_lifetime(self):
+    nat_installer = natinstaller.NatInstaller(self.forwarder, 2, [1, 2, 3], 4,
+      refresh_mode=natinstaller.NatFlowRefreshMode.SKIP_WITHIN_TOLERANCE, refresh_tolerance=60)
+    
+    # The tolerance is capped at half of the lifetime (30 seconds).
+    self.assertFalse(nat_installer.is_lifetime_refresh_needed(self.table_entry, 1044.0))
+    self.assertTrue(nat_installer.is_lifetime_refresh_needed(self.table_entry, 1045.0))
+    # Shortening the lifetime is never skipped.
+    self.assertTrue(nat_installer.is_lifetime_refresh_needed(self.table_entry, 1029.0))
+
+
+class TestNatInstallerCookies(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+    self.nat_installer = natinstaller.NatInstaller(self.forwarder, 2, [1, 2, 3], 4)
+    del self.forwarder.sent_messages[:]
+    
+    self.table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.TCP,
+      "172.16.1.2", 2000, "200.0.0.2", 50000, 30)
+  
+  def _get_sent_flow_mods(self):
+    return [msg for msg in self.forwarder.sent_messages
+            if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+  
+  def test_parse_nat_cookie(self):
+    cookie = natinstaller.get_nat_cookie(256, 3, 1)
+    self.assertEqual(natinstaller.parse_nat_cookie(cookie), (256, 3, 1))
+    self.assertIsNone(natinstaller.parse_nat_cookie(0))
+  
+  def test_install_nat_entry_cookies(self):
+    self.nat_installer.install_nat_entry(self.table_entry)
+    
+    self.assertEqual(
+      sorted(natinstaller.parse_nat_cookie(flow_mod.cookie)
+             for flow_mod in self._get_sent_flow_mods()),
+      [(256, 0, 0), (256, 0, 1)])
+  
+  def test_install_nat_entry_cookie_ip_outside_nat_pool(self):
+    self.table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.TCP,
+      "10.0.0.1", 2000, "200.0.0.2", 50000, 30)
+    self.nat_installer.install_nat_entry(self.table_entry)
+    
+    for flow_mod in self._get_sent_flow_mods():
+      self.assertEqual(natinstaller.parse_nat_cookie(flow_mod.cookie)[0], (1 << 24) - 1)
+  
+  def test_uninstall_nat_entries_by_internal_ip(self):
+    self.nat_installer.uninstall_nat_entries_by_internal_ip("172.16.1.2", [self.table_entry])
+    
+    flow_mods = self._get_sent_flow_mods()
+    self.assertEqual(len(flow_mods), 1)
+    self.assertEqual(flow_mods[0].table_id, ofproto_v1_3.OFPTT_ALL)
+    self.assertEqual(flow_mods[0].cookie & flow_mods[0].cookie_mask,
+                     natinstaller.get_nat_cookie(256, 0, 0))
+  
+  def test_uninstall_nat_entries_by_internal_ip_outside_nat_pool(self):
+    self.nat_installer.uninstall_nat_entries_by_internal_ip("10.0.0.1", [self.table_entry])
+    
+    self.assertEqual([flow_mod.command for flow_mod in self._get_sent_flow_mods()],
+                     [ofproto_v1_3.OFPFC_DELETE] * 2)
+
+
+class TestNatFlowModTemplate(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+  
+  def _assert_flow_mod_equal_to_reference(self, table_entry, translation_direction,
+                                          match_fields, action_fields):
+    flow_mod_template = natinstaller._NatFlowModTemplate(self.forwarder, 2, 4,
+      table_entry.address_family, table_entry.protocol, translation_direction, 1)
+    flow_mod = flow_mod_template.build_flow_mod(table_entry, 30, 0x4e00000000000102)
+    flow_mod.xid = 7
+    flow_mod.serialize()
+    
+    parser = ofproto_v1_3_parser
+    match = parser.OFPMatch(
+      eth_type=table_entry.address_family, ip_proto=table_entry.protocol, **match_fields)
+    actions = [parser.OFPActionSetField(**{field_name: field_value})
+               for field_name, field_value in action_fields]
+    instructions = [
+      parser.OFPInstructionActions(ofproto_v1_3.OFPIT_APPLY_ACTIONS, actions),
+      parser.OFPInstructionGotoTable(4)
+    ]
+    reference_flow_mod = parser.OFPFlowMod(self.forwarder, command=ofproto_v1_3.OFPFC_ADD,
+      match=match, instructions=instructions, table_id=2, idle_timeout=30, priority=1,
+      cookie=0x4e00000000000102, flags=ofproto_v1_3.OFPFF_SEND_FLOW_REM)
+    reference_flow_mod.xid = 7
+    reference_flow_mod.serialize()
+    
+    self.assertEqual(bytes(flow_mod.buf), bytes(reference_flow_mod.buf))
+  
+  def test_build_flow_mod_ipv4_tcp_internal_to_external(self):
+    table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.TCP,
+      "172.16.1.2", 2000, "200.0.0.2", 50000, 30)
+    
+    self._assert_flow_mod_equal_to_reference(
+      table_entry, natinstaller.NatTranslationDirection.INTERNAL_TO_EXTERNAL,
+      {'ipv4_src': "172.16.1.2", 'tcp_src': 2000},
+      [('ipv4_src', "200.0.0.2"), ('tcp_src', 50000)])
+  
+  def test_build_flow_mod_ipv4_udp_external_to_internal(self):
+    table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.UDP,
+      "172.16.1.2", 2000, "200.0.0.2", 50000, 30)
+    
+    self._assert_flow_mod_equal_to_reference(
+      table_entry, natinstaller.NatTranslationDirection.EXTERNAL_TO_INTERNAL,
+      {'ipv4_dst': "200.0.0.2", 'udp_dst': 50000},
+      [('ipv4_dst', "172.16.1.2"), ('udp_dst', 2000)])
+  
+  def test_build_flow_mod_ipv6_tcp_external_to_internal(self):
+    table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv6, nattable.IpUpperProtocol.TCP,
+      "fd00::1:2", 2000, "2001:db8::2", 50000, 30)
+    
+    self._assert_flow_mod_equal_to_reference(
+      table_entry, natinstaller.NatTranslationDirection.EXTERNAL_TO_INTERNAL,
+      {'ipv6_dst': "2001:db8::2", 'tcp_dst': 50000},
+      [('ipv6_dst', "fd00::1:2"), ('tcp_dst', 2000)])
+  
+  def test_build_flow_mod_ipv6_udp_internal_to_external(self):
+    table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv6, nattable.IpUpperProtocol.UDP,
+      "fd00::1:2", 2000, "2001:db8::2", 50000, 30)
+    
+    self._assert_flow_mod_equal_to_reference(
+      table_entry, natinstaller.NatTranslationDirection.INTERNAL_TO_EXTERNAL,
+      {'ipv6_src': "fd00::1:2", 'udp_src': 2000},
+      [('ipv6_src', "2001:db8::2"), ('udp_src', 50000)])
+  
+  def test_install_nat_entry_reuses_templates(self):
+    nat_installer = natinstaller.NatInstaller(self.forwarder, 2, [1, 2, 3], 4)
+    del self.forwarder.sent_messages[:]
+    
+    for internal_port in [2000, 2001]:
+      nat_installer.install_nat_entry(nattable.NatTableEntry(
+        nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.TCP,
+        "172.16.1.2", internal_port, "200.0.0.2", internal_port + 48000, 30))
+    
+    self.assertEqual(len(nat_installer._flow_mod_templates), 2)
+    
+    flow_mods = self.forwarder.sent_messages
+    self.assertEqual([flow_mod.table_id for flow_mod in flow_mods], [2, 3, 2, 3])
+    self.assertEqual([flow_mod.match['tcp_src'] for flow_mod in flow_mods[::2]], [2000, 2001])
+    self.assertEqual([flow_mod.match['tcp_dst'] for flow_mod in flow_mods[1::2]], [50000, 50001])
+    
+    nat_installer.set_forwarder(_FakeForwarder())
+    self.assertEqual(nat_installer._flow_mod_templates, {})
@@ -0,0 +1,118 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..nat import natjournal
+from ..nat import nattable
+
+from .test_nathandler import _FakeClock
+
+#===============================================================================
+
+
+class TestNatJournal(unittest.TestCase):
+  
+  def setUp(self):
+    self.journal_dir = tempfile.mkdtemp()
+    self.path_prefix = os.path.join(self.journal_dir, "nat")
+    self.clock = _FakeClock()
+    self.journal = self._create_journal()
+    self.assertEqual(self.journal.load(), [])
+  
+  def tearDown(self):
+    self.journal.close()
+    shutil.rmtree(self.journal_dir)
+  
+  def _create_journal(self):
+    return natjournal.NatJournal(self.path_prefix, clock=self.clock, compaction_threshold=3)
+  
+  def _reload(self):
+    self.journal.close()
+    self.journal = self._create_journal()
+    return sorted(self.journal.load(), key=lambda entry: entry.internal_port)
+  
+  def _create_entry(self, internal_port, lifetime=3600, internal_ip="172.16.1.1"):
+    return nattable.NatTableEntry(nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.UDP,
+      internal_ip, internal_port, "200.0.0.2", internal_port + 50000, lifetime,
+      self.clock() + lifetime)
+  
+  def test_load_replays_records(self):
+    entries = [self._create_entry(port) for port in [1000, 1001, 1002]]
+    for entry in entries:
+      self.journal.record_create(entry)
+    
+    entries[1].lifetime = 7200
+    entries[1].expiry_time = self.clock() + 7200
+    self.journal.record_refresh(entries[1])
+    self.journal.record_remove(entries[2])
+    
+    loaded_entries = self._reload()
+    
+    self.assertEqual([entry.to_dict() for entry in loaded_entries],
+                     [entry.to_dict() for entry in entries[:2]])
+    self.assertEqual(self.journal.num_journal_records, 5)
+  
+  def test_load_skips_expired_entries(self):
+    self.journal.record_create(self._create_entry(1000, lifetime=30))
+    self.journal.record_create(self._create_entry(1001, lifetime=60))
+    
+    self.clock.time += 30
+    
+    self.assertEqual([entry.internal_port for entry in self._reload()], [1001])
+  
+  def test_load_ignores_incomplete_last_record(self):
+    self.journal.record_create(self._create_entry(1000))
+    self.journal.record_create(self._create_entry(1001))
+    self.journal.close()
+    
+    journal_path = self.path_prefix + ".journal"
+    with open(journal_path, 'r+b') as journal_file:
+      journal_file.truncate(os.path.getsize(journal_path) - 10)
+    
+    self.assertEqual([entry.internal_port for entry in self._reload()], [1000])
+    
+    # New records are appended after the last complete record.
+    self.journal.record_create(self._create_entry(1002))
+    self.assertEqual([entry.internal_port for entry in self._reload()], [1000, 1002])
+  
+  def test_load_ignores_corrupted_last_record(self):
+    self.journal.record_create(self._create_entry(1000))
+    self.journal.record_create(self._create_entry(1001))
+    self.journal.close()
+    
+    with open(self.path_prefix + ".journal", 'r+b') as journal_file:
+      journal_file.seek(-20, os.SEEK_END)
+      journal_file.write(b"\xff")
+    
+    self.assertEqual([entry.internal_port for entry in self._reload()], [1000])
+  
+  def test_load_invalid_file(self):
+    self.journal.close()
+    with open(self.path_prefix + ".journal", 'wb') as journal_file:
+      journal_file.write(b"invalid journal")
+    
+    self.journal = self._create_journal()
+    with self.assertRaises(natjournal.NatJournalError):
+      self.journal.load()
+  
+  def test_load_ipv6(self):
+    self.journal.record_create(self._create_entry(1000, internal_ip="2001:db8::1"))
+    
+    self.assertEqual(self._reload()[0].internal_ip, "2001:db8::1")
+  
+  def test_compact_if_due(self):
+    entries = [self._create_entry(port) for port in [1000, 1001]]
+    for entry in entries:
+      self.journal.record_create(entry)
+    
+    self.assertFalse(self.journal.compact_if_due(lambda: entries))
+    
+    self.journal.record_remove(entries[0])
+    self.assertTrue(self.journal.compact_if_due(lambda: entries[1:]))
+    self.assertEqual(self.journal.num_journal_records, 0)
+    
+    self.journal.record_create(entries[0])
+    
+    self.assertEqual([entry.internal_port for entry in self._reload()], [1000, 1001])
+    self.assertEqual(self.journal.num_journal_records, 1)
@@ -0,0 +1,34 @@
+import unittest
+
+from ..nat import natpool
+
+#===============================================================================
+
+
+class TestPartitionNatPoolConfig(unittest.TestCase):
+  
+  def setUp(self):
+    self.nat_pool_config = {
+      'external_ip_low_end': "200.0.0.1",
+      'external_ip_high_end': "200.0.0.10",
+      'external_port_low_end': 49152,
+    }
+  
+  def test_partition_nat_pool_config(self):
+    nat_pool_configs = natpool.partition_nat_pool_config(self.nat_pool_config, 3)
+    
+    self.assertEqual(
+      [(config['external_ip_low_end'], config['external_ip_high_end'])
+       for config in nat_pool_configs],
+      [("200.0.0.1", "200.0.0.4"), ("200.0.0.5", "200.0.0.7"), ("200.0.0.8", "200.0.0.10")])
+    for config in nat_pool_configs:
+      self.assertEqual(config['external_port_low_end'], 49152)
+  
+  def test_partition_nat_pool_config_single_partition(self):
+    self.assertEqual(
+      natpool.partition_nat_pool_config(self.nat_pool_config, 1),
+      [self.nat_pool_config])
+  
+  def test_partition_nat_pool_config_too_many_partitions(self):
+    with self.assertRaises(ValueError):
+      natpool.partition_nat_pool_config(self.nat_pool_config, 11)
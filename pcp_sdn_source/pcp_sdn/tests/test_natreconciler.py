@@ -0,0 +1,268 @@
+import unittest
+
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from ..nat import natinstaller
+from ..nat import natreconciler
+from ..nat import nattable
+
+from .test_nathandler import _FakeForwarder, _FakeClock
+
+#===============================================================================
+
+
+class TestNatFlowReconciler(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+    self.clock = _FakeClock()
+    self.nat_table = nattable.NatTable(clock=self.clock)
+    self.nat_installer = natinstaller.NatInstaller(self.forwarder, 2, [1, 2, 3], 4)
+    self.reconciler = natreconciler.NatFlowReconciler(
+      self.nat_table, self.nat_installer, timeout=10, clock=self.clock)
+    
+    self.table_entries = [
+      self.nat_table.add_entry("172.16.1.1", 2000, 30, protocol=nattable.IpUpperProtocol.TCP),
+      self.nat_table.add_entry("172.16.1.2", 2000, 30, protocol=nattable.IpUpperProtocol.UDP),
+    ]
+    del self.forwarder.sent_messages[:]
+  
+  def _get_flow_stats(self, table_entry, priority=None):
+    """
+    Return `OFPFlowStats` of the flow entries the NAT installer installs for the
+    NAT table entry.
+    """
+    
+    forwarder = _FakeForwarder()
+    nat_installer = natinstaller.NatInstaller(forwarder, 2, [1, 2, 3], 4)
+    del forwarder.sent_messages[:]
+    nat_installer.install_nat_entry(table_entry)
+    
+    return [
+      ofproto_v1_3_parser.OFPFlowStats(table_id=flow_mod.table_id,
+        priority=flow_mod.priority if priority is None else priority,
+        cookie=flow_mod.cookie, match=flow_mod.match, instructions=flow_mod.instructions)
+      for flow_mod in forwarder.sent_messages]
+  
+  def _reconcile(self, flow_stats_by_table):
+    self.reconciler.start()
+    
+    stats_requests = list(self.forwarder.sent_messages)
+    self.assertEqual([request.table_id for request in stats_requests], [2, 3])
+    for request in stats_requests:
+      self.assertEqual(request.cookie, natinstaller.NAT_COOKIE_MARKER)
+      self.assertEqual(request.cookie_mask, natinstaller.NAT_COOKIE_MARKER_MASK)
+    del self.forwarder.sent_messages[:]
+    
+    for request in stats_requests:
+      reply = ofproto_v1_3_parser.OFPFlowStatsReply(
+        self.forwarder, body=flow_stats_by_table.get(request.table_id, []), flags=0)
+      reply.xid = request.xid
+      self.assertTrue(self.reconciler.handle_flow_stats_reply(reply))
+    
+    self.assertFalse(self.reconciler.in_progress)
+    
+    return self.forwarder.sent_messages
+  
+  def test_all_flow_entries_installed(self):
+    flow_stats = self._get_flow_stats(self.table_entries[0]) + self._get_flow_stats(self.table_entries[1])
+    
+    flow_mods = self._reconcile({
+      2: [stats for stats in flow_stats if stats.table_id == 2],
+      3: [stats for stats in flow_stats if stats.table_id == 3],
+    })
+    
+    self.assertEqual(flow_mods, [])
+  
+  def test_missing_flow_entries_installed(self):
+    flow_stats = self._get_flow_stats(self.table_entries[0])
+    
+    flow_mods = self._reconcile({2: flow_stats[:1]})
+    
+    self.assertEqual(
+      sorted((flow_mod.command, flow_mod.table_id) for flow_mod in flow_mods),
+      [(ofproto_v1_3.OFPFC_ADD, 2), (ofproto_v1_3.OFPFC_ADD, 3), (ofproto_v1_3.OFPFC_ADD, 3)])
+  
+  def test_orphaned_flow_entries_uninstalled(self):
+    orphaned_table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.UDP,
+      "172.16.1.3", 3000, "200.0.0.3", 60000, 30)
+    flow_stats = (
+      self._get_flow_stats(self.table_entries[0]) + self._get_flow_stats(self.table_entries[1]))
+    orphaned_flow_stats = self._get_flow_stats(orphaned_table_entry)
+    
+    flow_mods = self._reconcile({
+      2: [stats for stats in flow_stats + orphaned_flow_stats if stats.table_id == 2],
+      3: [stats for stats in flow_stats + orphaned_flow_stats if stats.table_id == 3],
+    })
+    
+    self.assertEqual(
+      sorted((flow_mod.command, flow_mod.table_id) for flow_mod in flow_mods),
+      [(ofproto_v1_3.OFPFC_DELETE_STRICT, 2), (ofproto_v1_3.OFPFC_DELETE_STRICT, 3)])
+    self.assertEqual(flow_mods[0].match['ipv4_src'], "172.16.1.3")
+  
+  def test_flow_entry_with_different_translation_overwritten(self):
+    stale_table_entry = nattable.NatTableEntry(
+      nattable.AddressFamily.IPv4, nattable.IpUpperProtocol.TCP,
+      self.table_entries[0].internal_ip, self.table_entries[0].internal_port,
+      "200.0.0.99", 60000, 30)
+    flow_stats = self._get_flow_stats(stale_table_entry)
+    
+    flow_mods = self._reconcile({2: flow_stats[:1]})
+    
+    # The stale internal -> external flow entry is replaced by `OFPFC_ADD`.
+    self.assertEqual(
+      sorted((flow_mod.command, flow_mod.table_id) for flow_mod in flow_mods),
+      [(ofproto_v1_3.OFPFC_ADD, 2), (ofproto_v1_3.OFPFC_ADD, 2),
+       (ofproto_v1_3.OFPFC_ADD, 3), (ofproto_v1_3.OFPFC_ADD, 3)])
+  
+  def test_flow_entry_with_different_priority_uninstalled(self):
+    flow_stats = self._get_flow_stats(self.table_entries[0], priority=2)
+    
+    flow_mods = self._reconcile({2: flow_stats[:1], 3: flow_stats[1:]})
+    
+    self.assertEqual(
+      sorted((flow_mod.command, flow_mod.priority) for flow_mod in flow_mods
+             if flow_mod.command == ofproto_v1_3.OFPFC_DELETE_STRICT),
+      [(ofproto_v1_3.OFPFC_DELETE_STRICT, 2)] * 2)
+    self.assertEqual(
+      len([flow_mod for flow_mod in flow_mods if flow_mod.command == ofproto_v1_3.OFPFC_ADD]), 4)
+  
+  def test_multipart_replies(self):
+    flow_stats = self._get_flow_stats(self.table_entries[0])
+    
+    self.reconciler.start()
+    stats_requests = list(self.forwarder.sent_messages)
+    del self.forwarder.sent_messages[:]
+    
+    reply = ofproto_v1_3_parser.OFPFlowStatsReply(
+      self.forwarder, body=flow_stats[:1], flags=ofproto_v1_3.OFPMPF_REPLY_MORE)
+    reply.xid = stats_requests[0].xid
+    self.assertTrue(self.reconciler.handle_flow_stats_reply(reply))
+    
+    reply = ofproto_v1_3_parser.OFPFlowStatsReply(self.forwarder, body=[], flags=0)
+    reply.xid = stats_requests[0].xid
+    self.assertTrue(self.reconciler.handle_flow_stats_reply(reply))
+    
+    reply = ofproto_v1_3_parser.OFPFlowStatsReply(self.forwarder, body=flow_stats[1:], flags=0)
+    reply.xid = stats_requests[1].xid
+    self.assertTrue(self.reconciler.handle_flow_stats_reply(reply))
+    
+    # Only flow entries of the second NAT table entry are missing.
+    self.assertEqual(len(self.forwarder.sent_messages), 2)
+  
+  def _reconcile_next_page(self, flow_stats_by_table=None):
+    del self.forwarder.sent_messages[:]
+    self.assertTrue(self.reconciler.start_next_page())
+    
+    stats_requests = list(self.forwarder.sent_messages)
+    del self.forwarder.sent_messages[:]
+    
+    for request in stats_requests:
+      reply = ofproto_v1_3_parser.OFPFlowStatsReply(
+        self.forwarder, body=(flow_stats_by_table or {}).get(request.table_id, []), flags=0)
+      reply.xid = request.xid
+      self.assertTrue(self.reconciler.handle_flow_stats_reply(reply))
+    
+    return stats_requests, self.forwarder.sent_messages
+  
+  def test_pages(self):
+    # Internal IP indexes: 255 for 172.16.1.1, 256 for 172.16.1.2
+    self.reconciler = natreconciler.NatFlowReconciler(
+      self.nat_table, self.nat_installer, page_size=256)
+    
+    stats_requests, flow_mods = self._reconcile_next_page()
+    self.assertEqual(
+      [(request.cookie, request.cookie_mask) for request in stats_requests],
+      [natinstaller.get_nat_cookie_filter_by_internal_ip_indexes(0, 256)] * 2)
+    self.assertEqual(
+      set(flow_mod.match['ipv4_src'] for flow_mod in flow_mods if flow_mod.table_id == 2),
+      set(["172.16.1.1"]))
+    
+    stats_requests, flow_mods = self._reconcile_next_page()
+    self.assertEqual(stats_requests[0].cookie & 0xffffff, 256)
+    self.assertEqual(
+      set(flow_mod.match['ipv4_src'] for flow_mod in flow_mods if flow_mod.table_id == 2),
+      set(["172.16.1.2"]))
+    
+    for unused_ in range(254):
+      self._reconcile_next_page()
+    
+    # The walk starts over after the last page.
+    stats_requests, flow_mods = self._reconcile_next_page()
+    self.assertEqual(stats_requests[0].cookie & 0xffffff, 0)
+    self.assertEqual(len(flow_mods), 2)
+  
+  def test_page_flow_mod_budget(self):
+    self.reconciler = natreconciler.NatFlowReconciler(
+      self.nat_table, self.nat_installer, page_size=512, max_flow_mods_per_page=3)
+    
+    unused_, flow_mods = self._reconcile_next_page()
+    self.assertEqual(len(flow_mods), 3)
+    
+    # The page is reconciled again since the budget was exhausted.
+    flow_stats = self._get_flow_stats(self.table_entries[0])
+    stats_requests, flow_mods = self._reconcile_next_page({2: flow_stats[:1], 3: flow_stats[1:]})
+    self.assertEqual(stats_requests[0].cookie & 0xffffff, 0)
+    self.assertEqual(len(flow_mods), 2)
+    
+    stats_requests, unused_ = self._reconcile_next_page()
+    self.assertEqual(stats_requests[0].cookie & 0xffffff, 512)
+  
+  def test_start_next_page_in_progress(self):
+    self.assertTrue(self.reconciler.start_next_page())
+    self.assertFalse(self.reconciler.start_next_page())
+  
+  def test_start_next_page_reply_timed_out(self):
+    self.assertTrue(self.reconciler.start_next_page())
+    stats_requests = list(self.forwarder.sent_messages)
+    del self.forwarder.sent_messages[:]
+    
+    self.clock.time += 9
+    self.assertFalse(self.reconciler.start_next_page())
+    
+    self.clock.time += 1
+    self.assertTrue(self.reconciler.start_next_page())
+    self.assertEqual(
+      [(request.cookie, request.cookie_mask) for request in self.forwarder.sent_messages],
+      [(request.cookie, request.cookie_mask) for request in stats_requests])
+    
+    # Late replies to the abandoned requests are ignored.
+    reply = ofproto_v1_3_parser.OFPFlowStatsReply(self.forwarder, body=[], flags=0)
+    reply.xid = stats_requests[0].xid
+    self.assertFalse(self.reconciler.handle_flow_stats_reply(reply))
+  
+  def test_error_abandons_reconciliation(self):
+    self.assertTrue(self.reconciler.start_next_page())
+    stats_requests = list(self.forwarder.sent_messages)
+    del self.forwarder.sent_messages[:]
+    
+    reply = ofproto_v1_3_parser.OFPFlowStatsReply(self.forwarder, body=[], flags=0)
+    reply.xid = stats_requests[0].xid
+    self.assertTrue(self.reconciler.handle_flow_stats_reply(reply))
+    
+    error_msg = ofproto_v1_3_parser.OFPErrorMsg(
+      self.forwarder, type_=ofproto_v1_3.OFPET_BAD_REQUEST, code=ofproto_v1_3.OFPBRC_EPERM)
+    error_msg.xid = stats_requests[1].xid
+    self.assertTrue(self.reconciler.handle_error(error_msg))
+    
+    self.assertFalse(self.reconciler.in_progress)
+    self.assertEqual(self.forwarder.sent_messages, [])
+    self.assertFalse(self.reconciler.handle_error(error_msg))
+    
+    self.assertTrue(self.reconciler.start_next_page())
+    self.assertEqual(
+      [(request.cookie, request.cookie_mask) for request in self.forwarder.sent_messages],
+      [(request.cookie, request.cookie_mask) for request in stats_requests])
+  
+  def test_reply_to_unknown_request_ignored(self):
+    self.reconciler.start()
+    del self.forwarder.sent_messages[:]
+    
+    reply = ofproto_v1_3_parser.OFPFlowStatsReply(self.forwarder, body=[], flags=0)
+    reply.xid = 12345
+    self.assertFalse(self.reconciler.handle_flow_stats_reply(reply))
+    self.assertTrue(self.reconciler.in_progress)
+    self.assertEqual(self.forwarder.sent_messages, [])
+
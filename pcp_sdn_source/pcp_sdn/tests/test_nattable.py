@@ -1,3 +1,4 @@
+import random
 import unittest
 
 from ..nat import nattable
@@ -39,7 +40,7 @@ class TestNatTable(unittest.TestCase):
   def test_add_entry_explicit_args(self):
     self.table.add_entry(**self.table_entry_args_explicit)
     
-    table_entry = self.table.find_entry("172.16.1.1", 2000)
+    table_entry = self.table.find_entry("172.16.1.1", 2000, nattable.IpUpperProtocol.TCP)
     
     for entry_param_name, entry_param_value in self.table_entry_args_explicit.items():
       self.assertEqual(getattr(table_entry, entry_param_name), entry_param_value)
@@ -73,6 +74,128 @@ class TestNatTable(unittest.TestCase):
     self.assertEqual(table_entry.external_ip, "200.0.0.2")
     self.assertEqual(table_entry.external_port, 49152)
   
+  def test_add_entry_explicit_external_ip_and_port_in_use(self):
+    self.table.add_entry(**self.table_entry_args_explicit)
+    
+    self.table_entry_args_explicit['internal_port'] = 2001
+    self.table.add_entry(**self.table_entry_args_explicit)
+    
+    table_entry = self.table.find_entry("172.16.1.1", 2001, nattable.IpUpperProtocol.TCP)
+    self.assertNotEqual(
+      (table_entry.external_ip, table_entry.external_port), ("200.0.0.1", 50000))
+  
+  def test_add_entry_released_port_reused(self):
+    pool_config = dict(self._NAT_POOL_CONFIG)
+    pool_config['external_port_high_end'] = pool_config['external_port_low_end'] + 1
+    self.table = nattable.NatTable(**pool_config)
+    
+    self.table.add_entry(**self.table_entry_args)
+    self.table_entry_args['internal_port'] = 2001
+    self.table.add_entry(**self.table_entry_args)
+    self.table.remove_entry("172.16.1.1", 2000)
+    
+    self.table_entry_args['internal_port'] = 2002
+    table_entry = self.table.add_entry(**self.table_entry_args)
+    self.assertEqual(table_entry.external_ip, "200.0.0.1")
+    self.assertEqual(table_entry.external_port, 49152)
+  
+  def test_add_entry_released_ip_preferred_over_unused_ip(self):
+    pool_config = dict(self._NAT_POOL_CONFIG)
+    pool_config['external_port_high_end'] = pool_config['external_port_low_end']
+    self.table = nattable.NatTable(**pool_config)
+    
+    for internal_port in [2000, 2001]:
+      self.table_entry_args['internal_port'] = internal_port
+      self.table.add_entry(**self.table_entry_args)
+    self.table.remove_entry("172.16.1.1", 2000)
+    
+    self.table_entry_args['internal_port'] = 2002
+    table_entry = self.table.add_entry(**self.table_entry_args)
+    self.assertEqual(table_entry.external_ip, "200.0.0.1")
+    self.assertEqual(table_entry.external_port, 49152)
+  
+  def test_add_entry_nat_pool_depleted(self):
+    pool_config = dict(self._NAT_POOL_CONFIG)
+    pool_config['external_ip_high_end'] = pool_config['external_ip_low_end']
+    pool_config['external_port_high_end'] = pool_config['external_port_low_end']
+    self.table = nattable.NatTable(**pool_config)
+    
+    self.table.add_entry(**self.table_entry_args)
+    
+    self.table_entry_args['internal_port'] = 2001
+    with self.assertRaises(nattable.NatPoolDepletedError):
+      self.table.add_entry(**self.table_entry_args)
+  
+  def test_add_entry_random_port_allocation_no_collisions(self):
+    pool_config = dict(self._NAT_POOL_CONFIG)
+    pool_config['external_ip_high_end'] = pool_config['external_ip_low_end']
+    pool_config['external_port_high_end'] = pool_config['external_port_low_end'] + 999
+    pool_config['port_allocation_type'] = nattable.NatTableAllocationType.RANDOM
+    self.table = nattable.NatTable(**pool_config)
+    
+    external_ports = set()
+    for internal_port in range(1000):
+      self.table_entry_args['internal_port'] = internal_port + 1
+      external_ports.add(self.table.add_entry(**self.table_entry_args).external_port)
+    
+    self.assertEqual(external_ports, set(range(49152, 49152 + 1000)))
+    
+    self.table_entry_args['internal_port'] = 2000
+    with self.assertRaises(nattable.NatPoolDepletedError):
+      self.table.add_entry(**self.table_entry_args)
+  
+  def test_add_entry_random_ip_allocation_no_collisions(self):
+    pool_config = dict(self._NAT_POOL_CONFIG)
+    pool_config['external_ip_high_end'] = "200.0.0.10"
+    pool_config['external_port_high_end'] = pool_config['external_port_low_end']
+    pool_config['ip_allocation_type'] = nattable.NatTableAllocationType.RANDOM
+    self.table = nattable.NatTable(**pool_config)
+    
+    external_ips = set()
+    for internal_port in range(10):
+      self.table_entry_args['internal_port'] = internal_port + 1
+      external_ips.add(self.table.add_entry(**self.table_entry_args).external_ip)
+    
+    self.assertEqual(external_ips, set("200.0.0.{0}".format(i) for i in range(1, 11)))
+  
+  def test_add_entry_same_internal_ip_and_port_different_protocol(self):
+    self.table.add_entry(protocol=nattable.IpUpperProtocol.TCP, **self.table_entry_args)
+    self.table.add_entry(protocol=nattable.IpUpperProtocol.UDP, **self.table_entry_args)
+    
+    table_entry_tcp = self.table.find_entry("172.16.1.1", 2000, nattable.IpUpperProtocol.TCP)
+    table_entry_udp = self.table.find_entry("172.16.1.1", 2000, nattable.IpUpperProtocol.UDP)
+    self.assertEqual(table_entry_tcp.protocol, nattable.IpUpperProtocol.TCP)
+    self.assertEqual(table_entry_udp.protocol, nattable.IpUpperProtocol.UDP)
+  
+  def test_find_entry_ip_and_port_not_ambiguous(self):
+    self.table_entry_args['internal_ip'] = "10.0.0.1"
+    self.table_entry_args['internal_port'] = 23
+    self.table.add_entry(**self.table_entry_args)
+    
+    self.assertEqual(self.table.find_entry("10.0.0.12", 3), None)
+  
+  def test_find_entry_by_external(self):
+    table_entry = self.table.add_entry(**self.table_entry_args_explicit)
+    
+    self.assertIs(self.table.find_entry_by_external(
+      "200.0.0.1", 50000, nattable.IpUpperProtocol.TCP), table_entry)
+    self.assertEqual(self.table.find_entry_by_external(
+      "200.0.0.1", 50000, nattable.IpUpperProtocol.UDP), None)
+  
+  def test_get_key_ipv4_mapped_ipv6_address(self):
+    self.assertEqual(nattable.get_key("::ffff:172.16.1.1", 2000, nattable.IpUpperProtocol.UDP),
+                     nattable.get_key("172.16.1.1", 2000, nattable.IpUpperProtocol.UDP))
+    self.assertNotEqual(nattable.get_key("::172.16.1.1", 2000, nattable.IpUpperProtocol.UDP),
+                        nattable.get_key("172.16.1.1", 2000, nattable.IpUpperProtocol.UDP))
+  
+  def test_get_address_family(self):
+    self.assertEqual(nattable.get_address_family(nattable.ip_to_int("172.16.1.1")),
+                     nattable.AddressFamily.IPv4)
+    self.assertEqual(nattable.get_address_family(nattable.ip_to_int("::ffff:172.16.1.1")),
+                     nattable.AddressFamily.IPv4)
+    self.assertEqual(nattable.get_address_family(nattable.ip_to_int("::172.16.1.1")),
+                     nattable.AddressFamily.IPv6)
+  
   def test_update_entry_lifetime(self):
     self.table.add_entry(**self.table_entry_args)
     
@@ -83,6 +206,18 @@ class TestNatTable(unittest.TestCase):
                                         self.table_entry_args['internal_port'])
     self.assertEqual(table_entry.lifetime, 400)
   
+  def test_update_entry_lifetime_in_place(self):
+    self.table = nattable.NatTable(clock=lambda: 1000.0, **self._NAT_POOL_CONFIG)
+    table_entry = self.table.add_entry(**self.table_entry_args)
+    
+    updated_table_entry = self.table.update_entry_lifetime(
+      self.table_entry_args['internal_ip'], self.table_entry_args['internal_port'], 400)
+    
+    self.assertIs(updated_table_entry, table_entry)
+    self.assertIs(self.table.find_entry_by_external(
+      table_entry.external_ip, table_entry.external_port), table_entry)
+    self.assertEqual(table_entry.expiry_time, 1400.0)
+  
   def test_remove_entry(self):
     self.table.add_entry(**self.table_entry_args)
     self.table.remove_entry(
@@ -90,4 +225,75 @@ class TestNatTable(unittest.TestCase):
     
     self.assertEqual(self.table.find_entry(
       self.table_entry_args['internal_ip'], self.table_entry_args['internal_port']), None)
-  
\ No newline at end of file
+  
+  def test_remove_entries_by_internal_ip(self):
+    self.table.add_entry(**self.table_entry_args)
+    self.table_entry_args['internal_port'] = 2001
+    self.table.add_entry(**self.table_entry_args)
+    self.table.add_entry("172.16.1.2", 2000, 3600)
+    
+    removed_entries = self.table.remove_entries_by_internal_ip("172.16.1.1")
+    
+    self.assertEqual(sorted(entry.internal_port for entry in removed_entries), [2000, 2001])
+    self.assertEqual(self.table.find_entry("172.16.1.1", 2000), None)
+    self.assertEqual(self.table.find_entry("172.16.1.1", 2001), None)
+    self.assertIsNotNone(self.table.find_entry("172.16.1.2", 2000))
+    self.assertEqual(self.table.remove_entries_by_internal_ip("172.16.1.1"), [])
+  
+  def test_remove_entries_by_external_ip(self):
+    table_entry = self.table.add_entry(**self.table_entry_args_explicit)
+    
+    removed_entries = self.table.remove_entries_by_external_ip("200.0.0.1")
+    
+    self.assertEqual(removed_entries, [table_entry])
+    self.assertEqual(self.table.find_entry_by_external(
+      "200.0.0.1", 50000, nattable.IpUpperProtocol.TCP), None)
+  
+  def test_count_entries_by_internal_ip(self):
+    self.assertEqual(self.table.count_entries_by_internal_ip("172.16.1.1"), 0)
+    
+    self.table.add_entry(**self.table_entry_args)
+    self.table_entry_args['internal_port'] = 2001
+    self.table.add_entry(**self.table_entry_args)
+    self.table.add_entry("172.16.1.2", 2000, 3600)
+    self.assertEqual(self.table.count_entries_by_internal_ip("172.16.1.1"), 2)
+    
+    self.table.remove_entry("172.16.1.1", 2000)
+    self.assertEqual(self.table.count_entries_by_internal_ip("172.16.1.1"), 1)
+  
+  def test_get_entries_by_internal_ip_range(self):
+    self.table.add_entry("172.16.1.3", 2000, 3600)
+    self.table.add_entry("172.16.1.1", 2000, 3600)
+    self.table.add_entry("172.16.1.1", 2001, 3600)
+    self.table.add_entry("172.16.1.4", 2000, 3600)
+    
+    entries = self.table.get_entries_by_internal_ip_range(nattable.ip_to_int("172.16.1.0"), 4)
+    self.assertEqual(
+      sorted((entry.internal_ip, entry.internal_port) for entry in entries),
+      [("172.16.1.1", 2000), ("172.16.1.1", 2001), ("172.16.1.3", 2000)])
+    self.assertEqual(entries[-1].internal_ip, "172.16.1.3")
+  
+  def test_remove_all_entries(self):
+    self.table.add_entry(**self.table_entry_args)
+    self.table.add_entry("172.16.1.2", 2000, 3600)
+    
+    self.assertEqual(len(self.table.remove_all_entries()), 2)
+    self.assertEqual(self.table.find_entry("172.16.1.2", 2000), None)
+    self.assertEqual(self.table.remove_entries_by_internal_ip("172.16.1.2"), [])
+
+
+class TestExternalPortPool(unittest.TestCase):
+  
+  def test_reserve_release_cycle_bounded(self):
+    for random_ in [None, random.Random(1)]:
+      port_pool = nattable._ExternalPortPool(49152, 49161, random_=random_)
+      
+      for unused_ in range(1000):
+        self.assertTrue(port_pool.reserve(49152))
+        port_pool.release(49152)
+      
+      self.assertEqual(len(port_pool._released_offsets), 1)
+      
+      allocated_ports = set(port_pool.allocate() for unused_ in range(10))
+      self.assertEqual(allocated_ports, set(range(49152, 49162)))
+      self.assertIsNone(port_pool.allocate())
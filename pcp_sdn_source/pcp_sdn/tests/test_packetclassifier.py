@@ -0,0 +1,67 @@
+import unittest
+
+from ryu.lib import packet
+
+from .. import packetclassifier
+
+#===============================================================================
+
+
+def _build_frame(*protocols):
+  packet_ = packet.packet.Packet()
+  for protocol in protocols:
+    packet_.add_protocol(protocol)
+  packet_.serialize()
+  return bytes(packet_.data)
+
+
+class TestPacketClassifier(unittest.TestCase):
+  
+  def setUp(self):
+    self.ethernet_ipv4 = packet.ethernet.ethernet(ethertype=0x0800)
+    self.pcp_payload = b"\x02\x01" + b"\x00" * 58
+  
+  def test_classify_pcp(self):
+    frame = _build_frame(self.ethernet_ipv4, packet.ipv4.ipv4(proto=17),
+                         packet.udp.udp(src_port=5350, dst_port=5351), self.pcp_payload)
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.PCP)
+  
+  def test_classify_pcp_ipv4_options(self):
+    frame = _build_frame(self.ethernet_ipv4,
+                         packet.ipv4.ipv4(header_length=6, proto=17, option=b"\x01\x01\x01\x00"),
+                         packet.udp.udp(src_port=5350, dst_port=5351), self.pcp_payload)
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.PCP)
+  
+  def test_classify_udp_other_port(self):
+    frame = _build_frame(self.ethernet_ipv4, packet.ipv4.ipv4(proto=17),
+                         packet.udp.udp(src_port=5351, dst_port=53))
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.OTHER)
+  
+  def test_classify_tcp(self):
+    frame = _build_frame(self.ethernet_ipv4, packet.ipv4.ipv4(proto=6),
+                         packet.tcp.tcp(src_port=5350, dst_port=5351))
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.OTHER)
+  
+  def test_classify_non_first_fragment(self):
+    frame = _build_frame(self.ethernet_ipv4, packet.ipv4.ipv4(proto=17, offset=100),
+                         packet.udp.udp(src_port=5350, dst_port=5351))
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.OTHER)
+  
+  def test_classify_arp(self):
+    frame = _build_frame(packet.ethernet.ethernet(ethertype=0x0806),
+                         packet.arp.arp_ip(packet.arp.ARP_REQUEST, "00:00:00:00:00:01",
+                                           "172.16.0.2", "00:00:00:00:00:00", "172.16.0.1"))
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.ARP)
+  
+  def test_classify_ipv6(self):
+    frame = _build_frame(packet.ethernet.ethernet(ethertype=0x86dd),
+                         packet.ipv6.ipv6(nxt=17), packet.udp.udp(dst_port=5351))
+    self.assertEqual(packetclassifier.classify(frame), packetclassifier.PacketClass.OTHER)
+  
+  def test_classify_truncated(self):
+    frame = _build_frame(self.ethernet_ipv4, packet.ipv4.ipv4(proto=17),
+                         packet.udp.udp(src_port=5350, dst_port=5351))
+    
+    for length in [0, 13, 20, 35]:
+      self.assertEqual(packetclassifier.classify(frame[:length]),
+                       packetclassifier.PacketClass.OTHER)
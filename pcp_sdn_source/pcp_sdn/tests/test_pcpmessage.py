@@ -118,6 +118,61 @@ class TestPcpMessage(unittest.TestCase):
     self._test_parse_pcp_opcode(
       self.pcp_data_request_announce_common, self.pcp_fields_request_announce_common)
   
+  def test_parse_pcp_request_peer_from_buffer(self):
+    fields = self.pcp_fields_request_peer_common
+    fields.update(self.pcp_fields_peer)
+    data = self.pcp_data_request_peer_common + self.pcp_data_peer
+    
+    self._test_parse_pcp_opcode(memoryview(data), fields)
+    self._test_parse_pcp_opcode(bytearray(data), fields)
+  
+  def test_parse_pcp_request_items_contain_ip_addresses(self):
+    pcp_message = pcpmessage.PcpMessage.parse(
+      self.pcp_data_request_map_common + self.pcp_data_map, self.pcp_client_ip)
+    
+    fields = dict(pcp_message.items())
+    self.assertEqual(fields['pcp_client_ip'], self.pcp_client_ip)
+    self.assertEqual(fields['external_ip'], "200.0.0.1")
+  
+  def test_parse_pcp_request_ipv6_addresses(self):
+    pcp_client_ip = "2001:db8::1"
+    data = (self.pcp_data_request_map_common[:8] +
+            pcpmessage.ip_addr_to_packed_str(pcp_client_ip) +
+            self.pcp_data_map[:20] + pcpmessage.ip_addr_to_packed_str("2001:db8::2"))
+    
+    pcp_message = pcpmessage.PcpMessage.parse(data, pcp_client_ip)
+    
+    self.assertEqual(pcp_message.parse_result, pcpmessage.PcpResultCodes.SUCCESS)
+    self.assertEqual(pcp_message['pcp_client_ip'], pcp_client_ip)
+    self.assertEqual(pcp_message['external_ip'], "2001:db8::2")
+  
+  def test_copy(self):
+    pcp_message = pcpmessage.PcpMessage.parse(
+      self.pcp_data_request_map_common + self.pcp_data_map, self.pcp_client_ip)
+    
+    pcp_message_copy = pcp_message.copy()
+    pcp_message_copy.lifetime = 0
+    
+    self.assertEqual(pcp_message.lifetime, 300)
+    self.assertEqual(dict(pcp_message_copy.items()),
+                     dict(pcp_message.items(), lifetime=0))
+  
+  def test_missing_field(self):
+    pcp_message = pcpmessage.PcpMessage(**self.pcp_fields_request_announce_common)
+    
+    self.assertNotIn('external_ip', pcp_message)
+    with self.assertRaises(KeyError):
+      pcp_message['external_ip']
+    with self.assertRaises(AttributeError):
+      pcp_message.external_ip
+  
+  def test_invalid_field(self):
+    pcp_message = pcpmessage.PcpMessage()
+    
+    with self.assertRaises(KeyError):
+      pcp_message['invalid_field'] = 1
+    self.assertFalse(hasattr(pcp_message, '__dict__'))
+  
   def test_parse_pcp_message_data_length_less_than_minimum(self):
     pcp_message = pcpmessage.PcpMessage.parse('\x00', self.pcp_client_ip)
     self.assertEqual(pcp_message, None)
@@ -196,6 +251,13 @@ class TestPcpMessage(unittest.TestCase):
     
     self.assertEqual(pcp_message.serialize(), expected_data)
   
+  def test_serialize_pcp_request_missing_field(self):
+    del self.pcp_fields_request_map_common['lifetime']
+    pcp_message = pcpmessage.PcpMessage(**self.pcp_fields_request_map_common)
+    
+    with self.assertRaises(KeyError):
+      pcp_message.serialize()
+  
   def test_serialize_pcp_request_announce(self):
     pcp_message = pcpmessage.PcpMessage(**self.pcp_fields_request_announce_common)
     
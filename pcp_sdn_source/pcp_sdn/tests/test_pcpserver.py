@@ -0,0 +1,382 @@
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from ryu.lib import packet
+from ryu.ofproto import ofproto_v1_3
+from ryu.ofproto import ofproto_v1_3_parser
+
+from .. import dphelper
+from ..nat import mappingquota
+from ..nat import nathandler
+from ..pcp import pcpmessage
+from ..pcp import pcpserver
+
+from ..app_config import app_config
+
+from .test_dphelper import _FakeDatapath
+from .test_nathandler import _FakeForwarder, _FakeClock
+
+#===============================================================================
+
+
+class TestPcpServer(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+    self.clock = _FakeClock()
+    self.pcp_server = pcpserver.PcpServer(clock=self.clock)
+    self.nat_handler = nathandler.NatHandler(self.forwarder, 2, [1, 2, 3], 4, clock=self.clock,
+      mapping_removal_callback=self.pcp_server.handle_mapping_removed)
+    
+    self.pcp_client_ip = "172.16.1.1"
+    self.pcp_request_fields = {
+      'version': 2,
+      'message_type': pcpmessage.PcpMessageTypes.REQUEST,
+      'opcode': pcpmessage.PcpMessageOpcodes.MAP,
+      'lifetime': 300,
+      'pcp_client_ip': self.pcp_client_ip,
+      'mapping_nonce': "0102030464ff8e110a090204",
+      'protocol': 17,
+      'internal_port': 1250,
+      'external_port': 0,
+      'external_ip': "::",
+    }
+  
+  def _build_pcp_request_packet(self):
+    pcp_request = pcpmessage.PcpMessage(**self.pcp_request_fields)
+    
+    pcp_request_packet = packet.packet.Packet()
+    pcp_request_packet.add_protocol(packet.ethernet.ethernet(
+      ethertype=0x0800, src="00:00:00:00:00:01", dst="00:00:00:00:00:02"))
+    pcp_request_packet.add_protocol(packet.ipv4.ipv4(
+      proto=17, src=self.pcp_client_ip, dst="172.16.0.1"))
+    pcp_request_packet.add_protocol(packet.udp.udp(src_port=5350, dst_port=5351))
+    pcp_request_packet.add_protocol(bytes(pcp_request.serialize()))
+    pcp_request_packet.serialize()
+    
+    return packet.packet.Packet(bytes(pcp_request_packet.data))
+  
+  def _get_sent_packet_outs(self):
+    return [msg for msg in self.forwarder.sent_messages
+            if isinstance(msg, ofproto_v1_3_parser.OFPPacketOut)]
+  
+  def _get_sent_flow_mods(self):
+    return [msg for msg in self.forwarder.sent_messages
+            if isinstance(msg, ofproto_v1_3_parser.OFPFlowMod)]
+  
+  def _get_last_pcp_response_lifetime_and_epoch_time(self):
+    pcp_response_packet = packet.packet.Packet(bytes(self._get_sent_packet_outs()[-1].data))
+    return struct.unpack_from("!LL", pcp_response_packet[-1], 4)
+  
+  def test_build_pcp_response_packet_matches_ryu_serialization(self):
+    pcp_request_packet = self._build_pcp_request_packet()
+    pcp_request = pcpmessage.PcpMessage.parse(pcp_request_packet[-1], self.pcp_client_ip)
+    mapping = {'lifetime': 300, 'external_ip': "200.0.0.2", 'external_port': 50000}
+    
+    pcp_response = self.pcp_server._build_pcp_response_payload(pcp_request, mapping)
+    frame = self.pcp_server._build_pcp_response_packet(pcp_request_packet, pcp_response)
+    
+    expected_packet = packet.packet.Packet()
+    expected_packet.add_protocol(packet.ethernet.ethernet(
+      ethertype=0x0800, src="00:00:00:00:00:02", dst="00:00:00:00:00:01"))
+    expected_packet.add_protocol(packet.ipv4.ipv4(proto=17, src="172.16.0.1", dst=self.pcp_client_ip))
+    expected_packet.add_protocol(packet.udp.udp(src_port=5351, dst_port=5350))
+    expected_packet.add_protocol(bytes(pcp_response.serialize()))
+    expected_packet.serialize()
+    
+    self.assertEqual(bytes(frame), bytes(expected_packet.data))
+  
+  def test_process_pcp_request_creates_mapping(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    mapping = self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17)
+    self.assertIsNotNone(mapping)
+    
+    packet_outs = self._get_sent_packet_outs()
+    self.assertEqual(len(packet_outs), 1)
+    
+    pcp_response_packet = packet.packet.Packet(bytes(packet_outs[0].data))
+    pcp_response_data = pcp_response_packet[-1]
+    self.assertEqual(len(pcp_response_data), 60)
+    self.assertEqual(pcpmessage.packed_str_to_ip_addr(pcp_response_data[44:60]),
+                     mapping['external_ip'])
+  
+  def test_process_pcp_request_response_sent_after_flow_mods(self):
+    datapath = _FakeDatapath()
+    flow_mod_batcher = dphelper.FlowModBatcher(datapath, 100, 60, clock=self.clock)
+    self.nat_handler = nathandler.NatHandler(flow_mod_batcher, 2, [1, 2, 3], 4, clock=self.clock)
+    flow_mod_batcher.flush()
+    del datapath.sent_buffers[:]
+    
+    self.pcp_server.process_pcp_request(
+      flow_mod_batcher, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(len(datapath.sent_buffers), 1)
+    
+    message_types = []
+    buf = datapath.sent_buffers[0]
+    offset = 0
+    while offset < len(buf):
+      unused_, message_type, message_length = struct.unpack_from("!BBH", buf, offset)
+      message_types.append(message_type)
+      offset += message_length
+    
+    self.assertEqual(message_types, [ofproto_v1_3.OFPT_FLOW_MOD] * 2 +
+      [ofproto_v1_3.OFPT_PACKET_OUT, ofproto_v1_3.OFPT_BARRIER_REQUEST])
+  
+  def test_process_pcp_request_retransmitted_is_answered_from_cache(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    num_flow_mods = len(self._get_sent_flow_mods())
+    first_lifetime, first_epoch_time = self._get_last_pcp_response_lifetime_and_epoch_time()
+    
+    self.clock.time += 10
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(len(self._get_sent_flow_mods()), num_flow_mods)
+    self.assertEqual(len(self._get_sent_packet_outs()), 2)
+    self.assertEqual(self.pcp_server.response_cache.hits, 1)
+    self.assertEqual(self.pcp_server.response_cache.misses, 1)
+    
+    lifetime, epoch_time = self._get_last_pcp_response_lifetime_and_epoch_time()
+    self.assertEqual(lifetime, first_lifetime - 10)
+    self.assertEqual(epoch_time, first_epoch_time + 10)
+    
+    packet_outs = self._get_sent_packet_outs()
+    self.assertEqual(bytes(packet_outs[1].data)[:40], bytes(packet_outs[0].data)[:40])
+    self.assertEqual(bytes(packet_outs[1].data)[54:], bytes(packet_outs[0].data)[54:])
+  
+  def test_process_pcp_request_cached_per_forwarder(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    other_forwarder = _FakeForwarder(id_=2)
+    other_nat_handler = nathandler.NatHandler(other_forwarder, 2, [1, 2, 3], 4, clock=self.clock,
+      mapping_removal_callback=self.pcp_server.handle_mapping_removed)
+    self.pcp_server.process_pcp_request(
+      other_forwarder, self._build_pcp_request_packet(), 1, other_nat_handler)
+    
+    self.assertEqual(self.pcp_server.response_cache.hits, 0)
+    self.assertIsNotNone(other_nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+    
+    # Removing the mapping entry from one forwarder keeps the cached response
+    # of the other forwarder.
+    other_nat_handler.remove_mappings_by_internal_ip(self.pcp_client_ip)
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(self.pcp_server.response_cache.hits, 1)
+  
+  def test_process_pcp_request_after_cache_ttl_refreshes_mapping(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.clock.time += app_config['nat_flow_refresh_tolerance_seconds']
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(self.pcp_server.response_cache.hits, 0)
+    self.assertEqual(self.pcp_server.response_cache.misses, 2)
+    self.assertEqual(self._get_last_pcp_response_lifetime_and_epoch_time()[0], 300)
+  
+  def test_process_pcp_request_delete_invalidates_cache(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.pcp_request_fields['lifetime'] = 0
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    self.assertEqual(len(self.pcp_server.response_cache), 0)
+    
+    self.pcp_request_fields['lifetime'] = 300
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(self.pcp_server.response_cache.hits, 0)
+    self.assertIsNotNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+  
+  def test_process_pcp_request_retransmitted_after_flow_entry_expired(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    flow_mod = self._get_sent_flow_mods()[-1]
+    
+    self.clock.time += 10
+    self.assertTrue(self.nat_handler.handle_flow_removed(ofproto_v1_3_parser.OFPFlowRemoved(
+      self.forwarder, cookie=flow_mod.cookie, priority=flow_mod.priority,
+      reason=ofproto_v1_3.OFPRR_IDLE_TIMEOUT, table_id=flow_mod.table_id, match=flow_mod.match)))
+    self.assertEqual(len(self.pcp_server.response_cache), 0)
+    
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(self.pcp_server.response_cache.hits, 0)
+    self.assertIsNotNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+  
+  def test_process_pcp_request_retransmitted_after_mappings_removed_by_internal_ip(self):
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.nat_handler.remove_mappings_by_internal_ip(self.pcp_client_ip)
+    self.assertEqual(len(self.pcp_server.response_cache), 0)
+    
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertEqual(self.pcp_server.response_cache.hits, 0)
+    self.assertIsNotNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+  
+  def test_process_pcp_request_quota_exceeded(self):
+    self.nat_handler = nathandler.NatHandler(self.forwarder, 2, [1, 2, 3], 4, clock=self.clock,
+      mapping_quota=mappingquota.MappingQuota(default_quota=1, quota_overrides={}))
+    
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    self.pcp_request_fields['internal_port'] = 1251
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1251, protocol=17))
+    
+    pcp_response_packet = packet.packet.Packet(bytes(self._get_sent_packet_outs()[-1].data))
+    self.assertEqual(struct.unpack_from("!BBxBL", pcp_response_packet[-1]), (
+      2, 0x80 | pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpResultCodes.USER_EX_QUOTA, 0))
+  
+  def test_process_pcp_request_flow_table_full(self):
+    self.nat_handler.request_flow_table_capacity()
+    reply = ofproto_v1_3_parser.OFPTableFeaturesStatsReply(self.forwarder, flags=0, body=[
+      ofproto_v1_3_parser.OFPTableFeaturesStats(table_id=table_id, max_entries=1)
+      for table_id in [1, 2, 3]])
+    reply.xid = self.forwarder.sent_messages[-1].xid
+    self.nat_handler.handle_table_features_reply(reply)
+    
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    self.pcp_request_fields['internal_port'] = 1251
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1251, protocol=17))
+    
+    pcp_response_packet = packet.packet.Packet(bytes(self._get_sent_packet_outs()[-1].data))
+    self.assertEqual(struct.unpack_from("!BBxBL", pcp_response_packet[-1]), (
+      2, 0x80 | pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpResultCodes.NO_RESOURCES, 0))
+  
+  def test_process_pcp_request_nat_pool_depleted(self):
+    self.nat_handler = nathandler.NatHandler(self.forwarder, 2, [1, 2, 3], 4, clock=self.clock,
+      nat_pool_config={
+        'external_ip_low_end': "200.0.0.2", 'external_ip_high_end': "200.0.0.2",
+        'external_port_low_end': 49152, 'external_port_high_end': 49152})
+    
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    self.pcp_request_fields['internal_port'] = 1251
+    self.pcp_server.process_pcp_request(
+      self.forwarder, self._build_pcp_request_packet(), 1, self.nat_handler)
+    
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1251, protocol=17))
+    
+    pcp_response_packet = packet.packet.Packet(bytes(self._get_sent_packet_outs()[-1].data))
+    self.assertEqual(struct.unpack_from("!BBxBL", pcp_response_packet[-1]), (
+      2, 0x80 | pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpResultCodes.NO_RESOURCES, 0))
+  
+  def test_reject_pcp_request(self):
+    num_flow_mods = len(self._get_sent_flow_mods())
+    
+    self.pcp_server.reject_pcp_request(self.forwarder, self._build_pcp_request_packet(), 1,
+                                       pcpmessage.PcpResultCodes.NO_RESOURCES)
+    
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+    self.assertEqual(len(self._get_sent_flow_mods()), num_flow_mods)
+    
+    pcp_response_packet = packet.packet.Packet(bytes(self._get_sent_packet_outs()[0].data))
+    self.assertEqual(struct.unpack_from("!BBxBL", pcp_response_packet[-1]), (
+      2, 0x80 | pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpResultCodes.NO_RESOURCES, 0))
+
+
+class TestLoadEpochStartTime(unittest.TestCase):
+  
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, "pcp_epoch")
+  
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+  
+  def test_load_epoch_start_time_continues_epoch(self):
+    self.assertEqual(pcpserver.load_epoch_start_time(self.path, clock=lambda: 1000.5), 1000.5)
+    self.assertEqual(pcpserver.load_epoch_start_time(self.path, clock=lambda: 2000.0), 1000.5)
+    
+    pcp_server = pcpserver.PcpServer(clock=lambda: 1100.5, start_time=1000.5)
+    self.assertEqual(pcp_server._calculate_epoch_time(), 100)
+  
+  def test_load_epoch_start_time_invalid_file(self):
+    with open(self.path, 'w') as epoch_file:
+      epoch_file.write("invalid")
+    
+    self.assertEqual(pcpserver.load_epoch_start_time(self.path, clock=lambda: 1000.0), 1000.0)
+
+
+class TestPcpResponseCache(unittest.TestCase):
+  
+  def setUp(self):
+    self.clock = _FakeClock()
+    self.cache = pcpserver.PcpResponseCache(max_size=2, ttl=60, clock=self.clock)
+    self.pcp_response_data = bytearray(24)
+  
+  def _get_key(self, internal_port, forwarder_id=1):
+    return (forwarder_id, "172.16.1.1", pcpmessage.PcpMessageOpcodes.MAP, "00" * 12,
+            internal_port, 17, 300)
+  
+  def test_get_missing(self):
+    self.assertIsNone(self.cache.get(self._get_key(1250), 0))
+    self.assertEqual(self.cache.misses, 1)
+  
+  def test_get_patches_lifetime_and_epoch_time(self):
+    self.cache.put(self._get_key(1250), self.pcp_response_data, 300)
+    self.clock.time += 30
+    
+    pcp_response_data = self.cache.get(self._get_key(1250), 1234)
+    
+    self.assertEqual(pcp_response_data[4:12], bytearray(b"\x00\x00\x01\x0e\x00\x00\x04\xd2"))
+    self.assertEqual(self.pcp_response_data, bytearray(24))
+    self.assertEqual(self.cache.hits, 1)
+  
+  def test_get_expired(self):
+    self.cache.put(self._get_key(1250), self.pcp_response_data, 20)
+    self.clock.time += 20
+    
+    self.assertIsNone(self.cache.get(self._get_key(1250), 0))
+    self.assertEqual(len(self.cache), 0)
+  
+  def test_put_evicts_least_recently_used(self):
+    self.cache.put(self._get_key(1), self.pcp_response_data, 300)
+    self.cache.put(self._get_key(2), self.pcp_response_data, 300)
+    self.cache.get(self._get_key(1), 0)
+    self.cache.put(self._get_key(3), self.pcp_response_data, 300)
+    
+    self.assertIsNotNone(self.cache.get(self._get_key(1), 0))
+    self.assertIsNone(self.cache.get(self._get_key(2), 0))
+    self.assertIsNotNone(self.cache.get(self._get_key(3), 0))
+  
+  def test_invalidate(self):
+    self.cache.put(self._get_key(1), self.pcp_response_data, 300)
+    self.cache.put(self._get_key(2), self.pcp_response_data, 300)
+    
+    self.cache.invalidate(1, "172.16.1.1", 1, 17)
+    
+    self.assertEqual(len(self.cache), 1)
+    self.assertIsNone(self.cache.get(self._get_key(1), 0))
+  
+  def test_invalidate_keeps_other_forwarders(self):
+    self.cache.put(self._get_key(1), self.pcp_response_data, 300)
+    self.cache.put(self._get_key(1, forwarder_id=2), self.pcp_response_data, 300)
+    
+    self.cache.invalidate(1, "172.16.1.1", 1, 17)
+    
+    self.assertIsNone(self.cache.get(self._get_key(1), 0))
+    self.assertIsNotNone(self.cache.get(self._get_key(1, forwarder_id=2), 0))
@@ -0,0 +1,120 @@
+import socket
+import struct
+import unittest
+
+from .. import dphelper
+from ..nat import nathandler
+from ..pcp import pcpmessage
+from ..pcp import pcpserver
+from ..pcp import pcpudplistener
+
+from .test_dphelper import _FakeDatapath
+from .test_nathandler import _FakeForwarder
+
+#===============================================================================
+
+
+class TestPcpUdpListener(unittest.TestCase):
+  
+  def setUp(self):
+    self.forwarder = _FakeForwarder()
+    self.nat_handler = nathandler.NatHandler(self.forwarder, 2, [1, 2, 3], 4)
+    self.pcp_server = pcpserver.PcpServer()
+    
+    self.listener = pcpudplistener.PcpUdpListener(
+      self.pcp_server, lambda pcp_client_ip: self.nat_handlers.get(pcp_client_ip),
+      listening_address="127.0.0.1", listening_port=0)
+    
+    self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    self.client_socket.bind(("127.0.0.1", 0))
+    self.client_socket.settimeout(5)
+    
+    self.pcp_client_ip = "127.0.0.1"
+    self.nat_handlers = {self.pcp_client_ip: self.nat_handler}
+    self.pcp_request_fields = {
+      'version': 2,
+      'message_type': pcpmessage.PcpMessageTypes.REQUEST,
+      'opcode': pcpmessage.PcpMessageOpcodes.MAP,
+      'lifetime': 300,
+      'pcp_client_ip': self.pcp_client_ip,
+      'mapping_nonce': "0102030464ff8e110a090204",
+      'protocol': 17,
+      'internal_port': 1250,
+      'external_port': 0,
+      'external_ip': "::",
+    }
+  
+  def tearDown(self):
+    self.client_socket.close()
+    self.listener.close()
+  
+  def _send_pcp_request(self, padding_length=0):
+    pcp_request = pcpmessage.PcpMessage(**self.pcp_request_fields)
+    self.client_socket.sendto(
+      bytes(pcp_request.serialize()) + b"\x00" * padding_length, self.listener.listening_address)
+  
+  def test_handle_request(self):
+    self._send_pcp_request()
+    self.listener.handle_request()
+    
+    pcp_response_data, address = self.client_socket.recvfrom(1100)
+    
+    self.assertEqual(address, self.listener.listening_address)
+    self.assertEqual(len(pcp_response_data), 60)
+    self.assertEqual(struct.unpack_from("!BBxB", pcp_response_data), (
+      2, 0x80 | pcpmessage.PcpMessageOpcodes.MAP, pcpmessage.PcpResultCodes.SUCCESS))
+    
+    mapping = self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17)
+    self.assertIsNotNone(mapping)
+    self.assertEqual(pcpmessage.packed_str_to_ip_addr(pcp_response_data[44:60]),
+                     mapping['external_ip'])
+    self.assertTrue(self.forwarder.sent_messages)
+  
+  def test_handle_request_flushes_flow_mods(self):
+    datapath = _FakeDatapath()
+    flow_mod_batcher = dphelper.FlowModBatcher(datapath, 100, 60)
+    self.nat_handlers[self.pcp_client_ip] = nathandler.NatHandler(flow_mod_batcher, 2, [1, 2, 3], 4)
+    flow_mod_batcher.flush()
+    del datapath.sent_buffers[:]
+    
+    self._send_pcp_request()
+    self.listener.handle_request()
+    self.client_socket.recvfrom(1100)
+    
+    self.assertEqual(len(datapath.sent_buffers), 1)
+  
+  def test_handle_request_oversize(self):
+    self._send_pcp_request(padding_length=1104 - 60)
+    self.listener.handle_request()
+    
+    # The request is rejected as malformed rather than truncated.
+    self.client_socket.settimeout(0.1)
+    self.assertRaises(socket.timeout, self.client_socket.recvfrom, 1100)
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+  
+  def test_handle_request_address_mismatch(self):
+    self.pcp_request_fields['pcp_client_ip'] = "172.16.1.1"
+    self._send_pcp_request()
+    self.listener.handle_request()
+    
+    self.client_socket.settimeout(0.1)
+    self.assertRaises(socket.timeout, self.client_socket.recvfrom, 1100)
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+  
+  def test_handle_request_without_nat_handler(self):
+    del self.nat_handlers[self.pcp_client_ip]
+    self._send_pcp_request()
+    self.listener.handle_request()
+    
+    self.assertIsNone(self.nat_handler.find_mapping(self.pcp_client_ip, 1250, protocol=17))
+  
+  def test_serve_forever_survives_processing_error(self):
+    errors = [ValueError("invalid request"), SystemExit()]
+    
+    def handle_request():
+      raise errors.pop(0)
+    
+    self.listener.handle_request = handle_request
+    
+    self.assertRaises(SystemExit, self.listener.serve_forever)
+    self.assertEqual(errors, [])
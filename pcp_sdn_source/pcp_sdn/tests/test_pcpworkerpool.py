@@ -0,0 +1,67 @@
+import unittest
+
+from ryu.lib import hub
+
+from ..pcp import pcpworkerpool
+
+#===============================================================================
+
+
+class TestPcpWorkerPool(unittest.TestCase):
+  
+  def setUp(self):
+    self.processed_requests = []
+  
+  def tearDown(self):
+    self.pool.stop()
+  
+  def _process_request(self, pcp_client_ip, request_id):
+    self.processed_requests.append((pcp_client_ip, request_id))
+    # Yield to other workers in the middle of processing.
+    hub.sleep(0)
+  
+  def _wait_for_workers(self):
+    for unused_ in range(10):
+      hub.sleep(0)
+  
+  def test_submit_processes_requests_from_same_client_in_order(self):
+    self.pool = pcpworkerpool.PcpWorkerPool(num_workers=4, queue_max_size=16)
+    
+    for request_id in range(5):
+      for pcp_client_ip in ["172.16.1.1", "172.16.1.2", "172.16.1.3"]:
+        self.assertTrue(self.pool.submit(
+          pcp_client_ip, self._process_request, pcp_client_ip, request_id))
+    
+    self._wait_for_workers()
+    
+    self.assertEqual(len(self.processed_requests), 15)
+    for pcp_client_ip in ["172.16.1.1", "172.16.1.2", "172.16.1.3"]:
+      self.assertEqual(
+        [request_id for ip, request_id in self.processed_requests if ip == pcp_client_ip],
+        list(range(5)))
+  
+  def test_submit_rejects_request_if_queue_is_full(self):
+    self.pool = pcpworkerpool.PcpWorkerPool(num_workers=1, queue_max_size=2)
+    
+    self.assertTrue(self.pool.submit("172.16.1.1", self._process_request, "172.16.1.1", 0))
+    self.assertTrue(self.pool.submit("172.16.1.2", self._process_request, "172.16.1.2", 0))
+    self.assertFalse(self.pool.submit("172.16.1.3", self._process_request, "172.16.1.3", 0))
+    self.assertEqual(self.pool.num_rejected_requests, 1)
+    
+    self._wait_for_workers()
+    
+    self.assertEqual(len(self.processed_requests), 2)
+    self.assertTrue(self.pool.submit("172.16.1.3", self._process_request, "172.16.1.3", 0))
+  
+  def test_worker_continues_after_exception(self):
+    self.pool = pcpworkerpool.PcpWorkerPool(num_workers=1, queue_max_size=2)
+    
+    def _fail():
+      raise ValueError("failure")
+    
+    self.pool.submit("172.16.1.1", _fail)
+    self.pool.submit("172.16.1.1", self._process_request, "172.16.1.1", 0)
+    
+    self._wait_for_workers()
+    
+    self.assertEqual(self.processed_requests, [("172.16.1.1", 0)])
@@ -0,0 +1,87 @@
+import threading
+import unittest
+
+from ..nat import nattable
+from ..nat import shardednattable
+
+#===============================================================================
+
+
+class TestShardedNatTable(unittest.TestCase):
+  
+  _NAT_POOL_CONFIG = {
+    "internal_ip_low_end": "172.16.0.1",
+    "internal_ip_high_end": "172.16.255.254",
+    "internal_port_low_end": 1,
+    "internal_port_high_end": 65535,
+    "external_ip_low_end": "200.0.0.1",
+    "external_ip_high_end": "200.0.0.10",
+    "external_port_low_end": 49152,
+    "external_port_high_end": 65535,
+    "ip_allocation_type": nattable.NatTableAllocationType.ROUND_ROBIN,
+    "port_allocation_type": nattable.NatTableAllocationType.ROUND_ROBIN
+  }
+  
+  def setUp(self):
+    self.table = shardednattable.ShardedNatTable(4, **self._NAT_POOL_CONFIG)
+  
+  def test_add_entry_allocates_from_shard_partition(self):
+    # Partitions: 200.0.0.1-3, 200.0.0.4-6, 200.0.0.7-8, 200.0.0.9-10
+    # Internal IP addresses as integers modulo 4: 1, 2, 3, 0
+    expected_external_ips = ["200.0.0.4", "200.0.0.7", "200.0.0.9", "200.0.0.1"]
+    for i, expected_external_ip in enumerate(expected_external_ips):
+      entry = self.table.add_entry("172.16.1.{0}".format(i + 1), 2000, 3600)
+      self.assertEqual(entry.external_ip, expected_external_ip)
+  
+  def test_find_entry(self):
+    entry = self.table.add_entry("172.16.1.1", 2000, 3600)
+    
+    self.assertIs(self.table.find_entry("172.16.1.1", 2000), entry)
+    self.assertIs(self.table.find_entry_by_external(entry.external_ip, entry.external_port), entry)
+    self.assertIsNone(self.table.find_entry("172.16.1.1", 2001))
+    self.assertIsNone(self.table.find_entry_by_external("200.0.1.1", entry.external_port))
+  
+  def test_remove_entry_by_external(self):
+    entry = self.table.add_entry("172.16.1.1", 2000, 3600)
+    
+    self.table.remove_entry_by_external(entry.external_ip, entry.external_port)
+    
+    self.assertIsNone(self.table.find_entry("172.16.1.1", 2000))
+  
+  def test_remove_entries_by_external_ip(self):
+    entries = [self.table.add_entry("172.16.1.1", port, 3600) for port in [2000, 2001]]
+    self.table.add_entry("172.16.1.2", 2000, 3600)
+    
+    removed_entries = self.table.remove_entries_by_external_ip(entries[0].external_ip)
+    
+    self.assertEqual(set(removed_entries), set(entries))
+    self.assertEqual(len(self.table.get_all_entries()), 1)
+  
+  def test_remove_all_entries(self):
+    for i in range(8):
+      self.table.add_entry("172.16.1.{0}".format(i + 1), 2000, 3600)
+    
+    self.assertEqual(len(self.table.remove_all_entries()), 8)
+    self.assertEqual(self.table.get_all_entries(), [])
+  
+  def test_too_many_shards(self):
+    with self.assertRaises(ValueError):
+      shardednattable.ShardedNatTable(11, **self._NAT_POOL_CONFIG)
+  
+  def test_concurrent_writers(self):
+    def _add_entries(thread_index):
+      for i in range(200):
+        self.table.add_entry("172.16.{0}.{1}".format(thread_index, i % 100 + 1), 2000 + i // 100, 3600)
+    
+    threads = [threading.Thread(target=_add_entries, args=(thread_index,))
+               for thread_index in range(4)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    
+    entries = self.table.get_all_entries()
+    self.assertEqual(len(entries), 800)
+    self.assertEqual(len(set((entry.external_ip, entry.external_port) for entry in entries)), 800)
+    for entry in entries:
+      self.assertIs(self.table.find_entry_by_external(entry.external_ip, entry.external_port), entry)
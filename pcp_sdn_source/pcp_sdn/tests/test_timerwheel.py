@@ -0,0 +1,60 @@
+import unittest
+
+from .. import timerwheel
+
+#===============================================================================
+
+
+class TestTimerWheel(unittest.TestCase):
+  
+  def setUp(self):
+    self.timer_wheel = timerwheel.TimerWheel(0, tick_interval=1.0, slot_bits=4, num_levels=2)
+  
+  def test_advance_before_expiry(self):
+    self.timer_wheel.schedule(10, 'item')
+    
+    self.assertEqual(self.timer_wheel.advance(9.9), [])
+    self.assertEqual(len(self.timer_wheel), 1)
+  
+  def test_advance_after_expiry(self):
+    self.timer_wheel.schedule(10, 'item')
+    
+    self.assertEqual(self.timer_wheel.advance(10), ['item'])
+    self.assertEqual(len(self.timer_wheel), 0)
+  
+  def test_schedule_fractional_expiry_time_never_expires_early(self):
+    self.timer_wheel.schedule(10.5, 'item')
+    
+    self.assertEqual(self.timer_wheel.advance(10.6), [])
+    self.assertEqual(self.timer_wheel.advance(11), ['item'])
+  
+  def test_schedule_expiry_time_in_past(self):
+    self.timer_wheel.advance(5)
+    self.timer_wheel.schedule(2, 'item')
+    
+    self.assertEqual(self.timer_wheel.advance(6), ['item'])
+  
+  def test_advance_items_in_higher_levels_and_overflow(self):
+    # Level 0 covers 16 ticks, level 1 covers 256 ticks.
+    expiry_times = [1, 15, 16, 17, 100, 255, 256, 300, 1000, 5000]
+    for expiry_time in expiry_times:
+      self.timer_wheel.schedule(expiry_time, expiry_time)
+    
+    for time_ in range(1, 5001):
+      expired_items = self.timer_wheel.advance(time_)
+      expected_items = [time_] if time_ in expiry_times else []
+      self.assertEqual(expired_items, expected_items, msg="time: {0}".format(time_))
+    
+    self.assertEqual(len(self.timer_wheel), 0)
+  
+  def test_advance_many_items_large_time_step(self):
+    timer_wheel = timerwheel.TimerWheel(0)
+    num_items = 200000
+    for i in range(num_items):
+      timer_wheel.schedule(i % 100000 + 1, i)
+    
+    expired_items = timer_wheel.advance(50000)
+    self.assertEqual(len(expired_items), num_items // 2)
+    
+    expired_items.extend(timer_wheel.advance(100000))
+    self.assertEqual(sorted(expired_items), list(range(num_items)))
@@ -0,0 +1,120 @@
+"""
+This module implements a hierarchical timer wheel used to expire state (e.g.
+NAT mappings) on the controller.
+"""
+
+#===============================================================================
+
+import math
+
+#===============================================================================
+
+
+class TimerWheel(object):
+  
+  """
+  This class stores items scheduled to expire at a given time and returns them
+  once the time has passed.
+  
+  Time is divided into ticks of `tick_interval` seconds. The wheel consists of
+  `num_levels` levels of `2 ** slot_bits` slots each. A slot at level 0 covers
+  one tick, a slot at level N covers a full rotation of level N - 1. Items in a
+  higher level are moved (cascaded) to lower levels as time advances, hence
+  scheduling an item and expiring an item take O(1) time.
+  
+  Items scheduled beyond the range of the wheel are stored separately and
+  scheduled again once the top level completes a rotation.
+  """
+  
+  def __init__(self, start_time, tick_interval=1.0, slot_bits=8, num_levels=4):
+    self._tick_interval = tick_interval
+    self._slot_bits = slot_bits
+    self._slot_mask = (1 << slot_bits) - 1
+    self._num_levels = num_levels
+    
+    self._levels = [[[] for unused_ in range(1 << slot_bits)]
+                    for unused_ in range(num_levels)]
+    # Items scheduled beyond the range of the wheel
+    self._overflow = []
+    
+    self._current_tick = self._get_tick(start_time)
+    self._num_items = 0
+  
+  def __len__(self):
+    return self._num_items
+  
+  def schedule(self, expiry_time, item):
+    """
+    Schedule `item` to expire at `expiry_time` (in seconds).
+    
+    Items are never returned before `expiry_time`, but may be returned up to one
+    tick later. Items whose expiry time has already passed expire on the next
+    tick.
+    """
+    
+    expiry_tick = max(int(math.ceil(float(expiry_time) / self._tick_interval)),
+                      self._current_tick + 1)
+    self._insert(expiry_tick, item)
+    self._num_items += 1
+  
+  def advance(self, now):
+    """
+    Advance the wheel to the time `now` (in seconds) and return a list of items
+    that expired.
+    """
+    
+    target_tick = self._get_tick(now)
+    expired_items = []
+    
+    while self._current_tick < target_tick:
+      if self._num_items == 0:
+        self._current_tick = target_tick
+        break
+      
+      self._current_tick += 1
+      self._cascade()
+      
+      slot = self._levels[0][self._current_tick & self._slot_mask]
+      if slot:
+        expired_items.extend(item for unused_, item in slot)
+        self._num_items -= len(slot)
+        del slot[:]
+    
+    return expired_items
+  
+  def _get_tick(self, time_):
+    return int(time_ // self._tick_interval)
+  
+  def _insert(self, expiry_tick, item):
+    delta = expiry_tick - self._current_tick
+    
+    for level in range(self._num_levels):
+      if delta < 1 << (self._slot_bits * (level + 1)):
+        slot_index = (expiry_tick >> (self._slot_bits * level)) & self._slot_mask
+        self._levels[level][slot_index].append((expiry_tick, item))
+        return
+    
+    self._overflow.append((expiry_tick, item))
+  
+  def _cascade(self):
+    """
+    Move items from higher levels whose slot starts at the current tick to lower
+    levels.
+    """
+    
+    for level in range(1, self._num_levels):
+      if self._current_tick & ((1 << (self._slot_bits * level)) - 1):
+        return
+      
+      slot_index = (self._current_tick >> (self._slot_bits * level)) & self._slot_mask
+      slot = self._levels[level][slot_index]
+      items = list(slot)
+      del slot[:]
+      for expiry_tick, item in items:
+        self._insert(expiry_tick, item)
+    
+    if not self._current_tick & ((1 << (self._slot_bits * self._num_levels)) - 1):
+      items = self._overflow
+      self._overflow = []
+      for expiry_tick, item in items:
+        self._insert(expiry_tick, item)
@@ -4,10 +4,13 @@ This module is the entry point of the "PCP over SDN" network application.
 
 #===============================================================================
 
+import os
+
 from ryu.base import app_manager
 from ryu.lib import packet
 from ryu.controller import ofp_event
 from ryu.controller import handler
+from ryu.lib import hub
 
 from pcp_sdn import app_config
 
@@ -15,13 +18,17 @@ app_config.init()
 
 from pcp_sdn import dphelper
 from pcp_sdn import arphandler
+from pcp_sdn import forwarderregistry
+from pcp_sdn import packetclassifier
 
 from pcp_sdn.pcp import pcpinstaller
-from pcp_sdn.pcp import pcpserver
 from pcp_sdn.pcp import pcpmessage
+from pcp_sdn.pcp import pcpserver
+from pcp_sdn.pcp import pcpudplistener
+from pcp_sdn.pcp import pcpworkerpool
 
 from pcp_sdn.nat import nathandler
-from pcp_sdn.nat import natinstaller
+from pcp_sdn.nat import natjournal
 
 #===============================================================================
 
@@ -54,21 +61,52 @@ class PcpSdnApp(app_manager.RyuApp):
     self.flow_tables['arp_forwarding'] = self.flow_tables['pcp_message_forwarding']
     self.flow_tables['mac_overwriting'] = self.flow_tables['pcp_message_forwarding']
     
-    self.pcp_server = pcpserver.PcpServer()
+    self._journal_dir = app_config.app_config['nat_journal_dir']
+    if self._journal_dir:
+      if not os.path.isdir(self._journal_dir):
+        os.makedirs(self._journal_dir)
+      # Keep the epoch continuous since the mapping entries are recovered.
+      self.pcp_server = pcpserver.PcpServer(start_time=pcpserver.load_epoch_start_time(
+        os.path.join(self._journal_dir, "pcp_epoch")))
+    else:
+      self.pcp_server = pcpserver.PcpServer()
+    self.pcp_worker_pool = pcpworkerpool.PcpWorkerPool()
     
-    self.nat_handler = None
-    self.arp_handler = None
+    self.forwarders = forwarderregistry.ForwarderRegistry()
     
     self._datapath_mac_addrs = set([])
+    
+    self._mapping_expiry_thread = hub.spawn(self._expire_mappings_periodically)
+    self._flow_mod_flush_thread = hub.spawn(self._flush_flow_mods_periodically)
+    if app_config.app_config['nat_reconciliation_interval_seconds'] > 0:
+      self._flow_reconciliation_thread = hub.spawn(self._reconcile_flow_entries_periodically)
+    
+    if app_config.app_config['pcp_udp_listener_enabled']:
+      self._pcp_client_forwarders = forwarderregistry.PcpClientForwarderMap()
+      self.pcp_udp_listener = pcpudplistener.PcpUdpListener(
+        self.pcp_server, self._get_nat_handler_for_pcp_client)
+      self._pcp_udp_listener_thread = hub.spawn(self.pcp_udp_listener.serve_forever)
   
   @handler.set_ev_cls(ofp_event.EventOFPSwitchFeatures, handler.CONFIG_DISPATCHER)
   def switch_features_handler(self, ev):
     datapath = ev.msg.datapath
     
+    try:
+      nat_pool_config = self.forwarders.get_nat_pool_config(datapath.id)
+    except forwarderregistry.ForwarderRegistryFullError as e:
+      self.logger.error("Forwarder {0:016x} refused: {1}".format(datapath.id, e))
+      return
+    
     self._datapath_mac_addrs.add(dphelper.get_mac_addr_from_datapath(datapath))
     
-    dphelper.clear_datapath(datapath)
+    forwarder_context = self.forwarders.get(datapath.id)
+    
+    if forwarder_context is None and not self._journal_dir:
+      # No mapping entries are known, hence no flow entries are worth keeping.
+      dphelper.clear_datapath(datapath)
     
+    # Flow entries of the pipeline are added again. Existing identical flow
+    # entries are replaced, so the forwarder keeps forwarding packets.
     self._install_arp_forwarding(datapath,
       in_ports=[self._PORTS['access'], self._PORTS['external']],
       table_id=self.flow_tables['arp_forwarding'])
@@ -77,24 +115,93 @@ class PcpSdnApp(app_manager.RyuApp):
       self.flow_tables['pcp_message_forwarding'], self.flow_tables['nat_port_match'],
       priority=self._PCP_FORWARDING_PRIORITY)
     
-    self.nat_handler = nathandler.NatHandler(datapath, self._PORTS['external'],
-      [self.flow_tables['nat_port_match'], self.flow_tables['nat_internal_to_external'],
-       self.flow_tables['nat_external_to_internal']],
-      self.flow_tables['packet_forwarding'])
+    flow_mod_batcher = dphelper.FlowModBatcher(datapath,
+      app_config.app_config['flow_mod_batch_max_size'],
+      app_config.app_config['flow_mod_batch_flush_interval_seconds'])
     
-    self.arp_handler = arphandler.ArpHandler(self.flow_tables['mac_overwriting'],
-                                             self.flow_tables['nat_port_match'])
+    if forwarder_context is None:
+      if self._journal_dir:
+        journal = natjournal.NatJournal(
+          os.path.join(self._journal_dir, "nat_{0:016x}".format(datapath.id)))
+      else:
+        journal = None
+      
+      nat_handler = nathandler.NatHandler(flow_mod_batcher, self._PORTS['external'],
+        [self.flow_tables['nat_port_match'], self.flow_tables['nat_internal_to_external'],
+         self.flow_tables['nat_external_to_internal']],
+        self.flow_tables['packet_forwarding'],
+        nat_pool_config=nat_pool_config,
+        journal=journal,
+        mapping_removal_callback=self.pcp_server.handle_mapping_removed)
+      # Keep flow entries of mapping entries still valid after a restart and
+      # install only the missing ones.
+      if self._journal_dir:
+        nat_handler.recover_mappings(install_flow_entries=False)
+        nat_handler.reconcile_flow_entries()
+      
+      nat_handler.request_flow_table_capacity()
+      
+      arp_handler = arphandler.ArpHandler(self.flow_tables['mac_overwriting'],
+                                          self.flow_tables['nat_port_match'])
+      
+      self.forwarders.add(forwarderregistry.ForwarderContext(
+        datapath.id, flow_mod_batcher, nat_handler, arp_handler))
+      
+      self.logger.info("Forwarder {0:016x} connected".format(datapath.id))
+    else:
+      # Keep the mapping entries of the reconnected forwarder and reconcile its
+      # NAT flow entries with them.
+      forwarder_context.flow_mod_batcher = flow_mod_batcher
+      forwarder_context.nat_handler.set_forwarder(flow_mod_batcher)
+      forwarder_context.nat_handler.request_flow_table_capacity()
+      
+      self.logger.info("Forwarder {0:016x} reconnected".format(datapath.id))
     
     self._install_simple_packet_forwarding(datapath, table_id=self.flow_tables['packet_forwarding'])
   
+  @handler.set_ev_cls(ofp_event.EventOFPStateChange, handler.DEAD_DISPATCHER)
+  def state_change_handler(self, ev):
+    datapath = ev.datapath
+    
+    forwarder_context = self.forwarders.get(datapath.id)
+    # The connection of a reconnected forwarder may be closed after the new
+    # connection is established.
+    if forwarder_context is None or forwarder_context.flow_mod_batcher.datapath is not datapath:
+      return
+    
+    # Keep the context in case the forwarder reconnects, but let another
+    # forwarder take over the NAT pool partition if needed.
+    self.forwarders.release(datapath.id)
+    
+    self.logger.info("Forwarder {0:016x} disconnected".format(datapath.id))
+  
   @handler.set_ev_cls(ofp_event.EventOFPPacketIn, handler.MAIN_DISPATCHER)
   def packet_in_handler(self, ev):
-    packet_ = packet.packet.Packet(ev.msg.data)
+    forwarder_context = self.forwarders.get(ev.msg.datapath.id)
+    if forwarder_context is None:
+      return
     
-    if pcpmessage.is_pcp(packet_):
-      self.pcp_server.process_pcp_request(ev.msg.datapath, packet_, self._PORTS['access'], self.nat_handler)
+    # Drop packets other than PCP and ARP messages without parsing them.
+    packet_class = packetclassifier.classify(ev.msg.data)
+    if packet_class == packetclassifier.PacketClass.OTHER:
+      return
     
-    if arphandler.is_arp(packet_):
+    packet_ = packet.packet.Packet(ev.msg.data)
+    
+    if packet_class == packetclassifier.PacketClass.PCP:
+      # Process PCP requests in worker threads so that a burst of PCP requests
+      # does not block processing of other events.
+      pcp_client_ip = packet_.get_protocol(packet.ipv4.ipv4).src
+      # The PCP response is sent through the flow modification batcher, after
+      # the flow entries of the mapping entry.
+      is_submitted = self.pcp_worker_pool.submit(pcp_client_ip,
+        self.pcp_server.process_pcp_request, forwarder_context.flow_mod_batcher, packet_,
+        self._PORTS['access'], forwarder_context.nat_handler)
+      
+      if not is_submitted:
+        self.pcp_server.reject_pcp_request(ev.msg.datapath, packet_, self._PORTS['access'],
+                                           pcpmessage.PcpResultCodes.NO_RESOURCES)
+    elif packet_class == packetclassifier.PacketClass.ARP:
       # FIXME: This limits ARP processing to two ports on one forwarder.
       in_port = ev.msg.match['in_port']
       if in_port == self._PORTS['access']:
@@ -102,30 +209,103 @@ class PcpSdnApp(app_manager.RyuApp):
       else:
         out_port = self._PORTS['access']
       
-      self.arp_handler.process_arp(ev.msg.datapath, packet_, in_port, out_port)
+      forwarder_context.arp_handler.process_arp(ev.msg.datapath, packet_, in_port, out_port)
+  
+  @handler.set_ev_cls(ofp_event.EventOFPBarrierReply, handler.MAIN_DISPATCHER)
+  def barrier_reply_handler(self, ev):
+    forwarder_context = self.forwarders.get(ev.msg.datapath.id)
+    if forwarder_context is not None:
+      num_messages = forwarder_context.flow_mod_batcher.handle_barrier_reply(ev.msg.xid)
+      if num_messages is not None:
+        self.logger.debug("Batch of {0} messages completed (XID {1})".format(
+          num_messages, ev.msg.xid))
+        forwarder_context.nat_handler.handle_barrier_reply(ev.msg.xid)
+  
+  @handler.set_ev_cls(ofp_event.EventOFPErrorMsg, handler.MAIN_DISPATCHER)
+  def error_msg_handler(self, ev):
+    forwarder_context = self.forwarders.get(ev.msg.datapath.id)
+    if forwarder_context is not None:
+      forwarder_context.nat_handler.handle_error(ev.msg)
+  
+  @handler.set_ev_cls(ofp_event.EventOFPTableFeaturesStatsReply, handler.MAIN_DISPATCHER)
+  def table_features_reply_handler(self, ev):
+    forwarder_context = self.forwarders.get(ev.msg.datapath.id)
+    if forwarder_context is not None:
+      forwarder_context.nat_handler.handle_table_features_reply(ev.msg)
+  
+  @handler.set_ev_cls(ofp_event.EventOFPFlowStatsReply, handler.MAIN_DISPATCHER)
+  def flow_stats_reply_handler(self, ev):
+    forwarder_context = self.forwarders.get(ev.msg.datapath.id)
+    if forwarder_context is not None:
+      forwarder_context.nat_handler.handle_flow_stats_reply(ev.msg)
   
   @handler.set_ev_cls(ofp_event.EventOFPFlowRemoved, handler.MAIN_DISPATCHER)
   def flow_entry_removed_handler(self, ev):
-    msg = ev.msg
-    ofproto = msg.datapath.ofproto
-    match = ev.msg.match
-    
-    if msg.reason == ofproto.OFPRR_IDLE_TIMEOUT:
-      if msg.table_id == self.flow_tables['nat_internal_to_external']:
-        ip_src_name = natinstaller.MATCH_FIELD_NAME_MAPS['ip_src'][match['eth_type']]
-        port_src_name = natinstaller.MATCH_FIELD_NAME_MAPS['port_src'][match['ip_proto']]
-        
-        self.nat_handler.remove_mapping(match[ip_src_name], match[port_src_name],
-          nathandler.MappingRemovalType.FLOW_ENTRY_REMOVED_BY_FORWARDER)
-        
-        self.logger.info("Flow entry expired, removed mapping entry: {0}".format(match))
-      elif msg.table_id == self.flow_tables['nat_external_to_internal']:
-        # FIXME: Make it possible to remove mapping entries by specifying the
-        # external IP and port. For now, only the flow entry from the internal-
-        # -to-external table causes the mapping entry to be removed.
-        pass
-      else:
-        pass
+    forwarder_context = self.forwarders.get(ev.msg.datapath.id)
+    if forwarder_context is not None:
+      # Either NAT flow entry of a mapping entry may expire first.
+      forwarder_context.nat_handler.handle_flow_removed(ev.msg)
+  
+  def _get_nat_handler_for_pcp_client(self, pcp_client_ip):
+    """
+    Return the NAT handler processing PCP requests received directly over UDP
+    from the PCP client, or None if the PCP requests should be dropped.
+    """
+    
+    datapath_id = self._pcp_client_forwarders.get_datapath_id(pcp_client_ip)
+    
+    if datapath_id is None:
+      if app_config.app_config['nat_pool_partitions'] != 1:
+        return None
+      # At most one forwarder holds the only NAT pool partition at a time.
+      for forwarder_context in self.forwarders:
+        return forwarder_context.nat_handler
+      return None
+    
+    forwarder_context = self.forwarders.get(datapath_id)
+    if forwarder_context is None:
+      return None
+    
+    return forwarder_context.nat_handler
+  
+  def _expire_mappings_periodically(self):
+    """
+    Remove expired mapping entries on the controller, in case the forwarder does
+    not notify the controller about expired NAT flow entries.
+    """
+    
+    while True:
+      hub.sleep(app_config.app_config['mapping_expiry_check_interval_seconds'])
+      
+      for forwarder_context in self.forwarders:
+        forwarder_context.nat_handler.expire_mappings()
+        forwarder_context.nat_handler.compact_journal_if_due()
+  
+  def _flush_flow_mods_periodically(self):
+    """
+    Send batched NAT flow entry modifications that have been waiting for at
+    least the flush interval.
+    """
+    
+    while True:
+      hub.sleep(app_config.app_config['flow_mod_batch_flush_interval_seconds'])
+      
+      for forwarder_context in self.forwarders:
+        forwarder_context.flow_mod_batcher.flush_if_due()
+  
+  def _reconcile_flow_entries_periodically(self):
+    """
+    Walk NAT flow entries of the forwarders page by page and repair flow entries
+    that do not match the mapping entries. One page per forwarder is reconciled
+    per interval, hence reconciliation does not compete with processing of PCP
+    requests.
+    """
+    
+    while True:
+      hub.sleep(app_config.app_config['nat_reconciliation_interval_seconds'])
+      
+      for forwarder_context in self.forwarders:
+        forwarder_context.nat_handler.reconcile_next_flow_entry_page()
   
   def _install_simple_packet_forwarding(self, forwarder, table_id=0):
     """